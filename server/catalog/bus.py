@@ -0,0 +1,64 @@
+import logging
+import threading
+from typing import Dict
+
+from config import settings
+from database import SessionLocal
+from models import FeedCursor
+import coalesce
+import workers
+
+log = logging.getLogger("catalog.bus")
+
+# The feed consumer runs in one worker only (see workers.py) and forgets that worker's coalesced reads
+# after each page it applies. Every applied page also moves a row of feed_cursors, so the other workers
+# watch that table and forget theirs when it changes.
+ENABLED = workers.MULTI
+
+class CursorBus:
+    """Polls feed_cursors every `interval` seconds and drops coalesced reads once any cursor moved. Runs only when ENABLED."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.cursors: Dict[str, str] = {}
+        self.changes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cursor-bus", daemon=True)
+
+    def start(self) -> "CursorBus":
+        if ENABLED:
+            self.cursors = self._read()
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _read(self) -> Dict[str, str]:
+        with SessionLocal() as db:
+            return {row.source: row.cursor for row in db.query(FeedCursor).all()}
+
+    def poll(self) -> bool:
+        """True when a cursor moved since the last poll (and coalesced reads were dropped)."""
+        current = self._read()
+        if current == self.cursors:
+            return False
+        self.cursors = current
+        self.changes += 1
+        coalesce.reads.forget()
+        return True
+
+    def snapshot(self) -> dict:
+        return {"enabled": ENABLED, "cursors": self.cursors, "changes": self.changes}
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                log.warning("Cursor bus poll failed: %s", e)
+
+channel = CursorBus(settings.BUS_POLL_MS / 1000)
+
+def start() -> CursorBus:
+    return channel.start()
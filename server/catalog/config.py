@@ -0,0 +1,62 @@
+from typing import Dict
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+class Settings(BaseSettings):
+    PRODUCT_BASE_URL: str = "http://localhost:8002/products"
+    SUPPLIER_BASE_URL: str = "http://localhost:8001/suppliers"
+    CATEGORY_BASE_URL: str = "http://localhost:8003/categories"
+    IMAGE_BASE_URL: str = "http://localhost:8004/images"
+    DATABASE_URL: str = "sqlite:///./catalog.db"
+    LOG_LEVEL: str = "INFO"
+    HTTP_TIMEOUT: int = 5
+    HTTP_RETRIES: int = 2
+    HTTP_POOL_SIZE: int = 10           # keep-alive connections per peer host
+    HTTP_WARMUP_TIMEOUT: float = 1.0
+    BREAKER_FAILURES: int = 5          # consecutive peer failures before the circuit opens
+    BREAKER_RESET_SECONDS: int = 30    # open circuit lets one trial call through after this
+    DB_BUSY_TIMEOUT_MS: int = 5000
+    DB_WARM_CONNECTIONS: int = 4       # pooled connections opened during startup
+    READYZ_REQUIRE_PEERS: bool = False # when true, an open feed circuit fails /readyz
+    FEED_POLL_INTERVAL: float = 1.0   # seconds between polls once a feed is caught up
+    FEED_BATCH: int = 500             # change entries fetched per request
+    ADMISSION_MAX_CONCURRENCY: int = 32   # requests in flight across the service; 0 disables admission control
+    ADMISSION_QUEUE_SIZE: int = 64        # requests allowed to wait for a slot; beyond this they get 503
+    ADMISSION_QUEUE_TIMEOUT: float = 1.0  # seconds a queued request may wait (keep below the gateway timeout)
+    ADMISSION_RETRY_AFTER: int = 1        # Retry-After seconds on 503
+    COALESCE_READS: bool = True           # identical concurrent GETs share one query
+    COALESCE_WINDOW: float = 0.0          # seconds a finished read keeps serving new callers; 0 = in-flight only
+    COMPRESS_MIN_BYTES: int = 1024        # smaller responses go out uncompressed; negative disables compression
+    COMPRESS_GZIP_LEVEL: int = 6
+    COMPRESS_BROTLI_QUALITY: int = 4      # br is offered only when the `brotli` package is installed
+    WORKERS: int = 1                      # processes started by serve.py; > 1 elects one worker to consume the feeds
+    WORKER_LOCK_FILE: str = "./catalog.leader"   # flock held by the worker running the feed consumer
+    WORKER_LEADER_POLL: float = 5.0       # seconds between the other workers' attempts to take over
+    BUS_POLL_MS: float = 50.0             # WORKERS > 1: how often the other workers check feed_cursors for applied pages
+    SNAPSHOT_DIR: str = "./snapshots"     # <name>.db.gz + <name>.json manifest per snapshot
+    SNAPSHOT_TOKEN: str = ""              # POST /admin/snapshot needs X-Admin-Token equal to this; empty = endpoint off (CLI still works)
+    SNAPSHOT_STEP_PAGES: int = 1024       # pages copied per backup step; 0 = whole database in one step
+    SNAPSHOT_STEP_SLEEP_MS: float = 5.0   # pause between steps
+    SNAPSHOT_MAX_RESTARTS: int = 3        # copies restarted by concurrent writes before finishing in one step
+    SNAPSHOT_GZIP_LEVEL: int = 6
+    SNAPSHOT_KEEP: int = 7                # newest snapshots kept in SNAPSHOT_DIR; 0 keeps all
+    MAINTENANCE_ENABLED: bool = True      # background checkpoint / incremental vacuum / ANALYZE (SQLite, leading worker)
+    MAINTENANCE_TICK_SECONDS: float = 15.0  # how often the scheduler looks for due tasks and a quiet moment
+    MAINTENANCE_BUDGET_MS: float = 200.0  # longest one tick's work, or its wait for a lock, may take
+    MAINTENANCE_MAX_IN_FLIGHT: int = 0    # quiet = at most this many requests running ...
+    MAINTENANCE_MAX_RPS: float = 5.0      # ... and at most this many admitted per second since the last tick
+    MAINTENANCE_CHECKPOINT_SECONDS: int = 300   # WAL checkpoint (TRUNCATE) at most this often; 0 = never
+    MAINTENANCE_VACUUM_SECONDS: int = 3600      # incremental vacuum; 0 = never
+    MAINTENANCE_VACUUM_MIN_FREE: float = 0.05   # ... only once at least this share of the pages is free
+    MAINTENANCE_VACUUM_PAGES: int = 256         # pages returned per step (each step is one short write)
+    MAINTENANCE_ANALYZE_SECONDS: int = 3600     # ANALYZE + PRAGMA optimize; 0 = never
+    MAINTENANCE_ANALYSIS_LIMIT: int = 1000      # rows ANALYZE samples per index
+    PROFILE_TOKEN: str = ""               # requests whose X-Profile header equals this are profiled; empty = header ignored
+    PROFILE_SAMPLE_RATE: float = 0.0      # fraction of requests profiled at random; 0 with no token = profiling not installed
+    PROFILE_DIR: str = "./profiles"       # <id>.prof (pstats) and <id>.json (queries, plans, top functions) per request
+    PROFILE_SLOW_QUERY_MS: float = 50.0   # profiled statements at least this slow get EXPLAIN QUERY PLAN
+    PROFILE_MAX_QUERIES: int = 30         # profiled requests issuing more statements than this are flagged
+    ADMISSION_ROUTE_LIMITS: Dict[str, int] = {}   # per-route caps ("METHOD /template")
+
+    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
+
+settings = Settings()
@@ -0,0 +1,156 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from models import CatalogProduct, CatalogLink, RefCategory, RefSupplier, RefImage, FeedCursor
+import sparse
+
+LINK_KINDS = {"category": "category_ids", "supplier": "supplier_ids", "image": "image_ids"}
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# ---- Reads
+def get(db: Session, product_id: str, fields: Optional[Sequence[str]] = None) -> CatalogProduct:
+    """With `fields`, only those columns are loaded and a row tuple in that order is returned."""
+    if fields:
+        obj = db.query(*sparse.columns(CatalogProduct, fields)).filter(CatalogProduct.id == product_id).first()
+    else:
+        obj = db.get(CatalogProduct, product_id)
+    if not obj:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    return obj
+
+def list_products(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    category_id: Optional[str] = None,
+    supplier_id: Optional[str] = None,
+    q: Optional[str] = None,
+    min_price: Optional[Decimal] = None,
+    max_price: Optional[Decimal] = None,
+    fields: Optional[Sequence[str]] = None,
+) -> List[CatalogProduct]:
+    query = db.query(*sparse.columns(CatalogProduct, fields)) if fields else db.query(CatalogProduct)
+    for kind, ref_id in (("category", category_id), ("supplier", supplier_id)):
+        if ref_id:
+            linked = db.query(CatalogLink.product_id).filter(CatalogLink.kind == kind, CatalogLink.ref_id == ref_id)
+            query = query.filter(CatalogProduct.id.in_(linked))
+    if q:
+        query = query.filter(CatalogProduct.name.ilike(f"%{q}%"))
+    if min_price is not None:
+        query = query.filter(CatalogProduct.price >= min_price)
+    if max_price is not None:
+        query = query.filter(CatalogProduct.price <= max_price)
+    return query.order_by(CatalogProduct.name, CatalogProduct.id).offset(skip).limit(limit).all()
+
+def cursors(db: Session) -> List[FeedCursor]:
+    return db.query(FeedCursor).order_by(FeedCursor.source).all()
+
+def get_cursor(db: Session, source: str) -> str:
+    row = db.get(FeedCursor, source)
+    return row.cursor if row else "0"
+
+def set_cursor(db: Session, source: str, cursor) -> None:
+    row = db.get(FeedCursor, source)
+    if row is None:
+        db.add(FeedCursor(source=source, cursor=str(cursor), updated_at=_now()))
+    else:
+        row.cursor, row.updated_at = str(cursor), _now()
+
+# ---- Rendering
+def _render(db: Session, docs: Iterable[CatalogProduct]) -> None:
+    """Fill the denormalized fields of `docs` from the local peer copies (one query per kind)."""
+    docs = list(docs)
+    if not docs:
+        return
+    wanted = {kind: set() for kind in LINK_KINDS}
+    for doc in docs:
+        for kind, field in LINK_KINDS.items():
+            wanted[kind].update(getattr(doc, field) or [])
+    cats = {r.id: r for r in db.query(RefCategory).filter(RefCategory.id.in_(wanted["category"]))}
+    sups = {r.id: r for r in db.query(RefSupplier).filter(RefSupplier.id.in_(wanted["supplier"]))}
+    imgs = {r.id: r for r in db.query(RefImage).filter(RefImage.id.in_(wanted["image"]))}
+    for doc in docs:
+        doc.categories = [{"id": c.id, "name": c.name} for c in (cats.get(i) for i in doc.category_ids or []) if c]
+        doc.suppliers = [{"id": s.id, "name": s.name, "contact": s.contact} for s in (sups.get(i) for i in doc.supplier_ids or []) if s]
+        doc.images = [{"id": m.id, "url": m.url} for m in (imgs.get(i) for i in doc.image_ids or []) if m]
+        doc.updated_at = _now()
+
+def _rerender_linked(db: Session, kind: str, ref_id: str) -> None:
+    linked = db.query(CatalogLink.product_id).filter(CatalogLink.kind == kind, CatalogLink.ref_id == ref_id)
+    _render(db, db.query(CatalogProduct).filter(CatalogProduct.id.in_(linked)).all())
+
+# ---- Applying change-feed entries
+def _sync_links(db: Session, pid: str, wanted: set) -> None:
+    existing = {(l.kind, l.ref_id): l for l in db.query(CatalogLink).filter(CatalogLink.product_id == pid)}
+    for key, link in existing.items():
+        if key not in wanted:
+            db.delete(link)
+    db.add_all(CatalogLink(product_id=pid, kind=kind, ref_id=ref_id) for kind, ref_id in wanted - existing.keys())
+
+def apply_product(db: Session, entry: Dict) -> None:
+    pid = entry["id"]
+    db.flush()
+    data = entry.get("data")
+    doc = db.get(CatalogProduct, pid)
+    if entry["op"] == "delete" or data is None:
+        _sync_links(db, pid, set())
+        if doc is not None:
+            db.delete(doc)
+        return
+    if doc is None:
+        doc = CatalogProduct(id=pid)
+        db.add(doc)
+    doc.name = data["name"]
+    doc.description = data.get("description") or ""
+    doc.quantity = int(data["quantity"])
+    doc.price = Decimal(str(data["price"]))
+    wanted = set()
+    for kind, field in LINK_KINDS.items():
+        ids = list(dict.fromkeys(data.get(field) or []))
+        setattr(doc, field, ids)
+        wanted.update((kind, i) for i in ids)
+    _sync_links(db, pid, wanted)
+    _render(db, [doc])
+
+def _apply_ref(db: Session, model, kind: str, entry: Dict, fields: Iterable[str]) -> None:
+    ref_id = entry["id"]
+    row = db.get(model, ref_id)
+    data = entry.get("data")
+    if entry["op"] == "delete" or data is None:
+        if row is not None:
+            db.delete(row)
+    else:
+        if row is None:
+            row = model(id=ref_id)
+            db.add(row)
+        for f in fields:
+            setattr(row, f, str(data.get(f) or ""))
+    db.flush()
+    _rerender_linked(db, kind, ref_id)
+
+def apply_category(db: Session, entry: Dict) -> None:
+    _apply_ref(db, RefCategory, "category", entry, ("name",))
+
+def apply_supplier(db: Session, entry: Dict) -> None:
+    _apply_ref(db, RefSupplier, "supplier", entry, ("name", "contact"))
+
+def apply_image(db: Session, entry: Dict) -> None:
+    _apply_ref(db, RefImage, "image", entry, ("url",))
+
+def reset_source(db: Session, source: str) -> None:
+    """Drop everything learned from `source` before replaying its feed from the start."""
+    if source == "products":
+        db.query(CatalogLink).delete(synchronize_session=False)
+        db.query(CatalogProduct).delete(synchronize_session=False)
+    else:
+        model = {"categories": RefCategory, "suppliers": RefSupplier, "images": RefImage}[source]
+        db.query(model).delete(synchronize_session=False)
+        db.flush()
+        _render(db, db.query(CatalogProduct).all())
+    set_cursor(db, source, 0)
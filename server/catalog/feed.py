@@ -0,0 +1,200 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+from config import settings
+from database import SessionLocal
+import crud
+import coalesce
+
+log = logging.getLogger("catalog.feed")
+
+# Source service change feeds (GET {base}/changes?since=&limit=) and how to apply their entries.
+SOURCES: Dict[str, tuple] = {
+    "products": (lambda: settings.PRODUCT_BASE_URL, crud.apply_product),
+    "categories": (lambda: settings.CATEGORY_BASE_URL, crud.apply_category),
+    "suppliers": (lambda: settings.SUPPLIER_BASE_URL, crud.apply_supplier),
+    "images": (lambda: settings.IMAGE_BASE_URL, crud.apply_image),
+}
+
+_session = None
+_session_lock = threading.Lock()
+# Identical concurrent feed requests (same URL and cursor) share one HTTP call.
+_fetches = coalesce.SingleFlight(0)
+# Sources poll concurrently but apply one at a time, so a page never renders against a peer copy
+# that another source is changing underneath it.
+_apply_lock = threading.Lock()
+
+class FeedGone(Exception):
+    pass
+
+# ---- Peer circuit breakers
+class CircuitBreaker:
+    """
+    Closed until `threshold` consecutive failures (exceptions or 5xx), then open: calls are
+    skipped for `reset_after` seconds, after which one trial call decides (half-open).
+    """
+
+    def __init__(self, name: str, threshold: int, reset_after: float):
+        self.name, self.threshold, self.reset_after = name, threshold, reset_after
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            self._trial = False
+            if ok:
+                self.failures, self.opened_at = 0, None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold or self.opened_at is not None:
+                if self.opened_at is None:
+                    log.warning("Circuit to %s opened after %d failures", self.name, self.failures)
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "failures": self.failures}
+
+breakers: Dict[str, CircuitBreaker] = {
+    name: CircuitBreaker(name, settings.BREAKER_FAILURES, settings.BREAKER_RESET_SECONDS) for name in SOURCES
+}
+
+# ---- Shared HTTP pool
+def http():
+    """Keep-alive session shared by the feed threads; `requests` is only imported on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=len(SOURCES), pool_maxsize=settings.HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+def _reset_http() -> None:
+    # Keep-alive sockets of a forked parent are not ours; the child opens its own pool on first use.
+    global _session, _session_lock
+    _session, _session_lock = None, threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_http)
+
+def warm_peers() -> Dict[str, bool]:
+    """Open one pooled connection per source service (GET /livez) before the first poll."""
+    def ping(base: str) -> bool:
+        parts = urlsplit(base)
+        try:
+            http().get(f"{parts.scheme}://{parts.netloc}/livez", timeout=settings.HTTP_WARMUP_TIMEOUT)
+            return True
+        except Exception as e:
+            log.info("Peer warm-up %s failed: %s", base, e)
+            return False
+    with ThreadPoolExecutor(max_workers=len(SOURCES)) as pool:
+        return dict(zip(SOURCES, pool.map(ping, [base_url() for base_url, _ in SOURCES.values()])))
+
+def _fetch(source: str, base_url: str, cursor: str) -> Optional[dict]:
+    breaker = breakers[source]
+    if not breaker.allow():
+        return None
+    url = f"{base_url}/changes"
+    params = {"since": cursor, "limit": settings.FEED_BATCH}
+    try:
+        resp = _fetches.do(
+            (url, cursor, settings.FEED_BATCH),
+            lambda: http().get(url, params=params, timeout=settings.HTTP_TIMEOUT),
+        )
+    except Exception as e:
+        breaker.record(False)
+        log.warning("Feed exception GET %s: %s", url, e)
+        return None
+    breaker.record(resp.status_code < 500)
+    if resp.status_code == 410:
+        raise FeedGone(resp.text)
+    if resp.status_code >= 400:
+        log.warning("Feed GET %s -> %s %s", url, resp.status_code, resp.text)
+        return None
+    return resp.json()
+
+def poll_once(source: str) -> bool:
+    """Apply one page of `source`'s feed. Returns True if more entries are already waiting."""
+    base_url, apply = SOURCES[source]
+    db = SessionLocal()
+    try:
+        cursor = crud.get_cursor(db, source)
+        try:
+            page = _fetch(source, base_url(), cursor)
+        except FeedGone:
+            log.warning("Feed %s compacted past cursor %s; rebuilding from the start", source, cursor)
+            with _apply_lock:
+                crud.reset_source(db, source)
+                db.commit()
+            coalesce.reads.forget()
+            return True
+        if not page or not page["changes"]:
+            return False
+        with _apply_lock:
+            for entry in page["changes"]:
+                apply(db, entry)
+            crud.set_cursor(db, source, page["next"])
+            db.commit()
+        coalesce.reads.forget()
+        return bool(page.get("has_more"))
+    except Exception as e:
+        db.rollback()
+        log.warning("Feed %s apply failed: %s", source, e)
+        return False
+    finally:
+        db.close()
+
+class FeedConsumer:
+    """One daemon thread per source; each page is applied in a single transaction together with its cursor."""
+
+    def __init__(self, interval: float, poll: Callable[[str], bool] = poll_once):
+        self.interval = interval
+        self._poll = poll
+        self._stop = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._run, args=(source,), name=f"feed-{source}", daemon=True)
+            for source in SOURCES
+        ]
+
+    def start(self) -> "FeedConsumer":
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self, source: str) -> None:
+        while not self._stop.is_set():
+            if not self._poll(source):
+                self._stop.wait(self.interval)
+
+def start_consumer() -> FeedConsumer:
+    return FeedConsumer(settings.FEED_POLL_INTERVAL).start()
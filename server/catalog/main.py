@@ -0,0 +1,130 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import logging
+from contextlib import asynccontextmanager
+from decimal import Decimal
+from typing import Optional
+from fastapi import FastAPI, Depends, Query, status, Header, HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import engine, warm_pool
+from deps import get_db
+import bus
+import crud
+import feed
+import admission
+import coalesce
+import compression
+import profiling
+import snapshot
+import sparse
+import maintenance
+import probes
+import workers
+from schemas import CatalogProductOut, FeedStatusOut
+
+# Logging
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO))
+log = logging.getLogger("catalog.service")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema is managed by `python migrate.py`, run before the server starts.
+    warmup_started = time.perf_counter()
+    warm_pool(settings.DB_WARM_CONNECTIONS)
+    probes.require_schema()
+    feed.warm_peers()
+    leader = app.state.leader = workers.elect(lambda: [feed.start_consumer(), maintenance.start()])
+    cursor_bus = bus.start()
+    probes.startup.mark_ready(_IMPORT_STARTED, warmup_started)
+    yield
+    cursor_bus.stop()
+    leader.stop()
+
+app = FastAPI(
+    title="Catalog Service",
+    version="1.0.0",
+    description="Denormalized catalog read model kept in sync from the Product, Category, Supplier and Image change feeds.",
+    lifespan=lifespan,
+)
+profiling.install(app, [engine])
+app.add_middleware(admission.AdmissionMiddleware, router=app.router)
+app.add_middleware(compression.CompressionMiddleware)
+
+# ---- Health
+@app.get("/health")
+def health():
+    # File size, free-page share and the last maintenance runs (those run in the leading worker only).
+    return {"status": "ok", "service": "catalog", "version": "1.0.0", "maintenance": maintenance.scheduler.snapshot()}
+
+@app.get("/livez")
+async def livez():
+    # Served on the event loop: stays answerable even when the threadpool or database is saturated.
+    return {"status": "alive"}
+
+@app.get("/readyz")
+def readyz():
+    ok, body = probes.readiness()
+    return JSONResponse(body, status_code=status.HTTP_200_OK if ok else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+@app.get("/admission")
+async def admission_stats():
+    return admission.controller.snapshot()
+
+@app.get("/workers")
+async def worker_stats():
+    # Answers for whichever worker the connection landed on.
+    return {"worker": app.state.leader.snapshot(), "bus": bus.channel.snapshot()}
+
+@app.post("/admin/snapshot", status_code=status.HTTP_201_CREATED)
+def take_snapshot(x_admin_token: Optional[str] = Header(None)):
+    snapshot.authorize(x_admin_token)
+    try:
+        return snapshot.create()
+    except snapshot.SnapshotBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except snapshot.SnapshotError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+@app.get("/catalog/feeds", response_model=list[FeedStatusOut])
+def feed_status(db: Session = Depends(get_db)):
+    return crud.cursors(db)
+
+# ---- Reads
+@app.get("/catalog/products", response_model=list[CatalogProductOut])
+def list_catalog_products(
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    category_id: Optional[str] = None,
+    supplier_id: Optional[str] = None,
+    q: Optional[str] = None,
+    min_price: Optional[Decimal] = None,
+    max_price: Optional[Decimal] = None,
+    fields: Optional[str] = None,
+):
+    names = sparse.parse(fields, CatalogProductOut)
+    key = ("products", skip, limit, category_id, supplier_id, q, min_price, max_price, names)
+
+    def load(db: Session):
+        rows = crud.list_products(
+            db, skip=skip, limit=limit, category_id=category_id, supplier_id=supplier_id,
+            q=q, min_price=min_price, max_price=max_price, fields=names,
+        )
+        if names:
+            return sparse.dump_all(CatalogProductOut, names, rows)
+        return [CatalogProductOut.model_validate(p) for p in rows]
+    result = coalesce.read(key, load)
+    return JSONResponse(result) if names else result
+
+@app.get("/catalog/products/{product_id}", response_model=CatalogProductOut)
+def read_catalog_product(product_id: str, fields: Optional[str] = None):
+    names = sparse.parse(fields, CatalogProductOut)
+    if names:
+        return JSONResponse(coalesce.read(
+            ("product", product_id, names),
+            lambda db: sparse.dump(CatalogProductOut, names, crud.get(db, product_id, fields=names)),
+        ))
+    return coalesce.read(("product", product_id), lambda db: CatalogProductOut.model_validate(crud.get(db, product_id)))
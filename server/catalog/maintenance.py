@@ -0,0 +1,235 @@
+"""
+Database housekeeping, run in the background by the worker that leads (see workers.py):
+
+    python maintenance.py status     # file size, free pages, auto_vacuum mode
+    python maintenance.py run        # every task once, now, whatever the traffic
+    python maintenance.py vacuum     # full VACUUM, service stopped: defragments and enables incremental vacuum
+
+- checkpoint: PRAGMA wal_checkpoint(TRUNCATE) copies the WAL back into the database and resets it.
+  SQLite's own auto-checkpoint is PASSIVE and never shrinks the file.
+- vacuum: PRAGMA incremental_vacuum hands free pages back to the file system, MAINTENANCE_VACUUM_PAGES at a
+  time. Link churn rewriting the JSON id arrays, change log compaction and deletes leave those pages behind.
+- analyze: ANALYZE (sampling at most MAINTENANCE_ANALYSIS_LIMIT rows per index), then PRAGMA optimize,
+  keeps the query planner's statistics current.
+
+Each task is due every MAINTENANCE_<TASK>_SECONDS. It runs only in a quiet moment: at most
+MAINTENANCE_MAX_IN_FLIGHT requests running and at most MAINTENANCE_MAX_RPS admitted per second since the
+last tick. A tick's work stops after MAINTENANCE_BUDGET_MS, or as soon as a request comes in, and waits at
+most that long for a lock. Incremental vacuum needs auto_vacuum=INCREMENTAL: new databases get it
+(database.py), an existing file once `python maintenance.py vacuum` has run.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List
+
+from sqlalchemy.engine import Connection, Engine
+
+from config import settings
+from database import IS_SQLITE, engine
+import admission
+
+log = logging.getLogger("catalog.maintenance")
+
+ENABLED = IS_SQLITE and settings.MAINTENANCE_ENABLED
+AUTO_VACUUM = {0: "none", 1: "full", 2: "incremental"}
+
+@contextmanager
+def _connection(eng: Engine, wait_ms: float) -> Iterator[Connection]:
+    """A pooled connection that gives up on a lock after `wait_ms` instead of DB_BUSY_TIMEOUT_MS."""
+    with eng.connect() as conn:
+        conn.exec_driver_sql(f"PRAGMA busy_timeout={max(int(wait_ms), 1)}")
+        try:
+            yield conn
+        finally:
+            conn.exec_driver_sql(f"PRAGMA busy_timeout={settings.DB_BUSY_TIMEOUT_MS}")
+
+# ---- Tasks: each gets a connection, the monotonic deadline and a `busy()` check, and returns its result
+def checkpoint(conn: Connection, deadline: float, busy: Callable[[], bool]) -> dict:
+    blocked, wal_frames, copied = conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").one()
+    return {"blocked": bool(blocked), "wal_frames": wal_frames, "checkpointed": copied}
+
+def vacuum(conn: Connection, deadline: float, busy: Callable[[], bool]) -> dict:
+    mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+    free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    if AUTO_VACUUM.get(mode) != "incremental":
+        return {"free_pages": free, "skipped": f"auto_vacuum={AUTO_VACUUM.get(mode, mode)}"}
+    pages = conn.exec_driver_sql("PRAGMA page_count").scalar()
+    if not free or free < pages * settings.MAINTENANCE_VACUUM_MIN_FREE:
+        return {"free_pages": free, "freed_pages": 0}
+    freed = 0
+    while free and time.monotonic() < deadline and not busy():
+        step = min(free, settings.MAINTENANCE_VACUUM_PAGES)
+        # The pragma frees one page per sqlite3_step; executescript steps it to the end, execute() only once.
+        conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({step});")
+        freed += step
+        free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return {"free_pages": free, "freed_pages": freed}
+
+def analyze(conn: Connection, deadline: float, busy: Callable[[], bool]) -> dict:
+    conn.exec_driver_sql(f"PRAGMA analysis_limit={settings.MAINTENANCE_ANALYSIS_LIMIT}")
+    try:
+        conn.exec_driver_sql("ANALYZE")
+        conn.exec_driver_sql("PRAGMA optimize")
+    finally:
+        conn.exec_driver_sql("PRAGMA analysis_limit=0")
+    return {}
+
+TASKS: Dict[str, Callable[[Connection, float, Callable[[], bool]], dict]] = {
+    "checkpoint": checkpoint,
+    "vacuum": vacuum,
+    "analyze": analyze,
+}
+
+def file_stats(eng: Engine) -> dict:
+    path = eng.url.database
+    with eng.connect() as conn:
+        page_size, pages, free, mode = (
+            conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+            for name in ("page_size", "page_count", "freelist_count", "auto_vacuum")
+        )
+    size = lambda p: os.path.getsize(p) if p and os.path.exists(p) else None
+    return {
+        "path": path,
+        "size_bytes": size(path),
+        "wal_bytes": size(f"{path}-wal" if path else None),
+        "page_size": page_size,
+        "pages": pages,
+        "free_pages": free,
+        "fragmentation": round(free / pages, 4) if pages else 0.0,   # share of the file that is free pages
+        "auto_vacuum": AUTO_VACUUM.get(mode, mode),
+    }
+
+class Maintenance:
+    """Every `tick` seconds: run the due tasks on every database if traffic is quiet, within `budget` seconds."""
+
+    def __init__(self, engines: Dict[str, Engine], tick: float, budget: float):
+        self.engines, self.tick, self.budget = engines, tick, budget
+        self.every = {
+            "checkpoint": settings.MAINTENANCE_CHECKPOINT_SECONDS,
+            "vacuum": settings.MAINTENANCE_VACUUM_SECONDS,
+            "analyze": settings.MAINTENANCE_ANALYZE_SECONDS,
+        }
+        self.next_at = {task: 0.0 for task in TASKS}
+        self.last: Dict[str, dict] = {}
+        self.deferred: Counter = Counter()
+        self._admitted = (0, time.monotonic())
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+
+    def start(self) -> "Maintenance":
+        if ENABLED and self.tick > 0:
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    @staticmethod
+    def busy() -> bool:
+        return admission.controller.in_flight > settings.MAINTENANCE_MAX_IN_FLIGHT
+
+    def quiet(self) -> bool:
+        # Counters of the event loop's controller, read from this thread: plain ints, a stale value is harmless.
+        admitted, now = sum(list(admission.controller.admitted.values())), time.monotonic()
+        before, since = self._admitted
+        self._admitted = (admitted, now)
+        return not self.busy() and (admitted - before) / max(now - since, 1e-3) <= settings.MAINTENANCE_MAX_RPS
+
+    def due(self) -> List[str]:
+        now = time.monotonic()
+        return [task for task in TASKS if self.every[task] > 0 and now >= self.next_at[task]]
+
+    def run(self, tasks: List[str], force: bool = False) -> None:
+        deadline = time.monotonic() + self.budget if not force else float("inf")
+        busy = (lambda: False) if force else self.busy
+        for task in tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or busy():
+                self.deferred[task] += 1
+                continue
+            wait_ms = settings.DB_BUSY_TIMEOUT_MS if force else min(remaining, self.budget) * 1000
+            started, at = time.monotonic(), datetime.now(timezone.utc)
+            results, status, unfinished = {}, "ok", False
+            try:
+                for name, eng in self.engines.items():
+                    with _connection(eng, wait_ms) as conn:
+                        results[name] = TASKS[task](conn, deadline, busy)
+                # A vacuum cut short by the budget or by traffic comes back on the next quiet tick.
+                unfinished = any(r.get("freed_pages") and r.get("free_pages") for r in results.values())
+            except Exception as e:
+                status, results = "error", {"error": str(e)}
+                log.warning("Maintenance %s failed: %s", task, e)
+            self.next_at[task] = time.monotonic() + (self.tick if unfinished else self.every[task])
+            self.last[task] = {
+                "at": at.isoformat().replace("+00:00", "Z"),
+                "status": status,
+                "duration_ms": round((time.monotonic() - started) * 1000, 1),
+                "result": results,
+                "runs": self.last.get(task, {}).get("runs", 0) + 1,
+            }
+
+    def snapshot(self) -> dict:
+        if not IS_SQLITE:
+            return {"enabled": False}
+        return {
+            "enabled": ENABLED,
+            "running": self._thread.is_alive(),      # False in workers that do not lead
+            "files": {name: file_stats(eng) for name, eng in self.engines.items()},
+            "tasks": {
+                task: {"every_s": self.every[task], "deferred": self.deferred[task], **self.last.get(task, {})}
+                for task in TASKS
+            },
+        }
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.tick):
+            tasks = self.due()
+            if not tasks:
+                continue
+            if not self.quiet():
+                for task in tasks:
+                    self.deferred[task] += 1
+                continue
+            try:
+                self.run(tasks)
+            except Exception as e:
+                log.warning("Maintenance tick failed: %s", e)
+
+scheduler = Maintenance({"catalog": engine}, settings.MAINTENANCE_TICK_SECONDS, settings.MAINTENANCE_BUDGET_MS / 1000)
+
+def start() -> Maintenance:
+    return scheduler.start()
+
+def full_vacuum(eng: Engine) -> dict:
+    """VACUUM the whole file (blocks every other connection meanwhile), switching it to incremental auto-vacuum."""
+    before = file_stats(eng)
+    with eng.connect() as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+    return {"before": before, "after": file_stats(eng)}
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Maintenance of the catalog database.")
+    parser.add_argument("command", choices=["status", "run", "vacuum"])
+    args = parser.parse_args(argv)
+    if not IS_SQLITE:
+        sys.exit("error: maintenance applies to SQLite databases only")
+    if args.command == "run":
+        scheduler.run(list(TASKS), force=True)
+        print(json.dumps(scheduler.last, indent=1))
+    elif args.command == "vacuum":
+        print(json.dumps({name: full_vacuum(eng) for name, eng in scheduler.engines.items()}, indent=1))
+    else:
+        print(json.dumps({name: file_stats(eng) for name, eng in scheduler.engines.items()}, indent=1))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
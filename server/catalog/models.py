@@ -0,0 +1,57 @@
+from sqlalchemy import Column, String, Integer, Numeric, DateTime, Index
+from sqlalchemy.types import JSON
+from database import Base
+
+# Denormalized product document: the product row plus names/contacts/urls of what it links to.
+class CatalogProduct(Base):
+    __tablename__ = "catalog_products"
+
+    id = Column(String(36), primary_key=True)                   # product UUID
+    name = Column(String(2000), nullable=False, index=True)
+    description = Column(String(10000), nullable=False, default="")
+    quantity = Column(Integer, nullable=False)
+    price = Column(Numeric(18, 2), nullable=False, index=True)
+    category_ids = Column(JSON, nullable=False, default=list)
+    supplier_ids = Column(JSON, nullable=False, default=list)
+    image_ids = Column(JSON, nullable=False, default=list)
+    categories = Column(JSON, nullable=False, default=list)     # [{"id", "name"}]
+    suppliers = Column(JSON, nullable=False, default=list)      # [{"id", "name", "contact"}]
+    images = Column(JSON, nullable=False, default=list)         # [{"id", "url"}]
+    updated_at = Column(DateTime, nullable=False)
+
+# product -> category/supplier/image edges; drives list filters and re-rendering when a peer entity changes
+class CatalogLink(Base):
+    __tablename__ = "catalog_links"
+    __table_args__ = (Index("ix_catalog_links_ref", "kind", "ref_id"),)
+
+    product_id = Column(String(36), primary_key=True)
+    kind = Column(String(16), primary_key=True)                 # category|supplier|image
+    ref_id = Column(String(36), primary_key=True)
+
+# Local copies of peer entities, keyed by id
+class RefCategory(Base):
+    __tablename__ = "ref_categories"
+
+    id = Column(String(36), primary_key=True)
+    name = Column(String(2000), nullable=False)
+
+class RefSupplier(Base):
+    __tablename__ = "ref_suppliers"
+
+    id = Column(String(36), primary_key=True)
+    name = Column(String(2000), nullable=False)
+    contact = Column(String(320), nullable=False)
+
+class RefImage(Base):
+    __tablename__ = "ref_images"
+
+    id = Column(String(36), primary_key=True)
+    url = Column(String(2048), nullable=False)
+
+# Last applied change-feed position per source service
+class FeedCursor(Base):
+    __tablename__ = "feed_cursors"
+
+    source = Column(String(16), primary_key=True)               # products|categories|suppliers|images
+    cursor = Column(String(64), nullable=False, default="0")
+    updated_at = Column(DateTime, nullable=True)
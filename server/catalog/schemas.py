@@ -0,0 +1,42 @@
+from typing import List, Optional
+from datetime import datetime
+from decimal import Decimal
+from pydantic import BaseModel
+
+class CategoryRef(BaseModel):
+    id: str
+    name: str
+
+class SupplierRef(BaseModel):
+    id: str
+    name: str
+    contact: str
+
+class ImageRef(BaseModel):
+    id: str
+    url: str
+
+class CatalogProductOut(BaseModel):
+    id: str
+    name: str
+    description: str
+    quantity: int
+    price: Decimal
+    category_ids: List[str]
+    supplier_ids: List[str]
+    image_ids: List[str]
+    categories: List[CategoryRef]
+    suppliers: List[SupplierRef]
+    images: List[ImageRef]
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class FeedStatusOut(BaseModel):
+    source: str
+    cursor: str
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,32 @@
+"""
+Run the service, with one or more worker processes:
+
+    python serve.py                          # WORKERS from settings (default 1)
+    python serve.py --workers 4 --port 8005
+
+Use this instead of `uvicorn main:app --workers N`: every worker must know it is one of several
+(settings.WORKERS) to share its caches and coordination through the database (see workers.py, bus.py).
+Run `python migrate.py` first; workers only check the schema.
+"""
+import argparse
+import os
+import sys
+
+import uvicorn
+
+from config import settings
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8005)
+    parser.add_argument("--workers", type=int, default=settings.WORKERS)
+    args = parser.parse_args(argv)
+    workers = max(args.workers, 1)
+    # Workers are fresh interpreters (uvicorn spawns them) and read WORKERS from the environment, as this one did.
+    os.environ["WORKERS"] = str(workers)
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=workers, log_level=settings.LOG_LEVEL.lower())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Online snapshots of the catalog database, and restore from one:
+
+    python snapshot.py create [--dir DIR]                 # what POST /admin/snapshot does
+    python snapshot.py restore DIR/<name>.json [--force]
+
+A snapshot is copied with SQLite's backup API while the service keeps running, checked, gzipped and
+described by a manifest (<name>.json) that records the feed cursors it contains. Restore (service
+stopped) checks the manifest, unpacks the file over DATABASE_URL at disk speed and applies any newer
+migrations. The read model needs no separate catch-up: on start the feed consumer resumes every
+source from the restored cursors.
+"""
+import argparse
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from config import settings
+from database import engine
+import migrate
+
+log = logging.getLogger("catalog.snapshot")
+
+SERVICE = "catalog"
+CATCH_UP_PAGE = 5000
+_running = threading.Lock()
+
+class SnapshotError(Exception):
+    pass
+
+class SnapshotBusy(SnapshotError):
+    pass
+
+class _Restarted(Exception):
+    pass
+
+def _databases() -> List[Tuple[str, str]]:
+    """(shard, file) of every database the service writes."""
+    path = engine.url.database
+    if engine.url.get_backend_name() != "sqlite" or not path or path == ":memory:":
+        raise SnapshotError("Snapshots need a file-backed SQLite DATABASE_URL")
+    return [("0", path)]
+
+def authorize(token: Optional[str]) -> None:
+    if not settings.SNAPSHOT_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Snapshots over HTTP are off (SNAPSHOT_TOKEN is empty)")
+    if token is None or not hmac.compare_digest(token.encode(), settings.SNAPSHOT_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid X-Admin-Token")
+
+# ---- Create
+def _backup(src_path: str, dest_path: str) -> int:
+    """
+    Copy `src_path` to `dest_path` in steps of SNAPSHOT_STEP_PAGES pages, pausing between steps. A write
+    by another connection restarts the copy; after SNAPSHOT_MAX_RESTARTS it is finished in one step,
+    which under WAL only holds a read snapshot, so writers still carry on. Returns the restart count.
+    """
+    restarts, last = 0, None
+
+    def progress(_status: int, remaining: int, _total: int) -> None:
+        nonlocal restarts, last
+        if last is not None and remaining > last:
+            restarts += 1
+            if restarts > settings.SNAPSHOT_MAX_RESTARTS:
+                raise _Restarted()
+        last = remaining
+        if settings.SNAPSHOT_STEP_SLEEP_MS > 0:
+            time.sleep(settings.SNAPSHOT_STEP_SLEEP_MS / 1000)
+
+    src = sqlite3.connect(src_path, timeout=settings.DB_BUSY_TIMEOUT_MS / 1000)
+    try:
+        if settings.SNAPSHOT_STEP_PAGES > 0:
+            dest = sqlite3.connect(dest_path)
+            try:
+                src.backup(dest, pages=settings.SNAPSHOT_STEP_PAGES, progress=progress)
+                return restarts
+            except _Restarted:
+                log.info("Snapshot of %s restarted %d times under writes; finishing in one step", src_path, restarts - 1)
+            finally:
+                dest.close()
+        dest = sqlite3.connect(dest_path)
+        try:
+            src.backup(dest)
+        finally:
+            dest.close()
+        return restarts
+    finally:
+        src.close()
+
+def _position(path: str) -> dict:
+    """What the copy at `path` holds: the cursor of every feed and the schema version."""
+    conn = sqlite3.connect(path)
+    try:
+        check = conn.execute("PRAGMA quick_check").fetchone()[0]
+        cursors = dict(conn.execute("SELECT source, cursor FROM feed_cursors ORDER BY source").fetchall())
+        version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").fetchone()[0]
+    finally:
+        conn.close()
+    if check != "ok":
+        raise SnapshotError(f"Snapshot copy failed quick_check: {check}")
+    return {"cursors": cursors, "schema_version": version}
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _compress(src: str, dest: str) -> None:
+    with open(src, "rb") as raw, open(dest + ".tmp", "wb") as out:
+        with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=settings.SNAPSHOT_GZIP_LEVEL) as packed:
+            shutil.copyfileobj(raw, packed, 1 << 20)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(dest + ".tmp", dest)
+
+def _write_json(path: str, data: dict) -> None:
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+def _prune(directory: str) -> None:
+    if settings.SNAPSHOT_KEEP <= 0:
+        return
+    manifests = sorted(n for n in os.listdir(directory) if n.startswith(f"{SERVICE}-") and n.endswith(".json"))
+    for name in manifests[:-settings.SNAPSHOT_KEEP]:
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as f:
+                files = [entry["file"] for entry in json.load(f)["files"]]
+        except (OSError, ValueError, KeyError):
+            continue
+        for file in files + [name]:
+            try:
+                os.unlink(os.path.join(directory, file))
+            except FileNotFoundError:
+                pass
+
+def create(directory: Optional[str] = None) -> dict:
+    """Take a snapshot into `directory` (SNAPSHOT_DIR) and return its manifest. One at a time per process."""
+    directory = directory or settings.SNAPSHOT_DIR
+    if not _running.acquire(blocking=False):
+        raise SnapshotBusy("A snapshot is already running")
+    try:
+        started = time.perf_counter()
+        os.makedirs(directory, exist_ok=True)
+        name = f"{SERVICE}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%fZ}"
+        files = []
+        for shard, path in _databases():
+            raw = os.path.join(directory, f".{name}-{shard}.db")
+            try:
+                restarts = _backup(path, raw)
+                position = _position(raw)
+                file = f"{name}.db.gz"
+                _compress(raw, os.path.join(directory, file))
+                files.append({
+                    "shard": shard, "file": file, "sha256": _sha256(os.path.join(directory, file)),
+                    "bytes": os.path.getsize(os.path.join(directory, file)), "db_bytes": os.path.getsize(raw),
+                    "restarts": restarts, **position,
+                })
+            finally:
+                if os.path.exists(raw):
+                    os.unlink(raw)
+        manifest = {
+            "service": SERVICE,
+            "name": name,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "schema_version": min(f["schema_version"] for f in files),
+            "cursor": files[0]["cursors"],         # per source feed, as in GET /catalog/feeds
+            "files": files,
+            "took_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        _write_json(os.path.join(directory, name + ".json"), manifest)
+        _prune(directory)
+        log.info("Snapshot %s at cursors %s (%d bytes) in %.0f ms", name, manifest["cursor"], files[0]["bytes"], manifest["took_ms"])
+        return manifest
+    finally:
+        _running.release()
+
+# ---- Restore
+def restore(manifest_path: str, force: bool = False) -> dict:
+    """
+    Replace the database with the snapshot described by `manifest_path`. The service must be stopped.
+    Everything is checked (service, id storage, schema, checksums) before any file is touched.
+    """
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("service") != SERVICE:
+        raise SnapshotError(f"{manifest_path} is a {manifest.get('service')} snapshot, not {SERVICE}")
+    if manifest["schema_version"] > migrate.LATEST:
+        raise SnapshotError(f"Snapshot schema {manifest['schema_version']} is newer than this code ({migrate.LATEST})")
+    directory = os.path.dirname(os.path.abspath(manifest_path))
+    targets = dict(_databases())
+    if sorted(f["shard"] for f in manifest["files"]) != sorted(targets):
+        raise SnapshotError(f"Snapshot has shards {[f['shard'] for f in manifest['files']]}, this service {sorted(targets)}")
+    for f in manifest["files"]:
+        if _sha256(os.path.join(directory, f["file"])) != f["sha256"]:
+            raise SnapshotError(f"Checksum mismatch for {f['file']}")
+        target = targets[f["shard"]]
+        if not force and os.path.exists(target) and os.path.getsize(target) > 0:
+            raise SnapshotError(f"{target} exists; stop the service and pass --force to replace it")
+    engine.dispose()
+    for f in manifest["files"]:
+        target = targets[f["shard"]]
+        with gzip.open(os.path.join(directory, f["file"]), "rb") as packed, open(target + ".restoring", "wb") as out:
+            shutil.copyfileobj(packed, out, 1 << 20)
+            out.flush()
+            os.fsync(out.fileno())
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(target + suffix):
+                os.unlink(target + suffix)
+        os.replace(target + ".restoring", target)
+    applied = migrate.upgrade()
+    log.info("Restored %s (cursors %s); migrations applied: %s", manifest["name"], manifest["cursor"], applied or "none")
+    return {"restored": manifest["name"], "cursor": manifest["cursor"], "migrations": applied}
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Online snapshots and restore of the catalog database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    take = commands.add_parser("create")
+    take.add_argument("--dir", default=settings.SNAPSHOT_DIR)
+    back = commands.add_parser("restore")
+    back.add_argument("manifest")
+    back.add_argument("--force", action="store_true", help="replace an existing database file")
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "create":
+            print(json.dumps(create(args.dir), indent=1))
+        else:
+            print(json.dumps(restore(args.manifest, args.force)))
+    except SnapshotError as e:
+        sys.exit(f"error: {e}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,97 @@
+import json
+import uuid
+
+import pytest
+from sqlalchemy import event
+
+from config import settings
+from database import SessionLocal
+from models import CatalogLink, CatalogProduct
+import crud
+import feed
+
+class _Response:
+    def __init__(self, status_code, body):
+        self.status_code, self.body = status_code, body
+        self.text = json.dumps(body)
+
+    def json(self):
+        return self.body
+
+class _Session:
+    """Stands in for the feed's HTTP session: answers each GET with the next queued response."""
+
+    def __init__(self, *responses):
+        self.responses, self.calls = list(responses), []
+
+    def get(self, url, params=None, timeout=None):
+        self.calls.append((url, dict(params)))
+        return self.responses.pop(0)
+
+@pytest.fixture
+def peer(monkeypatch):
+    def install(*responses):
+        session = _Session(*responses)
+        monkeypatch.setattr(feed, "http", lambda: session)
+        return session
+    feed.breakers["products"].record(True)
+    return install
+
+@pytest.fixture
+def commits():
+    seen = []
+    listener = lambda session: seen.append(session)
+    event.listen(SessionLocal, "after_commit", listener)
+    yield seen
+    event.remove(SessionLocal, "after_commit", listener)
+
+def _product(seq, pid, name="widget", **data):
+    row = {"name": name, "description": "", "quantity": 1, "price": "2.50", "category_ids": [], "supplier_ids": [], "image_ids": []}
+    row.update(data)
+    return {"seq": seq, "op": "create", "id": pid, "data": row}
+
+def _page(changes, next_seq, has_more=False):
+    return _Response(200, {"changes": changes, "next": next_seq, "has_more": has_more})
+
+def test_page_and_cursor_commit_together(db, peer, commits):
+    a, b, cat = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+    session = peer(_page([_product(1, a, category_ids=[cat]), _product(2, b)], 2, has_more=True))
+
+    assert feed.poll_once("products") is True
+
+    assert session.calls == [(f"{settings.PRODUCT_BASE_URL}/changes", {"since": "0", "limit": settings.FEED_BATCH})]
+    assert len(commits) == 1
+    assert {p.id for p in db.query(CatalogProduct)} == {a, b}
+    assert [(l.kind, l.ref_id) for l in db.query(CatalogLink).filter(CatalogLink.product_id == a)] == [("category", cat)]
+    assert crud.get_cursor(db, "products") == "2"
+
+def test_failed_entry_leaves_read_model_and_cursor_untouched(db, peer, commits):
+    good, bad = _product(1, str(uuid.uuid4())), _product(2, str(uuid.uuid4()))
+    del bad["data"]["price"]
+    peer(_page([good, bad], 2))
+
+    assert feed.poll_once("products") is False
+
+    assert commits == []
+    assert db.query(CatalogProduct).count() == 0
+    assert crud.get_cursor(db, "products") == "0"
+
+def test_gone_cursor_rebuilds_from_the_start(db, peer):
+    old, new = str(uuid.uuid4()), str(uuid.uuid4())
+    peer(_page([_product(1, old)], 1))
+    feed.poll_once("products")
+    session = peer(
+        _Response(410, {"detail": "compacted"}),
+        _page([_product(9, new)], 9),
+    )
+
+    assert feed.poll_once("products") is True          # reset: poll again right away
+    db.expire_all()
+    assert db.query(CatalogProduct).count() == 0
+    assert crud.get_cursor(db, "products") == "0"
+
+    feed.poll_once("products")
+
+    assert [params["since"] for _, params in session.calls] == ["1", "0"]
+    assert [p.id for p in db.query(CatalogProduct)] == [new]
+    assert crud.get_cursor(db, "products") == "9"
@@ -0,0 +1,83 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from sqlalchemy.orm import Session
+
+log = logging.getLogger("category.batching")
+
+class _Batch:
+    __slots__ = ("ops", "after", "full", "done", "results", "error")
+
+    def __init__(self, after: Optional["_Batch"]):
+        self.ops: List[Any] = []
+        self.after = after                  # previous batch for the same row; must commit first
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results: List[Any] = []
+        self.error: Optional[BaseException] = None
+
+class GroupCommitter:
+    """
+    Group commit for writes that pile up on one row. Calls for the same key queue into a batch; the first
+    caller (the leader) waits for the previous batch of that key to commit, plus up to `window` seconds
+    or until `max_ops` calls have joined, then runs `apply(db, key, ops)` once on its own session. Every
+    caller gets its own entry of the returned list, or the exception `apply` raised.
+    With window 0 an idle row commits at once; only calls that arrive while a commit runs are batched.
+    Batches of one key run one after another, so concurrent read-modify-writes of the row cannot lose updates.
+    """
+
+    def __init__(self, apply: Callable[[Session, Hashable, List[Any]], List[Any]], window: float, max_ops: int):
+        self.apply, self.window, self.max_ops = apply, window, max_ops
+        self._lock = threading.Lock()
+        self._open: Dict[Hashable, _Batch] = {}    # batch still accepting calls, per key
+        self._tail: Dict[Hashable, _Batch] = {}    # newest batch per key, open or running
+
+    def submit(self, db: Session, key: Hashable, op: Any) -> Any:
+        return self.submit_many(db, key, [op])[0]
+
+    def submit_many(self, db: Session, key: Hashable, ops: List[Any]) -> List[Any]:
+        """Several calls from one caller: they join one batch together (it may exceed `max_ops`) and keep their order."""
+        if self.max_ops <= 0:
+            return self.apply(db, key, list(ops))
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = self._tail[key] = _Batch(self._tail.get(key))
+            start = len(batch.ops)
+            batch.ops.extend(ops)
+            if len(batch.ops) >= self.max_ops:
+                self._close(key, batch)
+        if leader:
+            self._lead(db, key, batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[start:start + len(ops)]
+
+    def _close(self, key: Hashable, batch: _Batch) -> None:
+        if self._open.get(key) is batch:
+            del self._open[key]
+        batch.full.set()
+
+    def _lead(self, db: Session, key: Hashable, batch: _Batch) -> None:
+        try:
+            if self.window > 0:
+                batch.full.wait(self.window)
+            if batch.after is not None:
+                batch.after.done.wait()
+            with self._lock:
+                self._close(key, batch)
+            batch.results = self.apply(db, key, batch.ops)
+            if len(batch.ops) > 1:
+                log.debug("Group commit on %s: %d calls in one transaction", key, len(batch.ops))
+        except BaseException as exc:
+            batch.error = exc
+        finally:
+            batch.after = None
+            with self._lock:
+                if self._tail.get(key) is batch:
+                    del self._tail[key]
+            batch.done.set()
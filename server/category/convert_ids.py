@@ -0,0 +1,85 @@
+"""
+Offline conversion of stored ids between text and binary form (ID_STORAGE). Stop the service first, then:
+
+    python convert_ids.py --to binary      # 36-char strings -> 16-byte blobs, id lists -> packed bytes
+    python convert_ids.py --to text        # and back
+    python convert_ids.py --to binary --no-vacuum
+
+Every UUIDBytes / UUIDList column of every table is rewritten in place in one transaction; values
+already in the target form are left alone, so a rerun is harmless.
+VACUUM afterwards returns the freed pages to the filesystem. Then set ID_STORAGE to match and start
+the service (it refuses to start while the two disagree).
+"""
+import argparse
+import json
+import logging
+import sys
+from typing import Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from config import settings
+from database import Base, engine
+from idtypes import UUIDBytes, UUIDList, from_bytes, pack, to_bytes, unpack
+import models  # noqa: F401  (registers tables on Base.metadata)
+
+BATCH = 5000
+
+def _id_columns() -> Dict[str, List[tuple]]:
+    out: Dict[str, List[tuple]] = {}
+    for table in Base.metadata.sorted_tables:
+        cols = [(c.name, isinstance(c.type, UUIDList)) for c in table.columns if isinstance(c.type, (UUIDBytes, UUIDList))]
+        if cols:
+            out[table.name] = cols
+    return out
+
+def _convert(value, is_list: bool, binary: bool):
+    if value is None:
+        return None
+    if binary:
+        if isinstance(value, bytes):
+            return value
+        return pack(json.loads(value)) if is_list else to_bytes(value)
+    if isinstance(value, str):
+        return value
+    return json.dumps(unpack(value)) if is_list else from_bytes(value)
+
+def convert(eng: Engine, binary: bool, vacuum: bool = True) -> Dict[str, int]:
+    """Rewrite the id columns of the database; returns rows changed per table."""
+    changed: Dict[str, int] = {}
+    with eng.begin() as conn:
+        for table, cols in _id_columns().items():
+            names = [name for name, _ in cols]
+            select_sql = text(f"SELECT rowid, {', '.join(names)} FROM {table} WHERE rowid > :after ORDER BY rowid LIMIT {BATCH}")
+            update_sql = f"UPDATE {table} SET {', '.join(f'{n} = ?' for n in names)} WHERE rowid = ?"
+            changed[table], after = 0, 0
+            while True:
+                rows = conn.execute(select_sql, {"after": after}).all()
+                if not rows:
+                    break
+                updates = []
+                for row in rows:
+                    new = [_convert(value, is_list, binary) for value, (_, is_list) in zip(row[1:], cols)]
+                    if new != list(row[1:]):
+                        updates.append((*new, row[0]))
+                if updates:
+                    conn.exec_driver_sql(update_sql, updates)
+                changed[table] += len(updates)
+                after = rows[-1][0]
+    if vacuum and eng.dialect.name == "sqlite":
+        with eng.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM")
+    return changed
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Convert stored ids between text and binary form (offline).")
+    parser.add_argument("--to", choices=("text", "binary"), default=settings.ID_STORAGE)
+    parser.add_argument("--no-vacuum", action="store_true")
+    args = parser.parse_args(argv)
+    changed = convert(engine, args.to == "binary", vacuum=not args.no_vacuum)
+    print(f"to={args.to} " + " ".join(f"{t}={n}" for t, n in changed.items()))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -1,49 +1,68 @@
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
-from typing import List, Optional
+from typing import Dict, List, Optional, Sequence, Tuple
 import uuid
 
+from config import settings
+from database import lock_for_write
 from models import Category
-from schemas import CategoryCreate, CategoryUpdate
+from schemas import CategoryBulkDelete, CategoryCreate, CategoryUpdate, UnlinkPair
+import batching
+import changes
+import idfilter
+import idtypes
+import jobs
+import sparse
+import tree
 
-def _validate_uuid(id_str: str) -> None:
-    try:
-        uuid.UUID(str(id_str))
-    except Exception:
+def _validate_uuid(id_str: str) -> str:
+    if not idtypes.is_uuid(id_str):
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID: {id_str}")
+    return idtypes.canonical(id_str)
 
 def _clean_ids(ids: Optional[List[str]]) -> Optional[List[str]]:
     if ids is None:
         return None
-    seen = set()
-    cleaned: List[str] = []
-    for pid in ids:
-        _validate_uuid(pid)
-        if pid not in seen:
-            seen.add(pid)
-            cleaned.append(pid)
-    return cleaned
-
-def get(db: Session, category_id: str) -> Category:
-    cat = db.query(Category).filter(Category.id == category_id).first()
+    bad = idtypes.first_invalid(ids)
+    if bad is not None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID: {bad}")
+    return list(dict.fromkeys(idtypes.canonical(s) for s in ids))
+
+def _parent(db: Session, parent_id: Optional[str]) -> Optional[str]:
+    if parent_id is None:
+        return None
+    parent_id = _validate_uuid(parent_id)
+    if db.get(Category, parent_id) is None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Parent category not found: {parent_id}")
+    return parent_id
+
+def get(db: Session, category_id: str, fields: Optional[Sequence[str]] = None) -> Category:
+    """With `fields`, only those columns are loaded and a row tuple in that order is returned."""
+    query = db.query(*sparse.columns(Category, fields)) if fields else db.query(Category)
+    cat = query.filter(Category.id == category_id).first()
     if not cat:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
     return cat
 
-def list_all(db: Session, skip: int = 0, limit: int = 100) -> List[Category]:
-    return db.query(Category).offset(skip).limit(limit).all()
+def list_all(db: Session, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None) -> List[Category]:
+    query = db.query(*sparse.columns(Category, fields)) if fields else db.query(Category)
+    return query.offset(skip).limit(limit).all()
 
 def create(db: Session, payload: CategoryCreate) -> Category:
-    cat_id = payload.id or str(uuid.uuid4())
-    _validate_uuid(cat_id)
+    cat_id = _validate_uuid(payload.id or str(uuid.uuid4()))
     product_ids = _clean_ids(payload.product_ids) or []
+    idfilter.require("product", product_ids)
+    parent_id = _parent(db, payload.parent_id)
     obj = Category(
         id=cat_id,
         name=payload.name,
         description=payload.description or "",
         product_ids=product_ids,
+        parent_id=parent_id,
     )
     db.add(obj)
+    tree.attach(db, cat_id, parent_id)
+    changes.record(db, "create", obj)
     db.commit()
     db.refresh(obj)
     return obj
@@ -55,30 +74,127 @@ def update(db: Session, category_id: str, payload: CategoryUpdate) -> Category:
     if payload.description is not None:
         cat.description = payload.description
     if payload.product_ids is not None:
-        cat.product_ids = _clean_ids(payload.product_ids) or []
+        product_ids = _clean_ids(payload.product_ids) or []
+        # Only new links are checked: existing ones stay even if the peer has dropped the id since.
+        idfilter.require("product", [i for i in product_ids if i not in (cat.product_ids or [])])
+        cat.product_ids = product_ids
+    # An explicit null moves the category to the top level; leaving parent_id out keeps it where it is.
+    if "parent_id" in payload.model_fields_set:
+        parent_id = _parent(db, payload.parent_id)
+        if parent_id != cat.parent_id:
+            if parent_id is not None and tree.contains(db, cat.id, parent_id):
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="Cannot move a category under itself or one of its descendants",
+                )
+            tree.move(db, cat.id, parent_id)
+            cat.parent_id = parent_id
+    changes.record(db, "update", cat)
     db.commit()
     db.refresh(cat)
     return cat
 
-def delete(db: Session, category_id: str) -> None:
-    cat = get(db, category_id)
-    db.delete(cat)
+def delete(db: Session, category_id: str) -> Optional[jobs.Job]:
+    return delete_many(db, [get(db, category_id)])
+
+def select_for_delete(db: Session, payload: CategoryBulkDelete) -> Tuple[List[Category], List[str]]:
+    """The categories a bulk delete names (ids) or matches (filter), and the named ids that do not exist."""
+    if (payload.ids is None) == (payload.product_id is None):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Give either ids or a filter (product_id)")
+    if payload.ids is not None:
+        ids = _clean_ids(payload.ids)
+        if len(ids) > settings.BULK_DELETE_MAX_ROWS:
+            raise _too_many(len(ids))
+        cats = db.query(Category).filter(Category.id.in_(ids)).all() if ids else []
+        found = {cat.id for cat in cats}
+        return cats, [cid for cid in ids if cid not in found]
+    product_id = _validate_uuid(payload.product_id)
+    cats = [cat for cat in db.query(Category).all() if product_id in (cat.product_ids or [])]
+    if len(cats) > settings.BULK_DELETE_MAX_ROWS:
+        raise _too_many(len(cats))
+    return cats, []
+
+def _too_many(n: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail=f"{n} categories selected, a bulk delete removes at most {settings.BULK_DELETE_MAX_ROWS}",
+    )
+
+def delete_many(db: Session, cats: List[Category]) -> Optional[jobs.Job]:
+    """
+    Delete `cats` in one transaction; each one's children move up to its parent. Their products are not
+    called here: one product unlink per link is queued as a background job, committed with the delete,
+    and sent in batches by jobs.runner. Returns that job (None when the categories had no products).
+    """
+    doomed = {cat.id for cat in cats}
+    tasks, moved = [], {}
+    for cat in cats:
+        for child in tree.detach(db, cat):
+            moved[child.id] = child
+        tasks += [("product", "categories", pid, cat.id) for pid in cat.product_ids or []]
+        changes.record(db, "delete", entity_id=cat.id)
+        db.delete(cat)
+        # The next detach looks children up by parent_id: it must see this one's re-parenting.
+        db.flush()
+    for child in moved.values():
+        if child.id not in doomed:
+            changes.record(db, "update", child)      # once, with the parent it ends up under
+    job = jobs.enqueue(db, "delete_cascade", tasks)
     db.commit()
+    if job is not None:
+        jobs.runner.wake()
+    return job
 
-def add_product(db: Session, category_id: str, product_id: str) -> Category:
-    _validate_uuid(product_id)
+def apply_links(db: Session, category_id: str, ops: List[Tuple[str, str]]) -> List[dict]:
+    """
+    Apply ("link" | "unlink", product_id) calls to one category in order, in one transaction, with one
+    write of product_ids. Each call still gets its own change entry and sees the row as it stood right
+    after its own change.
+    """
+    lock_for_write(db)          # other worker processes batch their own calls to this row
     cat = get(db, category_id)
-    if product_id not in cat.product_ids:
-        cat.product_ids.append(product_id)
-        db.commit()
-        db.refresh(cat)
-    return cat
+    ids = dict.fromkeys(cat.product_ids or [])
+    results = []
+    for op, product_id in ops:
+        if (op == "link") == (product_id in ids):          # already linked / not linked: nothing to do
+            results.append(changes.snapshot(cat))
+            continue
+        if op == "link":
+            ids[product_id] = None
+        else:
+            del ids[product_id]
+        cat.product_ids = list(ids)
+        results.append(changes.record(db, op, cat, relation="products", ref_id=product_id).data)
+    db.commit()
+    return results
 
-def remove_product(db: Session, category_id: str, product_id: str) -> Category:
-    _validate_uuid(product_id)
-    cat = get(db, category_id)
-    if product_id in cat.product_ids:
-        cat.product_ids = [x for x in cat.product_ids if x != product_id]
-        db.commit()
-        db.refresh(cat)
-    return cat
+links = batching.GroupCommitter(apply_links, settings.GROUP_COMMIT_WINDOW_MS / 1000, settings.GROUP_COMMIT_MAX_OPS)
+
+def add_product(db: Session, category_id: str, product_id: str) -> dict:
+    return links.submit(db, idtypes.canonical(category_id), ("link", _validate_uuid(product_id)))
+
+def remove_product(db: Session, category_id: str, product_id: str) -> dict:
+    return links.submit(db, idtypes.canonical(category_id), ("unlink", _validate_uuid(product_id)))
+
+def bulk_unlink(db: Session, pairs: List[UnlinkPair]) -> int:
+    """
+    Drop each pair's product from its category (sent by Product's delete cascade jobs). The pairs of one
+    category go through `links` together; unknown categories and links already gone are no-ops, so a
+    retried batch is harmless. Returns how many pairs named an existing category.
+    """
+    bad = idtypes.first_invalid([p.id for p in pairs] + [p.ref_id for p in pairs])
+    if bad is not None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID: {bad}")
+    ops: Dict[str, List[Tuple[str, str]]] = {}
+    for p in pairs:
+        ops.setdefault(idtypes.canonical(p.id), []).append(("unlink", idtypes.canonical(p.ref_id)))
+    applied = 0
+    for category_id, category_ops in ops.items():
+        try:
+            links.submit_many(db, category_id, category_ops)
+        except HTTPException as e:
+            if e.status_code != status.HTTP_404_NOT_FOUND:
+                raise
+            continue
+        applied += len(category_ops)
+    return applied
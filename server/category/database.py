@@ -1,12 +1,57 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+import os
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session, sessionmaker, DeclarativeBase
 from config import settings
 
 class Base(DeclarativeBase):
     pass
 
+IS_SQLITE = settings.DATABASE_URL.startswith("sqlite")
+
 engine = create_engine(
     settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if settings.DATABASE_URL.startswith("sqlite") else {},
+    connect_args={"check_same_thread": False} if IS_SQLITE else {},
+    pool_pre_ping=not IS_SQLITE,
 )
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        # WAL lets readers run alongside the single writer; busy_timeout waits instead of failing fast.
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA auto_vacuum=INCREMENTAL")   # takes on a new file; see maintenance.py for older ones
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={settings.DB_BUSY_TIMEOUT_MS}")
+        cur.close()
+
+# A forked worker must not share the parent's pooled connections (serve.py spawns fresh workers, but a
+# pre-forking server would copy the pool). Only the child's references are dropped; the parent keeps its own.
+os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+def lock_for_write(db: Session) -> None:
+    """
+    Start `db`'s transaction with SQLite's write lock when several worker processes share the database,
+    so a read-modify-write cannot interleave with another process's (BEGIN IMMEDIATE). In one process
+    the callers already serialize such writes themselves.
+    """
+    if not IS_SQLITE or settings.WORKERS <= 1:
+        return
+    conn = db.connection()
+    if not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+def warm_pool(size: int) -> int:
+    """Open up to `size` pooled connections now so the first requests don't pay for connect + pragmas."""
+    conns = []
+    try:
+        for _ in range(size):
+            conn = engine.connect()
+            conn.execute(text("SELECT 1"))
+            conns.append(conn)
+    finally:
+        for conn in conns:
+            conn.close()
+    return len(conns)
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+from typing import AsyncIterator, List, Optional, Set
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+from database import SessionLocal
+from models import ChangeLog
+import bus
+import changes
+
+log = logging.getLogger("category.events")
+
+# Snapshot fields that hold linked ids; used by the `related` stream filter.
+LINK_FIELDS = ("product_ids",)
+
+class Broker:
+    """
+    Fan-out of committed change entries to SSE connections in this process.
+    Publishers may call from any thread; all state is touched on the event loop only,
+    and idle connections cost one awaited Event each.
+    """
+
+    def __init__(self, backlog: int):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._recent: deque = deque(maxlen=backlog)
+        self._wakeup = asyncio.Event()
+        self.latest = 0
+        self.connections = 0
+        self._published = 0                   # newest seq handed to the loop
+        self._order = threading.Lock()
+
+    def bind(self, loop: asyncio.AbstractEventLoop, latest: int) -> None:
+        self._loop = loop
+        self.latest = latest
+        with self._order:
+            self._published = latest
+
+    def publish(self, entries: List[dict]) -> None:
+        """
+        Hand `entries` to the loop in seq order. Commits of concurrent requests report in whatever
+        order their threads get here: an entry above a gap first pulls the entries below it, committed
+        already (one writer at a time), from change_log, and those are skipped when they report.
+        """
+        if self._loop is None or not entries:
+            return
+        with self._order:
+            ordered = []
+            for e in sorted(entries, key=lambda e: e["seq"]):
+                if e["seq"] <= self._published:
+                    continue
+                if e["seq"] > self._published + 1:
+                    ordered += _committed(self._published, e["seq"], self._recent.maxlen)
+                ordered.append(e)
+                self._published = e["seq"]
+            if ordered:
+                self._loop.call_soon_threadsafe(self._dispatch, ordered)
+
+    def _dispatch(self, entries: List[dict]) -> None:
+        for e in entries:
+            if e["seq"] > self.latest:
+                self._recent.append(e)
+                self.latest = e["seq"]
+        wakeup, self._wakeup = self._wakeup, asyncio.Event()
+        wakeup.set()
+
+    def oldest(self) -> Optional[int]:
+        return self._recent[0]["seq"] if self._recent else None
+
+    def since(self, cursor: int) -> List[dict]:
+        return [e for e in self._recent if e["seq"] > cursor]
+
+    def waiter(self) -> asyncio.Event:
+        return self._wakeup
+
+def _committed(after: int, before: int, limit: int) -> List[dict]:
+    """The newest `limit` entries between seqs `after` and `before` (both excluded), oldest first."""
+    try:
+        with SessionLocal() as db:
+            rows = (
+                db.query(ChangeLog)
+                .filter(ChangeLog.seq > after, ChangeLog.seq < before)
+                .order_by(ChangeLog.seq.desc())
+                .limit(limit)
+                .all()
+            )
+    except Exception as e:
+        log.warning("Reading change entries %s..%s failed: %s", after, before, e)
+        return []
+    return [changes.entry_out(e) for e in reversed(rows)]
+
+broker = Broker(settings.SSE_BACKLOG)
+
+def _on_commit(entries: List[dict]) -> None:
+    broker.publish(entries)
+
+# Through the bus: with several workers, streams of this one carry the others' commits as well.
+bus.subscribe(_on_commit)
+
+class StreamFilter:
+    def __init__(self, ids: Optional[Set[str]], related: Optional[Set[str]], ops: Optional[Set[str]]):
+        self.ids, self.related, self.ops = ids, related, ops
+
+    def match(self, e: dict) -> bool:
+        if self.ops and e["op"] not in self.ops:
+            return False
+        if self.ids and e["id"] not in self.ids:
+            return False
+        if self.related:
+            if e.get("ref_id") in self.related:
+                return True
+            data = e.get("data") or {}
+            for field in LINK_FIELDS:
+                value = data.get(field)
+                linked = value if isinstance(value, list) else [value]
+                if self.related.intersection(x for x in linked if x):
+                    return True
+            return False
+        return True
+
+def _format(e: dict) -> str:
+    return f"id: {e['seq']}\nevent: {e['op']}\ndata: {json.dumps(e, separators=(',', ':'))}\n\n"
+
+def _backfill(cursor: int, limit: int) -> dict:
+    db = SessionLocal()
+    try:
+        return changes.read_since(db, cursor, limit)
+    finally:
+        db.close()
+
+async def stream(cursor: Optional[int], filt: StreamFilter) -> AsyncIterator[str]:
+    """SSE body: replay from `cursor` (Last-Event-ID) out of the change log, then follow live commits."""
+    if cursor is None:
+        cursor = broker.latest
+    broker.connections += 1
+    try:
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n"
+        while True:
+            latest, oldest = broker.latest, broker.oldest()
+            if cursor < latest and (oldest is None or oldest > cursor + 1):
+                # Fell behind the in-memory window: catch up from the database.
+                try:
+                    page = await run_in_threadpool(_backfill, cursor, settings.SSE_BACKFILL_PAGE)
+                except HTTPException:
+                    cursor = broker.latest
+                    yield f"event: reset\ndata: {json.dumps({'seq': cursor})}\n\n"
+                    continue
+                for e in page["changes"]:
+                    if filt.match(e):
+                        yield _format(e)
+                cursor = page["next"]
+                if not page["has_more"]:
+                    # Compaction can leave seq gaps; everything up to the window is now delivered.
+                    cursor = max(cursor, oldest - 1 if oldest is not None else latest)
+                continue
+
+            # Take the wakeup before yielding so commits that land mid-send are not missed.
+            wakeup = broker.waiter()
+            for e in broker.since(cursor):
+                cursor = e["seq"]
+                if filt.match(e):
+                    yield _format(e)
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=settings.SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+    finally:
+        broker.connections -= 1
+
+def _csv(value: Optional[str]) -> Optional[Set[str]]:
+    return {x.strip() for x in value.split(",") if x.strip()} if value else None
+
+def open_stream(last_event_id: Optional[str], since: Optional[int], ids: Optional[str],
+                related: Optional[str], ops: Optional[str]) -> StreamingResponse:
+    cursor = int(last_event_id) if last_event_id and last_event_id.isdigit() else since
+    return StreamingResponse(
+        stream(cursor, StreamFilter(_csv(ids), _csv(related), _csv(ops))),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
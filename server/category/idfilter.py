@@ -0,0 +1,219 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from config import settings
+from database import SessionLocal
+from models import Category
+import bus
+import sync
+
+log = logging.getLogger("category.idfilter")
+
+class BloomFilter:
+    """
+    `bits` bits, `hashes` probes per id (double hashing over one blake2b digest). No false negatives;
+    false positives at about IDFILTER_ERROR_RATE once `capacity` ids are in. Peers rebuild it from
+    the bit array and the two sizes, so the hashing must stay the same in every service.
+    """
+
+    def __init__(self, bits: int, hashes: int, data: Optional[bytes] = None, count: int = 0, capacity: int = 0):
+        self.bits, self.hashes, self.count, self.capacity = bits, hashes, count, capacity
+        self.data = bytearray(data) if data is not None else bytearray((bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter":
+        bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        return cls(bits, max(1, round(bits / capacity * math.log(2))), capacity=capacity)
+
+    def _probes(self, id_: str) -> Iterable[int]:
+        digest = hashlib.blake2b(id_.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, id_: str) -> None:
+        for bit in self._probes(id_):
+            self.data[bit >> 3] |= 1 << (bit & 7)
+        self.count += 1
+
+    def __contains__(self, id_: str) -> bool:
+        return all(self.data[bit >> 3] & (1 << (bit & 7)) for bit in self._probes(id_))
+
+# ---- Own ids (served at GET /categories/idfilter)
+class OwnIds:
+    """
+    Filter of every category id, built from the table at startup and kept current from the commits of
+    every worker (bus.subscribe). Deleted ids stay in until the next rebuild, which happens once
+    creates and deletes since the last one outgrow the capacity (sized at twice the rows).
+    """
+
+    def __init__(self, error_rate: float, min_capacity: int):
+        self.error_rate, self.min_capacity = error_rate, min_capacity
+        self.bloom: Optional[BloomFilter] = None
+        self.generation = 0
+        self.removed = 0
+        self._pending: Optional[List[str]] = None     # creates seen while a rebuild scans the table
+        self._tag: Optional[Tuple[Tuple[int, int], str]] = None   # ((generation, count), etag)
+        self._lock = threading.Lock()
+        self._rebuilding = threading.Lock()
+
+    @property
+    def full(self) -> bool:
+        return self.bloom is None or self.bloom.count + self.removed > self.bloom.capacity
+
+    def rebuild(self) -> None:
+        if not self._rebuilding.acquire(blocking=False):
+            return                                    # another thread is at it; its result will do
+        try:
+            with self._lock:
+                self._pending = []
+            with SessionLocal() as db:
+                ids = [id_ for (id_,) in db.query(Category.id)]
+            bloom = BloomFilter.for_capacity(max(2 * len(ids), self.min_capacity), self.error_rate)
+            for id_ in ids:
+                bloom.add(id_)
+            with self._lock:
+                for id_ in self._pending:
+                    bloom.add(id_)
+                self.bloom, self._pending = bloom, None
+                self.generation += 1
+                self.removed = 0
+        finally:
+            self._rebuilding.release()
+
+    def on_commit(self, entries: List[dict]) -> None:
+        with self._lock:
+            for e in entries:
+                if e["op"] == "create":
+                    if self._pending is not None:
+                        self._pending.append(e["id"])
+                    if self.bloom is not None:
+                        self.bloom.add(e["id"])
+                elif e["op"] == "delete":
+                    self.removed += 1
+
+    def current(self) -> Tuple[str, BloomFilter]:
+        """(etag, filter), rebuilding first when the filter is full. Ids added later only set more bits."""
+        if self.full:
+            self.rebuild()
+        with self._lock:
+            return self._etag(), self.bloom
+
+    def _etag(self) -> str:
+        # A digest of the filter itself, so every worker holding the same bits answers with the same tag and
+        # a 304 from any of them is right. Recomputed only after an add or a rebuild (caller holds the lock).
+        key = (self.generation, self.bloom.count)
+        if self._tag is None or self._tag[0] != key:
+            digest = hashlib.blake2b(f"{self.bloom.bits}.{self.bloom.hashes}.".encode(), digest_size=16)
+            digest.update(self.bloom.data)
+            self._tag = (key, f'"{digest.hexdigest()}"')
+        return self._tag[1]
+
+    def snapshot(self) -> dict:
+        bloom = self.bloom
+        return {
+            "ids": bloom.count if bloom else 0, "capacity": bloom.capacity if bloom else 0,
+            "bytes": len(bloom.data) if bloom else 0, "removed": self.removed, "generation": self.generation,
+        }
+
+owned = OwnIds(settings.IDFILTER_ERROR_RATE, settings.IDFILTER_MIN_CAPACITY)
+bus.subscribe(owned.on_commit)
+
+# ---- Peer filters (validate linked ids before the write)
+class PeerFilter:
+    """
+    A peer's filter, fetched from `<base>/idfilter` and revalidated (If-None-Match) every `ttl`
+    seconds. An id the filter does not hold is missing for sure only if the filter is newer than the
+    write asking: otherwise the filter is fetched again (at most every `refetch` seconds) or, in
+    between, the id is looked up with a GET. An unreachable peer or an open circuit fails open.
+    """
+
+    def __init__(self, name: str, base: str, ttl: float, refetch: float):
+        self.name, self.base, self.ttl, self.refetch = name, base.rstrip("/"), ttl, refetch
+        self.bloom: Optional[BloomFilter] = None
+        self.etag: Optional[str] = None
+        self.fetched_at = 0.0                         # monotonic time the current filter was (re)validated
+        self.attempted_at = 0.0
+        self.counts = {"checked": 0, "rejected": 0, "fetches": 0, "lookups": 0, "failures": 0}
+        self._lock = threading.Lock()
+
+    def _fetch(self) -> None:
+        with self._lock:
+            breaker = sync.breakers.get(self.name)
+            if breaker is not None and breaker.state == "open":
+                return
+            started = self.attempted_at = time.monotonic()
+            headers = {"If-None-Match": self.etag} if self.etag and self.bloom is not None else {}
+            try:
+                resp = sync.http().get(f"{self.base}/idfilter", headers=headers, timeout=settings.HTTP_TIMEOUT)
+            except Exception as e:
+                self.counts["failures"] += 1
+                log.warning("Id filter fetch from %s failed: %s", self.name, e)
+                return
+            self.counts["fetches"] += 1
+            if resp.status_code == 200:
+                h = resp.headers
+                self.bloom = BloomFilter(int(h["X-Filter-Bits"]), int(h["X-Filter-Hashes"]), resp.content, int(h["X-Filter-Ids"]))
+                self.etag = h.get("ETag")
+            elif resp.status_code != 304:
+                self.counts["failures"] += 1
+                log.warning("Id filter fetch from %s -> %s", self.name, resp.status_code)
+                return
+            self.fetched_at = started
+
+    def _exists(self, id_: str) -> bool:
+        breaker = sync.breakers.get(self.name)
+        if breaker is not None and breaker.state == "open":
+            return True
+        self.counts["lookups"] += 1
+        try:
+            resp = sync.http().get(f"{self.base}/{id_}", params={"fields": "id"}, timeout=settings.HTTP_TIMEOUT)
+        except Exception as e:
+            log.warning("Id lookup %s %s failed: %s", self.name, id_, e)
+            return True
+        return resp.status_code != 404
+
+    def missing(self, ids: List[str]) -> List[str]:
+        """The ids the peer certainly does not have."""
+        if not ids:
+            return []
+        asked = time.monotonic()
+        self.counts["checked"] += len(ids)
+        stale = self.bloom is None or asked - self.fetched_at > self.ttl
+        if stale and asked - self.attempted_at >= self.refetch:   # a peer that is down is retried at that pace
+            self._fetch()
+        if self.bloom is None:
+            return []
+        absent = [id_ for id_ in ids if id_ not in self.bloom]
+        if absent and self.fetched_at < asked and asked - self.attempted_at >= self.refetch:
+            self._fetch()
+            absent = [id_ for id_ in absent if id_ not in self.bloom]
+        if absent and self.fetched_at < asked:
+            absent = [id_ for id_ in absent if not self._exists(id_)]
+        self.counts["rejected"] += len(absent)
+        return absent
+
+    def snapshot(self) -> dict:
+        age = time.monotonic() - self.fetched_at if self.bloom is not None else None
+        return {"ids": self.bloom.count if self.bloom else None, "age_s": round(age, 1) if age is not None else None, **self.counts}
+
+peers: Dict[str, PeerFilter] = {
+    name: PeerFilter(name, base, settings.IDFILTER_TTL_SECONDS, settings.IDFILTER_REFETCH_SECONDS)
+    for name, base in sync.PEERS.items()
+}
+
+def require(peer: str, ids: Iterable[str]) -> None:
+    """422 when `peer` certainly has none of some of `ids` (canonical). Costs a few hash probes per id."""
+    if not settings.IDFILTER_VALIDATE:
+        return
+    absent = peers[peer].missing(list(ids))
+    if absent:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Unknown {peer} id{'s' if len(absent) > 1 else ''}: {', '.join(absent)}",
+        )
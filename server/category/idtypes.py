@@ -0,0 +1,124 @@
+import re
+import uuid
+from typing import List, Optional, Sequence
+
+from sqlalchemy import LargeBinary, String, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.types import JSON, TypeDecorator
+
+from config import settings
+
+BINARY = settings.ID_STORAGE == "binary"
+
+# ---- Validation
+# Canonical 8-4-4-4-12 ids are checked by one regex; anything else uuid.UUID accepts (braces, no hyphens,
+# urn:uuid:) still passes through the slow path, so the accepted set is unchanged.
+_HEX = r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+_ONE = re.compile(_HEX + r"\Z")
+_MANY = re.compile(rf"(?:{_HEX},)*{_HEX}\Z")
+
+def is_uuid(value) -> bool:
+    if isinstance(value, str) and _ONE.match(value):
+        return True
+    try:
+        uuid.UUID(str(value))
+        return True
+    except (ValueError, TypeError, AttributeError):
+        return False
+
+def first_invalid(ids: Sequence[str]) -> Optional[str]:
+    """Batch check of an id list in one regex pass over the joined ids; None when all are valid."""
+    if not ids:
+        return None
+    joined = ",".join(ids) if all(isinstance(s, str) for s in ids) else None
+    # The length check pins every id to exactly 36 characters, so a comma inside an id cannot pass.
+    if joined is not None and len(joined) == 37 * len(ids) - 1 and _MANY.match(joined):
+        return None
+    return next((s for s in ids if not is_uuid(s)), None)
+
+def canonical(value: str) -> str:
+    """Binary storage returns ids in lowercase 8-4-4-4-12 form, so inputs are compared in that form too."""
+    if not BINARY:
+        return value
+    try:
+        return from_bytes(to_bytes(value))
+    except (ValueError, TypeError, AttributeError):
+        return value
+
+# ---- Conversion
+def to_bytes(value: str) -> bytes:
+    if len(value) == 36 and _ONE.match(value):
+        return bytes.fromhex(value.replace("-", ""))
+    return uuid.UUID(value).bytes
+
+def from_bytes(raw: bytes) -> str:
+    h = raw.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+def pack(ids: Sequence[str]) -> bytes:
+    return b"".join(to_bytes(s) for s in ids)
+
+def unpack(raw: bytes) -> List[str]:
+    return [from_bytes(raw[i:i + 16]) for i in range(0, len(raw), 16)]
+
+# ---- Column types
+class UUIDBytes(TypeDecorator):
+    """
+    A UUID column: String(36) with ID_STORAGE=text, a 16-byte blob with ID_STORAGE=binary.
+    Python always sees the string form.
+    """
+
+    impl = String(36)
+    cache_ok = True
+
+    def __init__(self, binary: bool = BINARY):
+        super().__init__()
+        self.binary = binary
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(LargeBinary(16) if self.binary else String(36))
+
+    def process_bind_param(self, value, dialect):
+        if not self.binary or value is None:
+            return value
+        try:
+            return to_bytes(value)
+        except (ValueError, TypeError, AttributeError):
+            # Not an id (e.g. a bad path parameter): any length but 16 matches nothing, so lookups just miss.
+            raw = str(value).encode()
+            return raw + b"\0" if len(raw) == 16 else raw
+
+    def process_result_value(self, value, dialect):
+        if not self.binary or value is None or isinstance(value, str):
+            return value
+        return from_bytes(value)
+
+class UUIDList(TypeDecorator):
+    """A list of UUIDs: a JSON array with ID_STORAGE=text, the ids packed back to back (16 bytes each) with ID_STORAGE=binary."""
+
+    impl = JSON
+    cache_ok = True
+
+    def __init__(self, binary: bool = BINARY):
+        super().__init__()
+        self.binary = binary
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(LargeBinary() if self.binary else JSON())
+
+    def process_bind_param(self, value, dialect):
+        if not self.binary or value is None:
+            return value
+        return pack(value)
+
+    def process_result_value(self, value, dialect):
+        if not self.binary or value is None or isinstance(value, list):
+            return value
+        return unpack(value)
+
+def stored_mode(conn: Connection, table: str) -> Optional[str]:
+    """How the ids of `table` are actually stored ("text" or "binary"); None if unknown (empty, not SQLite)."""
+    if conn.dialect.name != "sqlite":
+        return None
+    kind = conn.execute(text(f"SELECT typeof(id) FROM {table} LIMIT 1")).scalar()
+    return {"text": "text", "blob": "binary"}.get(kind)
@@ -0,0 +1,161 @@
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from typing import Iterable, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, insert, or_
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import Job, JobTask
+import bus
+import sync
+
+log = logging.getLogger("category.jobs")
+
+# (peer, relation, owner_id, ref_id): drop ref_id from the `relation` list of peer row owner_id.
+Task = Tuple[str, Optional[str], str, str]
+MAX_BACKOFF_SECONDS = 300.0
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# ---- Queue
+def enqueue(db: Session, kind: str, tasks: Iterable[Task]) -> Optional[Job]:
+    """
+    Queue `tasks` as one job in the caller's transaction, so the job exists exactly when the write
+    that caused it commits. Nothing is queued (None) when there are no tasks.
+    """
+    job_id = str(uuid.uuid4())
+    rows = [
+        {"job_id": job_id, "peer": peer, "relation": relation, "owner_id": owner_id, "ref_id": ref_id}
+        for peer, relation, owner_id, ref_id in tasks
+    ]
+    if not rows:
+        return None
+    now = _now()
+    job = Job(id=job_id, kind=kind, status="pending", total=len(rows), done=0, attempts=0, created_at=now, updated_at=now)
+    db.add(job)
+    db.execute(insert(JobTask), rows)
+    return job
+
+def get(db: Session, job_id: str) -> Job:
+    job = db.get(Job, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+def retry(db: Session, job_id: str) -> Job:
+    job = get(db, job_id)
+    if job.status != "failed":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job is {job.status}, only failed jobs can be retried")
+    job.status, job.attempts, job.next_run_at, job.updated_at = "pending", 0, None, _now()
+    db.commit()
+    runner.wake()
+    return job
+
+def out(job: Job) -> dict:
+    return {
+        "id": job.id, "kind": job.kind, "status": job.status,
+        "total": job.total, "done": job.done, "pending": job.total - job.done,
+        "attempts": job.attempts, "last_error": job.last_error,
+        "created_at": job.created_at, "updated_at": job.updated_at,
+    }
+
+# ---- Runner
+def run_once(db: Session) -> bool:
+    """
+    Send the next batch of the oldest runnable job: its first JOB_BATCH tasks, one request per peer
+    (and relation). Tasks a peer applied are deleted; a failed peer keeps its tasks for the retry.
+    Returns True when more work may be ready right away.
+    """
+    now = _now()
+    job = (
+        db.query(Job)
+        .filter(Job.status.in_(("pending", "running")), or_(Job.next_run_at.is_(None), Job.next_run_at <= now))
+        .order_by(Job.created_at)
+        .first()
+    )
+    if job is None:
+        return False
+    tasks = db.query(JobTask).filter(JobTask.job_id == job.id).order_by(JobTask.seq).limit(settings.JOB_BATCH).all()
+    sent, error = [], None
+    target = lambda t: (t.peer, t.relation or "")
+    for (peer, relation), group in groupby(sorted(tasks, key=target), key=target):
+        group = list(group)
+        failure = sync.bulk_unlink(peer, relation or None, [(t.owner_id, t.ref_id) for t in group])
+        if failure:
+            error = failure
+        else:
+            sent += [t.seq for t in group]
+    if sent:
+        db.execute(delete(JobTask).where(JobTask.seq.in_(sent)))
+    job.done += len(sent)
+    job.updated_at = _now()
+    if error is None:
+        job.attempts, job.next_run_at = 0, None
+        job.status = "running" if len(tasks) == settings.JOB_BATCH else "done"
+    else:
+        job.attempts += 1
+        job.last_error = error
+        if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+            job.status = "failed"
+            log.warning("Job %s failed after %d attempts: %s", job.id, job.attempts, error)
+        else:
+            job.status = "running"
+            backoff = min(settings.JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1), MAX_BACKOFF_SECONDS)
+            job.next_run_at = now + timedelta(seconds=backoff)
+    db.commit()
+    return error is None
+
+class JobRunner:
+    """One background thread draining the job queue; idle it polls every `interval` seconds or on wake()."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="job-runner", daemon=True)
+
+    def start(self) -> "JobRunner":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                more = run_once(db)
+            except Exception as e:
+                db.rollback()
+                log.warning("Job batch failed: %s", e)
+                more = False
+            finally:
+                db.close()
+            if not more:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+
+runner = JobRunner(settings.JOB_POLL_SECONDS)
+
+def _on_commit(entries) -> None:
+    # Jobs queued by another worker come with its delete entries: the leading worker starts on them at once.
+    if any(e["op"] == "delete" for e in entries):
+        runner.wake()
+
+if bus.ENABLED:
+    bus.subscribe(_on_commit)
+
+def start_runner() -> JobRunner:
+    return runner.start()
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field, constr
+from datetime import datetime
 from typing import List, Optional
 
 NameStr = constr(min_length=1, max_length=2000)
@@ -8,6 +9,7 @@ class CategoryBase(BaseModel):
     name: NameStr
     description: DescStr = ""
     product_ids: List[str] = Field(default_factory=list)
+    parent_id: Optional[str] = None  # null = root
 
 class CategoryCreate(CategoryBase):
     id: Optional[str] = None  # auto-generate UUID if omitted
@@ -16,12 +18,52 @@ class CategoryUpdate(BaseModel):
     name: Optional[NameStr] = None
     description: Optional[DescStr] = None
     product_ids: Optional[List[str]] = None
+    parent_id: Optional[str] = None  # moves the category with its subtree; an explicit null makes it a root
 
 class LinkProductOp(BaseModel):
     product_id: str
 
+class CategoryBulkDelete(BaseModel):
+    ids: Optional[List[str]] = None
+    product_id: Optional[str] = None   # filter: every category linked to this product
+
+class BulkDeleteOut(BaseModel):
+    deleted: int
+    missing: List[str] = Field(default_factory=list)  # requested ids that did not exist
+    job_id: Optional[str] = None                      # product unlinks still being sent (GET /jobs/{job_id})
+
+class UnlinkPair(BaseModel):
+    id: str       # category
+    ref_id: str   # product to drop from its product_ids
+
+class BulkUnlink(BaseModel):
+    relation: Optional[str] = None
+    pairs: List[UnlinkPair]
+
+class BulkUnlinkOut(BaseModel):
+    applied: int   # pairs naming an existing category (already unlinked ones included)
+
+class JobOut(BaseModel):
+    id: str
+    kind: str
+    status: str    # pending|running|done|failed
+    total: int
+    done: int
+    pending: int
+    attempts: int
+    last_error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
 class CategoryOut(CategoryBase):
     id: str
 
     class Config:
         from_attributes = True
+
+class CategoryNode(CategoryOut):
+    depth: int  # edges from the queried category (subtree) or up to it (ancestors)
+
+class CategoryProductsOut(BaseModel):
+    category_id: str
+    product_ids: List[str]
@@ -0,0 +1,34 @@
+"""
+The service's modules are flat (`import crud`), so the tests put its directory first on sys.path and
+point DATABASE_URL at a scratch file before anything imports config. Run from the service directory:
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_scratch = tempfile.mkdtemp(prefix="category-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_scratch}/category.db",
+    "WORKER_LOCK_FILE": f"{_scratch}/category.leader",
+    "IDFILTER_VALIDATE": "false",
+})
+sys.path.insert(0, SERVICE_DIR)
+
+from database import Base, SessionLocal, engine  # noqa: E402
+import migrate  # noqa: E402
+
+migrate.upgrade(engine)
+
+@pytest.fixture
+def db():
+    """A session on emptied tables."""
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+    with SessionLocal() as session:
+        yield session
@@ -0,0 +1,27 @@
+import pytest
+
+from models import Category, ChangeLog
+from schemas import CategoryCreate
+import crud
+import tree
+
+def _make(db, name, parent=None):
+    return crud.create(db, CategoryCreate(name=name, parent_id=parent.id if parent else None))
+
+@pytest.mark.parametrize("order", [("a", "b"), ("b", "a")])
+def test_deleting_parent_and_child_reparents_grandchild_to_survivor(db, order):
+    root = _make(db, "root")
+    a = _make(db, "a", root)
+    b = _make(db, "b", a)
+    c = _make(db, "c", b)
+    c_id, root_id = c.id, root.id
+    named = {"a": a, "b": b}
+
+    crud.delete_many(db, [named[key] for key in order])
+    db.expire_all()
+
+    assert db.get(Category, c_id).parent_id == root_id
+    assert [cat.id for cat, _ in tree.ancestors(db, c_id)] == [root_id]
+    assert [(cat.id, depth) for cat, depth in tree.subtree(db, root_id)] == [(root_id, 0), (c_id, 1)]
+    updates = db.query(ChangeLog).filter(ChangeLog.entity_id == c_id, ChangeLog.op == "update").all()
+    assert [e.data["parent_id"] for e in updates] == [root_id]
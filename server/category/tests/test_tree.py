@@ -0,0 +1,109 @@
+import asyncio
+import uuid
+
+import httpx
+from sqlalchemy import select
+
+from schemas import CategoryCreate
+from main import app
+import crud
+import tree
+
+P1, P2, P3, P4 = (str(uuid.uuid4()) for _ in range(4))
+
+def _request(method, path, **kwargs):
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.request(method, path, **kwargs)
+    return asyncio.run(go())
+
+def _make(db, name, parent=None, product_ids=()):
+    return crud.create(db, CategoryCreate(name=name, parent_id=parent, product_ids=list(product_ids))).id
+
+def _forest(db):
+    """root > a > b > c, and root > d; products on a, b, c and d."""
+    ids = {"root": _make(db, "root")}
+    ids["a"] = _make(db, "a", ids["root"], [P1])
+    ids["b"] = _make(db, "b", ids["a"], [P2])
+    ids["c"] = _make(db, "c", ids["b"], [P3, P1])
+    ids["d"] = _make(db, "d", ids["root"], [P4])
+    return ids
+
+def _names(resp, ids):
+    assert resp.status_code == 200, resp.text
+    by_id = {v: k for k, v in ids.items()}
+    return [(by_id[node["id"]], node["depth"]) for node in resp.json()]
+
+def _closure(db):
+    return sorted(db.execute(select(tree.closure.c.ancestor_id, tree.closure.c.descendant_id, tree.closure.c.depth)).all())
+
+def _consistent(db):
+    """The incrementally maintained closure equals one rebuilt from parent_id."""
+    db.expire_all()
+    kept = _closure(db)
+    tree.rebuild(db)
+    rebuilt = _closure(db)
+    db.rollback()
+    return kept == rebuilt
+
+def test_insert_builds_subtree_and_ancestors(db):
+    ids = _forest(db)
+
+    assert _names(_request("GET", f"/categories/{ids['root']}/subtree"), ids) == [
+        ("root", 0), ("a", 1), ("d", 1), ("b", 2), ("c", 3),
+    ]
+    assert _names(_request("GET", f"/categories/{ids['root']}/subtree", params={"max_depth": 1}), ids) == [
+        ("root", 0), ("a", 1), ("d", 1),
+    ]
+    assert _names(_request("GET", f"/categories/{ids['c']}/ancestors"), ids) == [("root", 3), ("a", 2), ("b", 1)]
+    assert _names(_request("GET", f"/categories/{ids['root']}/ancestors"), ids) == []
+    assert _consistent(db)
+
+def test_reparent_moves_the_whole_subtree(db):
+    ids = _forest(db)
+
+    resp = _request("PATCH", f"/categories/{ids['b']}", json={"parent_id": ids["d"]})
+
+    assert resp.status_code == 200, resp.text
+    assert _names(_request("GET", f"/categories/{ids['c']}/ancestors"), ids) == [("root", 3), ("d", 2), ("b", 1)]
+    assert _names(_request("GET", f"/categories/{ids['a']}/subtree"), ids) == [("a", 0)]
+    assert _names(_request("GET", f"/categories/{ids['d']}/subtree"), ids) == [("d", 0), ("b", 1), ("c", 2)]
+    assert _consistent(db)
+
+    to_root = _request("PATCH", f"/categories/{ids['b']}", json={"parent_id": None})
+
+    assert to_root.status_code == 200 and to_root.json()["parent_id"] is None
+    assert _names(_request("GET", f"/categories/{ids['c']}/ancestors"), ids) == [("b", 1)]
+    assert _consistent(db)
+
+def test_reparent_under_own_descendant_is_422(db):
+    ids = _forest(db)
+
+    for target in ("a", "c"):
+        resp = _request("PATCH", f"/categories/{ids['a']}", json={"parent_id": ids[target]})
+        assert resp.status_code == 422, resp.text
+
+    assert _names(_request("GET", f"/categories/{ids['c']}/ancestors"), ids) == [("root", 3), ("a", 2), ("b", 1)]
+    assert _consistent(db)
+
+def test_delete_moves_children_up(db):
+    ids = _forest(db)
+
+    assert _request("DELETE", f"/categories/{ids['a']}").status_code == 204
+
+    assert _names(_request("GET", f"/categories/{ids['root']}/subtree"), ids) == [
+        ("root", 0), ("b", 1), ("d", 1), ("c", 2),
+    ]
+    assert _names(_request("GET", f"/categories/{ids['c']}/ancestors"), ids) == [("root", 2), ("b", 1)]
+    assert _request("GET", f"/categories/{ids['a']}/subtree").status_code == 404
+    assert _consistent(db)
+
+def test_products_with_and_without_descendants(db):
+    ids = _forest(db)
+    products = lambda cid, **params: _request("GET", f"/categories/{cid}/products", params=params).json()["product_ids"]
+
+    assert products(ids["root"]) == [P1, P4, P2, P3]          # by depth then name, each id once
+    assert products(ids["root"], descendants="true") == products(ids["root"])
+    assert products(ids["a"], descendants="false") == [P1]
+    assert products(ids["b"]) == [P2, P3, P1]
+    assert _request("GET", f"/categories/{uuid.uuid4()}/products").status_code == 404
@@ -0,0 +1,134 @@
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, literal, or_, select, true, update
+from sqlalchemy.orm import Session
+
+from models import Category, CategoryClosure
+
+# The closure table holds every (ancestor, descendant, depth) pair of the tree, so a subtree, the
+# ancestors of a node or the products under it are each one indexed join, whatever the depth.
+# It is maintained in the caller's transaction, next to the parent_id change it mirrors.
+closure = CategoryClosure.__table__
+
+def _not_found() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
+
+# ---- Writes
+def attach(db: Session, category_id: str, parent_id: Optional[str]) -> None:
+    """Closure rows for a new leaf: itself at depth 0 and one per ancestor of its parent (parent included)."""
+    db.execute(closure.insert().values(ancestor_id=category_id, descendant_id=category_id, depth=0))
+    if parent_id is not None:
+        db.execute(closure.insert().from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(closure.c.ancestor_id, literal(category_id, closure.c.descendant_id.type), closure.c.depth + 1)
+            .where(closure.c.descendant_id == parent_id),
+        ))
+
+def contains(db: Session, ancestor_id: str, descendant_id: str) -> bool:
+    """True when `descendant_id` is `ancestor_id` or lies below it."""
+    return db.execute(
+        select(closure.c.depth).where(closure.c.ancestor_id == ancestor_id, closure.c.descendant_id == descendant_id)
+    ).first() is not None
+
+def move(db: Session, category_id: str, parent_id: Optional[str]) -> None:
+    """
+    Re-hang the subtree rooted at `category_id` under `parent_id` (None = make it a root). Only paths
+    crossing the subtree boundary change: those from the old ancestors are dropped and the new
+    ancestors x subtree cross product is inserted. Paths inside the subtree are untouched.
+    """
+    inner = closure.alias("inner")
+    subtree = select(inner.c.descendant_id).where(inner.c.ancestor_id == category_id)
+    db.execute(delete(closure).where(closure.c.descendant_id.in_(subtree), closure.c.ancestor_id.not_in(subtree)))
+    if parent_id is not None:
+        above, below = closure.alias("above"), closure.alias("below")
+        db.execute(closure.insert().from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(above.c.ancestor_id, below.c.descendant_id, above.c.depth + below.c.depth + 1)
+            .select_from(above.join(below, true()))
+            .where(above.c.descendant_id == parent_id, below.c.ancestor_id == category_id),
+        ))
+
+def detach(db: Session, cat: Category) -> List[Category]:
+    """
+    Take `cat` out of the tree before it is deleted. Its children move up to its parent, so every path
+    through it gets one edge shorter. Returns the re-parented children.
+    """
+    inner = closure.alias("inner")
+    above = select(inner.c.ancestor_id).where(inner.c.descendant_id == cat.id, inner.c.depth > 0)
+    below = select(inner.c.descendant_id).where(inner.c.ancestor_id == cat.id, inner.c.depth > 0)
+    db.execute(
+        update(closure)
+        .where(closure.c.ancestor_id.in_(above), closure.c.descendant_id.in_(below))
+        .values(depth=closure.c.depth - 1)
+    )
+    db.execute(delete(closure).where(or_(closure.c.ancestor_id == cat.id, closure.c.descendant_id == cat.id)))
+    children = db.query(Category).filter(Category.parent_id == cat.id).all()
+    for child in children:
+        child.parent_id = cat.parent_id
+    return children
+
+def rebuild(db: Session) -> int:
+    """
+    Recompute the whole closure table from parent_id, one depth level per statement, for rows written
+    without it (a feed replay). Returns the depth of the deepest path.
+    """
+    cats = Category.__table__
+    db.execute(delete(closure))
+    db.execute(closure.insert().from_select(
+        ["ancestor_id", "descendant_id", "depth"], select(cats.c.id, cats.c.id, literal(0)),
+    ))
+    depth, limit = 0, db.query(Category).count()
+    while depth < limit:
+        added = db.execute(closure.insert().from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(closure.c.ancestor_id, cats.c.id, literal(depth + 1))
+            .select_from(closure.join(cats, cats.c.parent_id == closure.c.descendant_id))
+            .where(closure.c.depth == depth),
+        )).rowcount
+        if not added:
+            break
+        depth += 1
+    return depth
+
+# ---- Reads
+def subtree(db: Session, category_id: str, max_depth: Optional[int] = None) -> List[Tuple[Category, int]]:
+    """`category_id` (depth 0) and everything below it, ordered by depth then name."""
+    query = (
+        db.query(Category, CategoryClosure.depth)
+        .join(CategoryClosure, CategoryClosure.descendant_id == Category.id)
+        .filter(CategoryClosure.ancestor_id == category_id)
+    )
+    if max_depth is not None:
+        query = query.filter(CategoryClosure.depth <= max_depth)
+    rows = query.order_by(CategoryClosure.depth, Category.name).all()
+    if not rows:
+        raise _not_found()
+    return [(cat, depth) for cat, depth in rows]
+
+def ancestors(db: Session, category_id: str) -> List[Tuple[Category, int]]:
+    """The path from the root down to the parent of `category_id`; depth counts the edges up to it."""
+    rows = (
+        db.query(Category, CategoryClosure.depth)
+        .join(CategoryClosure, CategoryClosure.ancestor_id == Category.id)
+        .filter(CategoryClosure.descendant_id == category_id)
+        .order_by(CategoryClosure.depth.desc())
+        .all()
+    )
+    if not rows:
+        raise _not_found()
+    return [(cat, depth) for cat, depth in rows if depth > 0]
+
+def product_ids(db: Session, category_id: str, descendants: bool = True) -> List[str]:
+    """Products linked to `category_id` or, with `descendants`, to any category below it (each once)."""
+    query = (
+        db.query(Category.product_ids)
+        .join(CategoryClosure, CategoryClosure.descendant_id == Category.id)
+        .filter(CategoryClosure.ancestor_id == category_id)
+    )
+    if not descendants:
+        query = query.filter(CategoryClosure.depth == 0)
+    rows = query.order_by(CategoryClosure.depth, Category.name).all()
+    if not rows:
+        raise _not_found()
+    return list(dict.fromkeys(pid for (ids,) in rows for pid in ids or []))
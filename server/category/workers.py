@@ -0,0 +1,82 @@
+import fcntl
+import logging
+import os
+import threading
+from typing import Callable, List, Optional, Protocol
+
+from config import settings
+
+log = logging.getLogger("category.workers")
+
+# More than one worker process (see serve.py): in-process state is shared through the database instead.
+MULTI = settings.WORKERS > 1
+
+class Stoppable(Protocol):
+    def stop(self) -> None: ...
+
+class Leader:
+    """
+    Background loops (change log compactor, job runner) run once per service, not once per worker. The
+    worker holding an exclusive flock on WORKER_LOCK_FILE starts them; the others try again every
+    WORKER_LEADER_POLL seconds, so when the leader exits (the kernel drops its lock) another takes over.
+    With a single worker there is nothing to elect and the loops start at once.
+    """
+
+    def __init__(self, start: Callable[[], List[Stoppable]], path: str, interval: float):
+        self._start, self.path, self.interval = start, path, interval
+        self._loops: List[Stoppable] = []
+        self._fd: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="leader-election", daemon=True)
+
+    @property
+    def leading(self) -> bool:
+        return bool(self._loops) or (self._fd is not None)
+
+    def start(self) -> "Leader":
+        if not MULTI:
+            self._loops = self._start()
+        elif not self._acquire():
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        for loop in reversed(self._loops):
+            loop.stop()
+        self._loops = []
+        if self._fd is not None:
+            os.close(self._fd)                  # releases the lock
+            self._fd = None
+
+    def _acquire(self) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        if self._stop.is_set():                 # shutting down meanwhile: let another worker lead
+            os.close(fd)
+            return True
+        self._fd = fd
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        log.info("Worker %d leads: running background loops", os.getpid())
+        self._loops = self._start()
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                if self._acquire():
+                    return
+            except OSError as e:
+                log.warning("Leader election failed: %s", e)
+
+    def snapshot(self) -> dict:
+        return {"pid": os.getpid(), "workers": settings.WORKERS, "leader": self.leading}
+
+def elect(start: Callable[[], List[Stoppable]]) -> Leader:
+    """Run `start()` (returning the loops to stop on shutdown) in exactly one worker."""
+    return Leader(start, settings.WORKER_LOCK_FILE, settings.WORKER_LEADER_POLL).start()
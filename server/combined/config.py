@@ -0,0 +1,10 @@
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+class Settings(BaseSettings):
+    IN_PROCESS_PEERS: bool = True                 # false = sync calls keep going over HTTP to each service's *_BASE_URL
+    PUBLIC_BASE_URL: str = "http://localhost:8000" # this process as clients reach it (image urls); IMAGE__PUBLIC_BASE_URL wins
+    LOG_LEVEL: str = "INFO"
+
+    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
+
+settings = Settings()
@@ -0,0 +1,109 @@
+"""
+A `requests` transport that hands a peer call to the co-located service's ASGI app, in the calling
+thread: no socket, no HTTP parsing, no hop through the server's event loop.
+
+Sync calls always run off the event loop (request threadpool, job runner, warm-up pool), so each
+calling thread drives the peer app on a private event loop of its own. The app is entered below the
+admission middleware, whose controller belongs to the server's loop, and above its exception handlers;
+the idempotency middleware stays in, so a retried write is still answered from the store.
+"""
+import asyncio
+import threading
+from http import HTTPStatus
+from typing import Dict, List, Tuple
+from urllib.parse import unquote, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from starlette.middleware.exceptions import ExceptionMiddleware
+
+from loader import PEER_SETTINGS, Service, in_process_origin
+
+class InProcessAdapter(BaseAdapter):
+    def __init__(self, service: Service):
+        super().__init__()
+        app = service.app
+        self.app, self.asgi = app, service.idempotency.IdempotencyMiddleware(
+            ExceptionMiddleware(app.router, handlers=app.exception_handlers)
+        )
+        self._local = threading.local()
+
+    def _loop(self) -> asyncio.AbstractEventLoop:
+        loop = getattr(self._local, "loop", None)
+        if loop is None:
+            loop = self._local.loop = asyncio.new_event_loop()
+        return loop
+
+    async def _call(self, scope: dict, body: bytes) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+        sent = False
+        start: dict = {}
+        chunks: List[bytes] = []
+
+        async def receive() -> dict:
+            nonlocal sent
+            if sent:
+                return {"type": "http.disconnect"}
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.asgi(scope, receive, send)
+        return start["status"], start.get("headers", []), b"".join(chunks)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("In-process peer calls must not be made from the event loop thread")
+        url = urlsplit(request.url)
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": request.method,
+            "scheme": url.scheme,
+            "path": unquote(url.path) or "/",
+            "raw_path": (url.path or "/").encode("latin-1"),
+            "query_string": url.query.encode("latin-1"),
+            "root_path": "",
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in request.headers.items()],
+            "client": ("127.0.0.1", 0),
+            "server": (url.hostname, url.port or 80),
+            "app": self.app,
+        }
+        status, headers, content = self._loop().run_until_complete(self._call(scope, body))
+
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict((k.decode("latin-1"), v.decode("latin-1")) for k, v in headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.reason = HTTPStatus(status).phrase
+        response._content = content
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self) -> None:
+        pass
+
+def mount(services: Dict[str, Service]) -> None:
+    """Route every service's sync calls to its co-located peers through InProcessAdapter."""
+    adapters = {name: InProcessAdapter(service) for name, service in services.items()}
+    for name, service in services.items():
+        session = service.sync.http()
+        session.trust_env = False   # every peer is in-process: skip the per-call proxy/netrc lookups in os.environ
+        for peer in PEER_SETTINGS[name]:
+            session.mount(in_process_origin(peer) + "/", adapters[peer])
@@ -0,0 +1,101 @@
+"""
+Import the services into this one interpreter.
+
+Each service is a flat set of top-level modules (`import crud`, `from config import settings`), so two
+of them cannot be imported side by side under their own names. They are imported one after the other,
+each with its directory first on sys.path and its environment overlaid (SUPPLIER__DATABASE_URL is the
+supplier's DATABASE_URL); its modules are then moved to "<service>.<module>" in sys.modules, out of
+the way of the next one. No service imports one of its own modules lazily, so nothing looks them up
+by the flat name afterwards.
+"""
+import importlib
+import os
+import sys
+import types
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Service -> the resource path it owns, in start-up order (product last: it calls the other three).
+SERVICES: Dict[str, str] = {
+    "supplier": "/suppliers",
+    "category": "/categories",
+    "image": "/images",
+    "product": "/products",
+}
+
+# The peers each service calls, as the config setting holding the peer's base url.
+PEER_SETTINGS: Dict[str, Dict[str, str]] = {
+    "supplier": {"product": "PRODUCT_BASE_URL"},
+    "category": {"product": "PRODUCT_BASE_URL"},
+    "image": {"product": "PRODUCT_BASE_URL"},
+    "product": {"supplier": "SUPPLIER_BASE_URL", "category": "CATEGORY_BASE_URL", "image": "IMAGE_BASE_URL"},
+}
+
+def in_process_origin(name: str) -> str:
+    """Origin of the in-process peer urls: never resolved, only matched by inprocess.InProcessAdapter."""
+    return f"http://{name}.inprocess"
+
+class Service:
+    """A loaded service: `service.app`, and its modules as attributes (`service.sync`, `service.migrate`)."""
+
+    def __init__(self, name: str, modules: Dict[str, types.ModuleType]):
+        self.name, self.modules = name, modules
+
+    def __getattr__(self, module: str) -> types.ModuleType:
+        try:
+            return self.modules[module]
+        except KeyError:
+            raise AttributeError(f"{self.name} has no module {module!r}") from None
+
+    @property
+    def app(self):
+        return self.modules["main"].app
+
+@contextmanager
+def _environ(overlay: Dict[str, str]) -> Iterator[None]:
+    saved = {key: os.environ.get(key) for key in overlay}
+    os.environ.update(overlay)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+def environment(name: str, in_process: bool, public_base_url: str) -> Dict[str, str]:
+    """Settings `name` is imported with: its prefixed variables, and the in-process peer urls."""
+    prefix = f"{name.upper()}__"
+    overlay = {"DATABASE_URL": f"sqlite:///./{name}.db", "WORKER_LOCK_FILE": f"./{name}.leader", "WORKERS": "1"}
+    if name == "image":
+        overlay["PUBLIC_BASE_URL"] = public_base_url
+    overlay.update({key[len(prefix):]: value for key, value in os.environ.items() if key.startswith(prefix)})
+    if in_process:
+        for peer, setting in PEER_SETTINGS[name].items():
+            overlay[setting] = in_process_origin(peer) + SERVICES[peer]
+    return overlay
+
+def load(name: str, env: Dict[str, str], extra: Iterable[str] = ("migrate",)) -> Service:
+    directory = os.path.join(SERVER_DIR, name)
+    flat = {entry[:-3] for entry in os.listdir(directory) if entry.endswith(".py")}
+    ours = {module: sys.modules.pop(module) for module in flat if module in sys.modules}  # combined's main, config
+    sys.path.insert(0, directory)
+    try:
+        with _environ(env):
+            for module in ("main", *extra):
+                importlib.import_module(module)
+    finally:
+        sys.path.remove(directory)
+    modules = {}
+    for module in flat:
+        loaded = sys.modules.pop(module, None)
+        if loaded is not None:
+            modules[module] = sys.modules[f"{name}.{module}"] = loaded
+    sys.modules.update(ours)
+    return Service(name, modules)
+
+def load_all(in_process: bool, public_base_url: str) -> Dict[str, Service]:
+    return {name: load(name, environment(name, in_process, public_base_url)) for name in SERVICES}
@@ -0,0 +1,81 @@
+"""
+Supplier, category, image and product services in one process (see README.md).
+
+Each resource path goes straight to the app that owns it (/suppliers... to the supplier app, with its
+middleware), so clients and the gateway see the same API as in the split deployment. The per-service
+endpoints that share a path (/health, /readyz, /jobs, /admin/..., /workers) are served under the
+service name: /supplier/health, /product/jobs/{id}. Sync calls between the services are dispatched
+in-process (inprocess.py) unless IN_PROCESS_PEERS is false.
+"""
+import logging
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Dict
+
+from fastapi import FastAPI, status
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import settings
+import inprocess
+import loader
+
+logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO))
+log = logging.getLogger("combined.service")
+
+services = loader.load_all(settings.IN_PROCESS_PEERS, settings.PUBLIC_BASE_URL)
+if settings.IN_PROCESS_PEERS:
+    inprocess.mount(services)
+
+# Resource path (first segment) -> the service app answering it.
+ROUTES: Dict[str, str] = {path: name for name, path in loader.SERVICES.items()}
+ROUTES["/stats"] = "product"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Mounted apps get no lifespan events of their own: run each one's, in order, and stop them in reverse.
+    async with AsyncExitStack() as stack:
+        for service in services.values():
+            await stack.enter_async_context(service.app.router.lifespan_context(service.app))
+        log.info("Started %s (peers %s)", ", ".join(services), "in-process" if settings.IN_PROCESS_PEERS else "over HTTP")
+        yield
+
+root = FastAPI(
+    title="Combined Services",
+    description="Supplier, category, image and product services in one process",
+    version="1.0.0",
+    lifespan=lifespan,
+)
+
+for name, service in services.items():
+    root.mount(f"/{name}", service.app)
+
+@root.get("/health")
+def health():
+    return {"status": "ok", "service": "combined", "version": "1.0.0", "services": list(services)}
+
+@root.get("/livez")
+async def livez():
+    return {"status": "alive"}
+
+@root.get("/readyz")
+def readyz():
+    checks = {name: service.probes.readiness() for name, service in services.items()}
+    ok = all(ready for ready, _ in checks.values())
+    body = {"status": "ready" if ok else "not_ready", "services": {name: body for name, (_, body) in checks.items()}}
+    return JSONResponse(body, status_code=status.HTTP_200_OK if ok else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+class Dispatcher:
+    """Sends resource paths to the owning service's app and everything else (lifespan included) to `root`."""
+
+    def __init__(self, root: ASGIApp, routes: Dict[str, ASGIApp]):
+        self.root, self.routes = root, routes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] in ("http", "websocket"):
+            target = self.routes.get("/" + scope["path"].split("/", 2)[1])
+            if target is not None:
+                await target(scope, receive, send)
+                return
+        await self.root(scope, receive, send)
+
+app = Dispatcher(root, {path: services[name].app for path, name in ROUTES.items()})
@@ -0,0 +1,25 @@
+"""
+Apply every service's pending migrations, with the databases the combined process will use:
+
+    python migrate.py            # upgrade supplier, category, image and product
+    python migrate.py --status
+"""
+import logging
+import sys
+
+from config import settings
+import loader
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for name, service in loader.load_all(settings.IN_PROCESS_PEERS, settings.PUBLIC_BASE_URL).items():
+        migrate = service.migrate
+        engines = getattr(service.database, "engines", {"": service.database.engine})
+        label = lambda shard: f"{name}{f' shard={shard}' if len(engines) > 1 else ''}"
+        if "--status" in sys.argv:
+            for shard, eng in engines.items():
+                with eng.begin() as conn:
+                    print(f"{label(shard)} current={migrate.current_version(conn)} latest={migrate.LATEST}")
+        else:
+            for shard, eng in engines.items():
+                print(f"{label(shard)} applied={migrate.upgrade(eng) or 'none'} latest={migrate.LATEST}")
@@ -0,0 +1,165 @@
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import ChangeLog, ChangeLogMeta
+from schemas import ImageOut
+
+log = logging.getLogger("image.changes")
+
+HORIZON_KEY = "horizon"
+
+_subscribers: List[Callable[[List[dict]], None]] = []
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def snapshot(obj) -> dict:
+    return ImageOut.model_validate(obj).model_dump(mode="json")
+
+def record(db: Session, op: str, obj=None, entity_id: Optional[str] = None,
+           relation: Optional[str] = None, ref_id: Optional[str] = None) -> ChangeLog:
+    """Append a change entry to the caller's transaction; it commits (or rolls back) with the write itself."""
+    entry = ChangeLog(
+        entity_id=entity_id or obj.id,
+        op=op,
+        relation=relation,
+        ref_id=ref_id,
+        data=snapshot(obj) if obj is not None and op != "delete" else None,
+        created_at=_now(),
+    )
+    db.add(entry)
+    return entry
+
+def _horizon(db: Session) -> int:
+    row = db.get(ChangeLogMeta, HORIZON_KEY)
+    return row.value if row else 0
+
+def entry_out(e: ChangeLog) -> dict:
+    return {
+        "seq": e.seq,
+        "op": e.op,
+        "id": e.entity_id,
+        "relation": e.relation,
+        "ref_id": e.ref_id,
+        "data": e.data,
+        "at": e.created_at.isoformat() + "Z",
+    }
+
+def read_since(db: Session, since: int, limit: int) -> dict:
+    """Entries with seq > since, oldest first. `next` is the cursor to pass back as `since`."""
+    horizon = _horizon(db)
+    if 0 < since < horizon:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail=f"Changes up to seq {horizon} were compacted; resync from since=0",
+        )
+    rows = (
+        db.query(ChangeLog)
+        .filter(ChangeLog.seq > since)
+        .order_by(ChangeLog.seq)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "changes": [entry_out(e) for e in rows],
+        "next": rows[-1].seq if rows else since,
+        "has_more": has_more,
+    }
+
+def latest_seq(db: Session) -> int:
+    return db.query(func.max(ChangeLog.seq)).scalar() or 0
+
+# ---- Commit notifications
+def subscribe(fn: Callable[[List[dict]], None]) -> None:
+    """Call `fn(entries)` after each commit that appended change entries."""
+    _subscribers.append(fn)
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect(session, flush_context):
+    pending = [entry_out(o) for o in session.new if isinstance(o, ChangeLog)]
+    if pending:
+        session.info.setdefault("changes", []).extend(pending)
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish(session):
+    entries = session.info.pop("changes", None)
+    if entries:
+        for fn in _subscribers:
+            try:
+                fn(entries)
+            except Exception as e:
+                log.warning("Change subscriber failed: %s", e)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard(session):
+    session.info.pop("changes", None)
+
+# ---- Compaction
+def compact(db: Session, retention: timedelta, tombstone_retention: timedelta) -> int:
+    """
+    Collapse entries older than `retention` to the latest one per entity, then drop delete
+    tombstones older than `tombstone_retention`. Replaying the compacted log still yields
+    the current state; consumers whose cursor is below the dropped tombstones get 410.
+    """
+    now = _now()
+    latest = select(func.max(ChangeLog.seq)).group_by(ChangeLog.entity_id)
+    removed = (
+        db.query(ChangeLog)
+        .filter(ChangeLog.created_at < now - retention, ChangeLog.seq.not_in(latest))
+        .delete(synchronize_session=False)
+    )
+    tomb_q = db.query(ChangeLog).filter(ChangeLog.op == "delete", ChangeLog.created_at < now - tombstone_retention)
+    tomb_max = tomb_q.with_entities(func.max(ChangeLog.seq)).scalar()
+    if tomb_max:
+        removed += tomb_q.delete(synchronize_session=False)
+        meta = db.get(ChangeLogMeta, HORIZON_KEY)
+        if meta is None:
+            db.add(ChangeLogMeta(key=HORIZON_KEY, value=tomb_max))
+        else:
+            meta.value = max(meta.value, tomb_max)
+    db.commit()
+    return removed
+
+class Compactor:
+    def __init__(self, interval: int):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="changelog-compactor", daemon=True)
+
+    def start(self) -> "Compactor":
+        if self.interval > 0:
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            db = SessionLocal()
+            try:
+                removed = compact(
+                    db,
+                    timedelta(seconds=settings.CHANGELOG_RETENTION_SECONDS),
+                    timedelta(seconds=settings.CHANGELOG_TOMBSTONE_RETENTION_SECONDS),
+                )
+                if removed:
+                    log.info("Compacted %d change log entries", removed)
+            except Exception as e:
+                db.rollback()
+                log.warning("Change log compaction failed: %s", e)
+            finally:
+                db.close()
+
+def start_compactor() -> Compactor:
+    return Compactor(settings.CHANGELOG_COMPACT_INTERVAL).start()
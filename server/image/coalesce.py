@@ -0,0 +1,97 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+import bus
+import changes
+
+class _Call:
+    __slots__ = ("done", "result", "error", "finished")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.finished = 0.0
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution; its result (or exception) is handed
+    to every caller. With `window > 0` a finished result also serves calls arriving within
+    `window` seconds. Callers block in their own (threadpool) thread, so this is thread-based.
+    """
+
+    MAX_KEYS = 4096
+
+    def __init__(self, window: float):
+        self.window = window
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def _reusable(self, call: _Call) -> bool:
+        return not call.done.is_set() or time.monotonic() - call.finished < self.window
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None or not self._reusable(call)
+            if leader:
+                if len(self._calls) >= self.MAX_KEYS:
+                    self._prune()
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.shared += 1
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                call.finished = time.monotonic()
+                call.done.set()
+                if self.window <= 0 or call.error is not None:
+                    with self._lock:
+                        if self._calls.get(key) is call:
+                            del self._calls[key]
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _prune(self) -> None:
+        for key in [k for k, c in self._calls.items() if not self._reusable(c)]:
+            del self._calls[key]
+
+    def forget(self) -> None:
+        """Later callers start a fresh call (in-flight callers still get theirs)."""
+        with self._lock:
+            self._calls.clear()
+
+    def snapshot(self) -> dict:
+        return {"window": self.window, "executed": self.executed, "shared": self.shared, "keys": len(self._calls)}
+
+reads = SingleFlight(settings.COALESCE_WINDOW)
+
+# A read that starts after a commit must not join a flight that began before it. Commits of other
+# workers arrive through the bus, up to BUS_POLL_MS later.
+changes.subscribe(lambda entries: reads.forget())
+if bus.ENABLED:
+    bus.subscribe(lambda entries: reads.forget())
+
+def read(key: Hashable, load: Callable[[Session], Any]) -> Any:
+    """
+    Run `load(db)` once for all concurrent requests with the same key, on a session of its own.
+    `load` must return plain data or schema objects, never ORM rows (the session closes first).
+    """
+    def run() -> Any:
+        with SessionLocal() as db:
+            return load(db)
+    return reads.do(key, run) if settings.COALESCE_READS else run()
@@ -1,58 +1,134 @@
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
-from typing import Optional, List
+from typing import Optional, List, Sequence, Tuple
 import uuid
 
+from config import settings
 from models import Image
-from schemas import ImageCreate, ImageUpdate
+from schemas import ImageBulkDelete, ImageCreate, ImageUpdate, UnlinkPair
+import changes
+import idfilter
+import idtypes
+import jobs
+import sparse
 
-def _validate_uuid_opt(id_str: Optional[str]) -> None:
+def _validate_uuid_opt(id_str: Optional[str]) -> Optional[str]:
     if id_str is None:
-        return
-    try:
-        uuid.UUID(str(id_str))
-    except Exception:
+        return None
+    if not idtypes.is_uuid(id_str):
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID: {id_str}")
+    return idtypes.canonical(id_str)
 
-def get(db: Session, image_id: str) -> Image:
-    obj = db.query(Image).filter(Image.id == image_id).first()
+def get(db: Session, image_id: str, fields: Optional[Sequence[str]] = None) -> Image:
+    """With `fields`, only those columns are loaded and a row tuple in that order is returned."""
+    query = db.query(*sparse.columns(Image, fields)) if fields else db.query(Image)
+    obj = query.filter(Image.id == image_id).first()
     if not obj:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
     return obj
 
-def list_all(db: Session, skip: int = 0, limit: int = 100) -> List[Image]:
-    return db.query(Image).offset(skip).limit(limit).all()
+def list_all(db: Session, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None) -> List[Image]:
+    query = db.query(*sparse.columns(Image, fields)) if fields else db.query(Image)
+    return query.offset(skip).limit(limit).all()
 
 def create(db: Session, payload: ImageCreate) -> Image:
-    iid = payload.id or str(uuid.uuid4())
-    _validate_uuid_opt(iid)
-    _validate_uuid_opt(payload.product_id)
+    iid = _validate_uuid_opt(payload.id or str(uuid.uuid4()))
+    product_id = _validate_uuid_opt(payload.product_id)
+    if product_id:
+        idfilter.require("product", [product_id])
 
     obj = Image(
         id=iid,
-        product_id=payload.product_id,
+        product_id=product_id,
         url=str(payload.url),
     )
     db.add(obj)
+    changes.record(db, "create", obj)
     db.commit()
     db.refresh(obj)
     return obj
 
 def update(db: Session, image_id: str, payload: ImageUpdate) -> Image:
     obj = get(db, image_id)
+    old_pid = obj.product_id
     if payload.url is not None:
         obj.url = str(payload.url)
     # product_id can be UUID or None (detach)
     if "product_id" in payload.model_fields_set:
-        _validate_uuid_opt(payload.product_id)
-        obj.product_id = payload.product_id
+        obj.product_id = _validate_uuid_opt(payload.product_id)
+        if obj.product_id and obj.product_id != old_pid:
+            idfilter.require("product", [obj.product_id])
+    if obj.product_id != old_pid:
+        if obj.product_id:
+            changes.record(db, "link", obj, relation="products", ref_id=obj.product_id)
+        else:
+            changes.record(db, "unlink", obj, relation="products", ref_id=old_pid)
+    else:
+        changes.record(db, "update", obj)
     db.commit()
     db.refresh(obj)
     return obj
 
-def delete(db: Session, image_id: str) -> Optional[str]:
-    obj = get(db, image_id)
-    old_pid = obj.product_id
-    db.delete(obj)
+def select_for_delete(db: Session, payload: ImageBulkDelete) -> Tuple[List[Image], List[str]]:
+    """The images a bulk delete names (ids) or matches (filter), and the named ids that do not exist."""
+    if (payload.ids is None) == (payload.product_id is None):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Give either ids or a filter (product_id)")
+    if payload.ids is not None:
+        bad = idtypes.first_invalid(payload.ids)
+        if bad is not None:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID: {bad}")
+        ids = list(dict.fromkeys(idtypes.canonical(s) for s in payload.ids))
+        if len(ids) > settings.BULK_DELETE_MAX_ROWS:
+            raise _too_many(len(ids))
+        objs = db.query(Image).filter(Image.id.in_(ids)).all() if ids else []
+        found = {obj.id for obj in objs}
+        return objs, [iid for iid in ids if iid not in found]
+    product_id = _validate_uuid_opt(payload.product_id)
+    objs = db.query(Image).filter(Image.product_id == product_id).all()
+    if len(objs) > settings.BULK_DELETE_MAX_ROWS:
+        raise _too_many(len(objs))
+    return objs, []
+
+def _too_many(n: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail=f"{n} images selected, a bulk delete removes at most {settings.BULK_DELETE_MAX_ROWS}",
+    )
+
+def delete_many(db: Session, objs: List[Image]) -> Optional[jobs.Job]:
+    """
+    Delete `objs` in one transaction (with whatever the caller staged, e.g. their content rows). Their
+    products are not called here: one product unlink per attached image is queued as a background job,
+    committed with the delete, and sent in batches by jobs.runner. Returns that job (None when no image
+    was attached).
+    """
+    tasks = []
+    for obj in objs:
+        if obj.product_id:
+            tasks.append(("product", "images", obj.product_id, obj.id))
+        changes.record(db, "delete", entity_id=obj.id)
+        db.delete(obj)
+    job = jobs.enqueue(db, "delete_cascade", tasks)
+    db.commit()
+    if job is not None:
+        jobs.runner.wake()
+    return job
+
+def bulk_unlink(db: Session, pairs: List[UnlinkPair]) -> int:
+    """
+    Detach each pair's image from its product, if it still points there (sent by Product's delete
+    cascade jobs), in one transaction. Unknown images and images since moved elsewhere are left alone,
+    so a retried batch is harmless. Returns how many pairs named an existing image.
+    """
+    bad = idtypes.first_invalid([p.id for p in pairs] + [p.ref_id for p in pairs])
+    if bad is not None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID: {bad}")
+    owner = {idtypes.canonical(p.id): idtypes.canonical(p.ref_id) for p in pairs}
+    applied = 0
+    for obj in db.query(Image).filter(Image.id.in_(list(owner))).all():
+        applied += 1
+        if obj.product_id is not None and obj.product_id == owner[obj.id]:
+            obj.product_id = None
+            changes.record(db, "unlink", obj, relation="products", ref_id=owner[obj.id])
     db.commit()
-    return old_pid
+    return applied
@@ -0,0 +1,362 @@
+import asyncio
+import hashlib
+import json
+import logging
+import secrets
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple, Union
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import settings
+from database import engine
+from models import IdempotencyRecord
+import storage
+import workers
+
+log = logging.getLogger("image.idempotency")
+
+MUTATING = {"POST", "PUT", "PATCH", "DELETE"}
+MAX_KEY_LENGTH = 255
+
+class _Entry:
+    __slots__ = ("fingerprint", "done", "status", "headers", "body", "expires")
+
+    def __init__(self, fingerprint: str, ttl: float):
+        self.fingerprint = fingerprint
+        self.done = asyncio.Event()
+        self.status: Optional[int] = None
+        self.headers: List[Tuple[bytes, bytes]] = []
+        self.body = b""
+        self.expires = time.monotonic() + ttl
+
+    @property
+    def finished(self) -> bool:
+        return self.done.is_set()
+
+class IdempotencyStore:
+    """
+    Bounded, expiring map of (method, path, Idempotency-Key) -> in-flight marker or stored response.
+    Lives on the event loop only, so it needs no locks.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries, self.ttl = max_entries, ttl
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        self.stored = 0
+        self.replayed = 0
+        self.waited = 0
+
+    async def lookup(self, key: tuple) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.done.is_set() and entry.expires < time.monotonic():
+            del self._entries[key]
+            return None
+        return entry
+
+    async def claim(self, key: tuple, fingerprint: str) -> Optional[_Entry]:
+        entry = self._entries[key] = _Entry(fingerprint, self.ttl)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)   # oldest first; waiters keep their reference
+        return entry
+
+    async def wait(self, key: tuple, entry: _Entry, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(asyncio.shield(entry.done.wait()), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def complete(self, key: tuple, entry: _Entry, status: int, headers, body: bytes) -> None:
+        entry.status, entry.headers, entry.body = status, list(headers), body
+        entry.expires = time.monotonic() + self.ttl
+        entry.done.set()
+        self.stored += 1
+
+    async def abandon(self, key: tuple, entry: _Entry) -> None:
+        """Forget a failed attempt so a retry with the same key runs again."""
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+        entry.done.set()
+
+    def snapshot(self) -> dict:
+        return {"entries": len(self._entries), "stored": self.stored, "replayed": self.replayed, "waited": self.waited}
+
+class _Record:
+    __slots__ = ("fingerprint", "token", "status", "headers", "body")
+
+    def __init__(self, fingerprint: str, token: str, status: Optional[int] = None, headers=None, body: Optional[bytes] = None):
+        self.fingerprint, self.token, self.status = fingerprint, token, status
+        self.headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers or []]
+        self.body = body or b""
+
+    @property
+    def finished(self) -> bool:
+        return self.status is not None
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class SharedStore:
+    """
+    The same records in the database (idempotency_keys), for several worker processes: a duplicate may
+    reach any worker. Claiming a key is an INSERT on its primary key, so exactly one worker runs the
+    request; duplicates poll the row until it holds the response. A claim whose worker died before
+    finishing is taken over after IDEMPOTENCY_LEASE_SECONDS. Expired rows are pruned as keys are claimed.
+    """
+
+    POLL_SECONDS = 0.05
+    PRUNE_EVERY = 1000
+
+    def __init__(self, ttl: float, lease: float):
+        self.ttl, self.lease = timedelta(seconds=ttl), timedelta(seconds=lease)
+        self.claims = 0
+        self.stored = 0
+        self.replayed = 0
+        self.waited = 0
+
+    @staticmethod
+    def _id(key: tuple) -> str:
+        return hashlib.sha256("\n".join(key).encode()).hexdigest()
+
+    def _lookup(self, key: tuple) -> Optional[_Record]:
+        t = IdempotencyRecord.__table__
+        with engine.begin() as conn:
+            row = conn.execute(select(t).where(t.c.key == self._id(key))).first()
+            if row is None:
+                return None
+            if row.expires_at < _now():
+                conn.execute(delete(t).where(t.c.key == row.key, t.c.token == row.token))
+                return None
+        return _Record(row.fingerprint, row.token, row.status, row.headers, row.body)
+
+    def _claim(self, key: tuple, fingerprint: str) -> Optional[_Record]:
+        t = IdempotencyRecord.__table__
+        token = secrets.token_hex(16)
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(t).values(
+                    key=self._id(key), fingerprint=fingerprint, token=token, expires_at=_now() + self.lease,
+                ))
+                self.claims += 1
+                if self.claims % self.PRUNE_EVERY == 0:
+                    conn.execute(delete(t).where(t.c.expires_at < _now()))
+        except IntegrityError:
+            return None                         # another worker claimed it first
+        return _Record(fingerprint, token)
+
+    def _finish(self, key: tuple, record: _Record, status: Optional[int], headers, body: bytes) -> None:
+        t = IdempotencyRecord.__table__
+        where = (t.c.key == self._id(key), t.c.token == record.token)
+        with engine.begin() as conn:
+            if status is None:
+                conn.execute(delete(t).where(*where))
+            else:
+                conn.execute(update(t).where(*where).values(
+                    status=status,
+                    headers=[[k.decode("latin-1"), v.decode("latin-1")] for k, v in headers],
+                    body=body,
+                    expires_at=_now() + self.ttl,
+                ))
+
+    async def lookup(self, key: tuple) -> Optional[_Record]:
+        return await run_in_threadpool(self._lookup, key)
+
+    async def claim(self, key: tuple, fingerprint: str) -> Optional[_Record]:
+        return await run_in_threadpool(self._claim, key, fingerprint)
+
+    async def wait(self, key: tuple, record: _Record, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.POLL_SECONDS)
+            current = await self.lookup(key)
+            if current is None or current.token != record.token or current.finished:
+                return True
+        return False
+
+    async def complete(self, key: tuple, record: _Record, status: int, headers, body: bytes) -> None:
+        await run_in_threadpool(self._finish, key, record, status, list(headers), body)
+        self.stored += 1
+
+    async def abandon(self, key: tuple, record: _Record) -> None:
+        await run_in_threadpool(self._finish, key, record, None, [], b"")
+
+    def snapshot(self) -> dict:
+        return {"shared": True, "stored": self.stored, "replayed": self.replayed, "waited": self.waited}
+
+store = (
+    SharedStore(settings.IDEMPOTENCY_TTL_SECONDS, settings.IDEMPOTENCY_LEASE_SECONDS) if workers.MULTI
+    else IdempotencyStore(settings.IDEMPOTENCY_MAX_ENTRIES, settings.IDEMPOTENCY_TTL_SECONDS)
+)
+
+async def _read_body(receive: Receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+def _replay_receive(body: bytes, receive: Receive) -> Receive:
+    sent = False
+
+    async def inner() -> Message:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+    return inner
+
+SPOOL_MEMORY = 1024 * 1024      # a keyed upload's body beyond this is spooled to a temp file
+
+class _TooLarge(Exception):
+    pass
+
+async def _spool_multipart(receive: Receive, boundary: bytes, digest) -> Receive:
+    """
+    Read a multipart body ahead of the app so the fingerprint covers the file and the fields, and
+    return a receive that replays it. Memory stays bounded: past SPOOL_MEMORY it goes to a temp file.
+    The boundary markers are left out of the hash, since a client's retry may pick a new boundary.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY)
+    marker, tail, size = b"--" + boundary, b"", 0
+    keep = len(marker) - 1                 # bytes held back in case they start a marker
+    try:
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > settings.IMAGE_MAX_BYTES + SPOOL_MEMORY:
+                raise _TooLarge()
+            await run_in_threadpool(spool.write, chunk)
+            data = (tail + chunk).replace(marker, b"")
+            digest.update(data[:-keep] if keep else data)
+            tail = data[-keep:] if keep else b""
+            if not message.get("more_body", False):
+                break
+        digest.update(tail)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    done = False
+
+    async def inner() -> Message:
+        nonlocal done
+        if done:
+            return await receive()
+        chunk = await run_in_threadpool(spool.read, storage.CHUNK)
+        if chunk:
+            return {"type": "http.request", "body": chunk, "more_body": True}
+        done = True
+        spool.close()
+        return {"type": "http.request", "body": b"", "more_body": False}
+    return inner
+
+async def _respond(send: Send, status: int, headers, body: bytes) -> None:
+    await send({"type": "http.response.start", "status": status, "headers": list(headers)})
+    await send({"type": "http.response.body", "body": body})
+
+async def _error(send: Send, status: int, detail: str, retry_after: Optional[int] = None) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    await _respond(send, status, headers, body)
+
+class IdempotencyMiddleware:
+    """
+    Mutating requests carrying `Idempotency-Key` run once per (method, path, key). A repeat gets the
+    stored response (marked `Idempotent-Replayed: true`) without touching crud or sync; a duplicate
+    that arrives while the first is still running waits for it. 5xx outcomes are not stored, so
+    the retry runs for real. Reusing a key with a different body is a 422.
+    """
+
+    def __init__(self, app: ASGIApp, store: Union[IdempotencyStore, SharedStore] = store):
+        self.app, self.store = app, store
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] not in MUTATING:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        raw_key = headers.get("idempotency-key")
+        if raw_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not raw_key.strip() or len(raw_key) > MAX_KEY_LENGTH:
+            await _error(send, 400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+            return
+
+        digest = hashlib.sha256(scope.get("query_string", b""))
+        ctype, params = storage.parse_options_header(headers.get("content-type", ""))
+        if ctype.startswith(b"multipart/") and params.get(b"boundary"):
+            try:
+                receive = await _spool_multipart(receive, params[b"boundary"], digest)
+            except _TooLarge:
+                await _error(send, 413, "Image too large")
+                return
+        else:
+            body = await _read_body(receive)
+            digest.update(body)
+            receive = _replay_receive(body, receive)
+        fingerprint = digest.hexdigest()
+        key = (scope["method"], scope["path"], raw_key)
+
+        while True:
+            entry = await self.store.lookup(key)
+            if entry is None:
+                entry = await self.store.claim(key, fingerprint)
+                if entry is None:               # another worker got there first
+                    continue
+                break
+            if entry.fingerprint != fingerprint:
+                await _error(send, 422, "Idempotency-Key was already used for a different request")
+                return
+            if entry.finished:
+                if entry.status is None:       # abandoned between our lookup() and now
+                    continue
+                self.store.replayed += 1
+                await _respond(send, entry.status, entry.headers + [(b"idempotent-replayed", b"true")], entry.body)
+                return
+            self.store.waited += 1
+            if not await self.store.wait(key, entry, settings.IDEMPOTENCY_WAIT_SECONDS):
+                await _error(send, 409, "A request with this Idempotency-Key is still in progress", retry_after=1)
+                return
+
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+        size = 0
+
+        async def capture(message: Message) -> None:
+            nonlocal start, size
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body" and size <= settings.IDEMPOTENCY_MAX_RESPONSE_BYTES:
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                chunks.append(chunk)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        except BaseException:
+            await self.store.abandon(key, entry)
+            raise
+        if start is None or start["status"] >= 500 or size > settings.IDEMPOTENCY_MAX_RESPONSE_BYTES:
+            await self.store.abandon(key, entry)
+        else:
+            await self.store.complete(key, entry, start["status"], start.get("headers", []), b"".join(chunks))
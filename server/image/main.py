@@ -1,31 +1,116 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
 import logging
-from fastapi import FastAPI, Depends, status
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Depends, Header, Query, Request, Response, status, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from config import settings
-from database import Base, engine
+from database import SessionLocal, engine, warm_pool
 from deps import get_db
+import bus
 import crud
-from schemas import ImageCreate, ImageUpdate, ImageOut
+import changes
+import events
+import admission
+import coalesce
+import compression
+import idempotency
+import idfilter
+import idtypes
+import jobs
+import profiling
+import snapshot
+import sparse
+import maintenance
+import probes
+import sync
+import workers
+import storage
+from schemas import (
+    ImageCreate, ImageUpdate, ImageOut,
+    ImageBulkDelete, BulkDeleteOut, BulkUnlink, BulkUnlinkOut, JobOut,
+)
 from sync import sync_link_to_product, sync_unlink_from_product
 
-# Initialize DB
-Base.metadata.create_all(bind=engine)
-
 # Logging
 logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO))
 log = logging.getLogger("image.service")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema is managed by `python migrate.py`, run before the server starts.
+    warmup_started = time.perf_counter()
+    warm_pool(settings.DB_WARM_CONNECTIONS)
+    probes.require_schema()
+    idfilter.owned.rebuild()
+    sync.warm_peers()
+    leader = app.state.leader = workers.elect(lambda: [changes.start_compactor(), jobs.start_runner(), maintenance.start()])
+    with SessionLocal() as db:
+        latest = changes.latest_seq(db)
+    events.broker.bind(asyncio.get_running_loop(), latest)
+    change_bus = bus.start(latest)
+    probes.startup.mark_ready(_IMPORT_STARTED, warmup_started)
+    yield
+    change_bus.stop()
+    leader.stop()
+
 app = FastAPI(
     title="Image Service",
     version="1.0.0",
     description="CRUD for images with single product association and bidirectional sync with Product service.",
+    lifespan=lifespan,
 )
+profiling.install(app, [engine])
+app.add_middleware(admission.AdmissionMiddleware, router=app.router)
+app.add_middleware(idempotency.IdempotencyMiddleware)
+app.add_middleware(compression.CompressionMiddleware)
 
 # ---- Health
 @app.get("/health")
 def health():
-    return {"status": "ok", "service": "image", "version": "1.0.0"}
+    # File size, free-page share and the last maintenance runs (those run in the leading worker only).
+    return {"status": "ok", "service": "image", "version": "1.0.0", "maintenance": maintenance.scheduler.snapshot()}
+
+@app.get("/livez")
+async def livez():
+    # Served on the event loop: stays answerable even when the threadpool or database is saturated.
+    return {"status": "alive"}
+
+@app.get("/readyz")
+def readyz():
+    ok, body = probes.readiness()
+    return JSONResponse(body, status_code=status.HTTP_200_OK if ok else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+@app.get("/admission")
+async def admission_stats():
+    return admission.controller.snapshot()
+
+@app.get("/workers")
+async def worker_stats():
+    # Answers for whichever worker the connection landed on.
+    return {"worker": app.state.leader.snapshot(), "bus": bus.channel.snapshot(), "idempotency": idempotency.store.snapshot()}
+
+@app.get("/idfilters")
+async def idfilter_stats():
+    return {"own": idfilter.owned.snapshot(), "peers": {peer: f.snapshot() for peer, f in idfilter.peers.items()}}
+
+@app.post("/admin/snapshot", status_code=status.HTTP_201_CREATED)
+def take_snapshot(x_admin_token: Optional[str] = Header(None)):
+    snapshot.authorize(x_admin_token)
+    try:
+        return snapshot.create()
+    except snapshot.SnapshotBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except snapshot.SnapshotError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 # ---- CRUD
 @app.post("/images", response_model=ImageOut, status_code=status.HTTP_201_CREATED)
@@ -37,12 +122,66 @@ def create_image(payload: ImageCreate, db: Session = Depends(get_db)):
     return created
 
 @app.get("/images", response_model=list[ImageOut])
-def list_images(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.list_all(db, skip=skip, limit=limit)
+def list_images(skip: int = 0, limit: int = 100, fields: Optional[str] = None):
+    names = sparse.parse(fields, ImageOut)
+    if names:
+        return JSONResponse(coalesce.read(
+            ("images", skip, limit, names),
+            lambda db: sparse.dump_all(ImageOut, names, crud.list_all(db, skip=skip, limit=limit, fields=names)),
+        ))
+    return coalesce.read(
+        ("images", skip, limit),
+        lambda db: [ImageOut.model_validate(x) for x in crud.list_all(db, skip=skip, limit=limit)],
+    )
+
+@app.delete("/images", response_model=BulkDeleteOut, status_code=status.HTTP_202_ACCEPTED)
+def bulk_delete_images(payload: ImageBulkDelete, response: Response, db: Session = Depends(get_db)):
+    objs, missing = crud.select_for_delete(db, payload)
+    job = _delete_images(db, objs)
+    if job is not None:
+        response.headers["Location"] = f"/jobs/{job.id}"
+    return BulkDeleteOut(deleted=len(objs), missing=missing, job_id=job.id if job else None)
+
+@app.post("/images/bulk-unlink", response_model=BulkUnlinkOut)
+def bulk_unlink_products(payload: BulkUnlink, db: Session = Depends(get_db)):
+    # Product's delete cascade: many (image, product) pairs per call.
+    return BulkUnlinkOut(applied=crud.bulk_unlink(db, payload.pairs))
+
+@app.get("/images/idfilter")
+def image_idfilter(if_none_match: Optional[str] = Header(None)):
+    # Bloom filter of every image id; peers cache it to reject links to missing ids (see idfilter.py).
+    etag, bloom = idfilter.owned.current()
+    headers = {
+        "ETag": etag, "Cache-Control": "no-cache",
+        "X-Filter-Bits": str(bloom.bits), "X-Filter-Hashes": str(bloom.hashes), "X-Filter-Ids": str(bloom.count),
+    }
+    if if_none_match == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(bytes(bloom.data), media_type="application/octet-stream", headers=headers)
+
+@app.get("/images/changes")
+def image_changes(since: int = 0, limit: int = Query(500, ge=1, le=5000), db: Session = Depends(get_db)):
+    return changes.read_since(db, since, limit)
+
+@app.get("/images/stream")
+async def image_stream(
+    since: Optional[int] = None,
+    id: Optional[str] = None,
+    related: Optional[str] = None,
+    ops: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+):
+    return events.open_stream(last_event_id, since, id, related, ops)
 
 @app.get("/images/{image_id}", response_model=ImageOut)
-def read_image(image_id: str, db: Session = Depends(get_db)):
-    return crud.get(db, image_id)
+def read_image(image_id: str, fields: Optional[str] = None):
+    names = sparse.parse(fields, ImageOut)
+    if names:
+        return JSONResponse(coalesce.read(
+            ("image", image_id, names),
+            lambda db: sparse.dump(ImageOut, names, crud.get(db, image_id, fields=names)),
+        ))
+    return coalesce.read(("image", image_id), lambda db: ImageOut.model_validate(crud.get(db, image_id)))
 
 @app.put("/images/{image_id}", response_model=ImageOut)
 def put_image(image_id: str, payload: ImageUpdate, db: Session = Depends(get_db)):
@@ -65,7 +204,78 @@ def patch_image(image_id: str, payload: ImageUpdate, db: Session = Depends(get_d
 
 @app.delete("/images/{image_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_image(image_id: str, db: Session = Depends(get_db)):
-    old_pid = crud.delete(db, image_id)
-    if old_pid:
-        sync_unlink_from_product(old_pid, image_id)
+    # The product is unlinked by a background job (see jobs.py), not before this returns.
+    _delete_images(db, [crud.get(db, image_id)])
     return None
+
+def _delete_images(db: Session, objs: list) -> Optional[jobs.Job]:
+    # Content rows go in the delete's transaction; blobs no image references any more are removed after it.
+    shas = {storage.detach(db, obj.id) for obj in objs}
+    job = crud.delete_many(db, objs)
+    for sha in shas:
+        storage.release(db, sha)
+    return job
+
+# ---- Background jobs
+@app.get("/jobs/{job_id}", response_model=JobOut)
+def read_job(job_id: str, db: Session = Depends(get_db)):
+    return jobs.out(jobs.get(db, job_id))
+
+@app.post("/jobs/{job_id}/retry", response_model=JobOut)
+def retry_job(job_id: str, db: Session = Depends(get_db)):
+    return jobs.out(jobs.retry(db, job_id))
+
+# ---- Local binary storage (enabled by IMAGE_STORAGE_DIR)
+@app.post("/images/upload", response_model=ImageOut, status_code=status.HTTP_201_CREATED)
+async def upload_image(request: Request):
+    """multipart/form-data: `file` plus optional `id` and `product_id` fields."""
+    upload = await storage.receive_upload(request)
+    try:
+        return await run_in_threadpool(_create_uploaded, upload)
+    finally:
+        await run_in_threadpool(storage.discard, upload)
+
+def _upload_payload(upload: storage.Upload) -> ImageCreate:
+    """The image the form fields describe, checked before anything is stored (422 on a bad field)."""
+    iid = upload.fields.get("id") or str(uuid.uuid4())
+    product_id = upload.fields.get("product_id") or None
+    for name, value in (("id", iid), ("product_id", product_id)):
+        if value is not None and not idtypes.is_uuid(value):
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID in form field {name}: {value}")
+    iid = idtypes.canonical(iid)
+    try:
+        return ImageCreate(id=iid, url=storage.content_url(iid, upload.sha256), product_id=product_id)
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=e.errors(include_url=False, include_context=False))
+
+def _create_uploaded(upload: storage.Upload):
+    payload = _upload_payload(upload)
+    with SessionLocal() as db:
+        with storage.stored(db, upload):
+            storage.attach(db, payload.id, upload)
+            created = crud.create(db, payload)
+        if created.product_id:
+            sync_link_to_product(created.product_id, created.id)
+        return ImageOut.model_validate(created)
+
+@app.put("/images/{image_id}/content", response_model=ImageOut)
+async def replace_image_content(image_id: str, request: Request):
+    upload = await storage.receive_upload(request)
+    try:
+        return await run_in_threadpool(_replace_content, image_id, upload)
+    finally:
+        await run_in_threadpool(storage.discard, upload)
+
+def _replace_content(image_id: str, upload: storage.Upload):
+    with SessionLocal() as db:
+        crud.get(db, image_id)
+        with storage.stored(db, upload):
+            previous = storage.attach(db, image_id, upload)
+            updated = crud.update(db, image_id, ImageUpdate(url=storage.content_url(image_id, upload.sha256)))
+        storage.release(db, previous)
+        return ImageOut.model_validate(updated)
+
+@app.api_route("/images/{image_id}/content", methods=["GET", "HEAD"])
+def read_image_content(image_id: str, request: Request, v: Optional[str] = None, db: Session = Depends(get_db)):
+    storage.require_enabled()
+    return storage.serve(request, storage.get_content(db, image_id), v)
@@ -0,0 +1,76 @@
+"""
+Versioned schema migrations. Run before starting the server:
+
+    python migrate.py            # upgrade to latest
+    python migrate.py --status   # print current / latest version
+
+Each step runs in its own transaction and is recorded in `schema_migrations`.
+Steps must be idempotent so an existing database created by `create_all` can adopt them.
+"""
+import logging
+import sys
+from datetime import datetime, timezone
+from typing import Callable, List, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select
+from sqlalchemy.engine import Connection, Engine
+
+from database import Base, engine
+import models  # noqa: F401  (registers tables on Base.metadata)
+
+log = logging.getLogger("image.migrate")
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _meta,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+def _create_tables(*names: str) -> Callable[[Connection], None]:
+    def step(conn: Connection) -> None:
+        Base.metadata.create_all(bind=conn, tables=[Base.metadata.tables[n] for n in names])
+    return step
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "images", _create_tables("images")),
+    (2, "change log", _create_tables("change_log", "change_log_meta")),
+    (3, "image content", _create_tables("image_contents")),
+    (4, "shared idempotency keys", _create_tables("idempotency_keys")),
+    (5, "background jobs", _create_tables("jobs", "job_tasks")),
+]
+LATEST = MIGRATIONS[-1][0]
+
+def current_version(conn: Connection) -> int:
+    """Highest applied migration (0 for a database that was never migrated). Read-only."""
+    if not inspect(conn).has_table(schema_migrations.name):
+        return 0
+    return conn.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+
+def upgrade(eng: Engine = engine) -> List[int]:
+    applied = []
+    with eng.begin() as conn:
+        _meta.create_all(bind=conn)
+        version = current_version(conn)
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        with eng.begin() as conn:
+            step(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=number, description=description,
+                applied_at=datetime.now(timezone.utc).replace(tzinfo=None),
+            ))
+        log.info("Applied migration %d: %s", number, description)
+        applied.append(number)
+    return applied
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if "--status" in sys.argv:
+        with engine.begin() as conn:
+            print(f"current={current_version(conn)} latest={LATEST}")
+    else:
+        applied = upgrade()
+        print(f"applied={applied or 'none'} latest={LATEST}")
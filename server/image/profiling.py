@@ -0,0 +1,204 @@
+import asyncio
+import cProfile
+import functools
+import hmac
+import inspect
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import secrets
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import settings
+
+log = logging.getLogger("image.profiling")
+
+# With no token and no sample rate nothing below is installed: no middleware, no route wrapper, no SQL hooks.
+ENABLED = bool(settings.PROFILE_TOKEN) or settings.PROFILE_SAMPLE_RATE > 0
+SKIP_SUFFIXES = ("/stream",)           # long-lived responses would hold a capture open indefinitely
+TOP_FUNCTIONS = 25
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+class Capture:
+    """What one profiled request recorded: its cProfile run and every SQL statement it issued."""
+
+    def __init__(self, method: str, path: str, reason: str):
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_")[:60] or "root"
+        self.id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{method}-{slug}-{secrets.token_hex(3)}"
+        self.method, self.path, self.reason = method, path, reason
+        self.started = time.perf_counter()
+        self.status: Optional[int] = None
+        self.profiler: Optional[cProfile.Profile] = None
+        self.queries: List[dict] = []
+
+_current: ContextVar[Optional[Capture]] = ContextVar("profile_capture", default=None)
+
+def _reason(scope: Scope) -> Optional[str]:
+    if scope["type"] != "http" or scope["path"].endswith(SKIP_SUFFIXES):
+        return None
+    if settings.PROFILE_TOKEN:
+        given = Headers(scope=scope).get("x-profile")
+        if given is not None and hmac.compare_digest(given.encode(), settings.PROFILE_TOKEN.encode()):
+            return "header"
+    if settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+# ---- Request hook
+class ProfilingMiddleware:
+    """Opens a capture for requests carrying the X-Profile token or picked by PROFILE_SAMPLE_RATE and writes it out afterwards."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        reason = _reason(scope)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+        capture = Capture(scope["method"], scope["path"], reason)
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                capture.status = message["status"]
+                MutableHeaders(scope=message).append("X-Profile-Id", capture.id)
+            await send(message)
+
+        token = _current.set(capture)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current.reset(token)
+            elapsed_ms = (time.perf_counter() - capture.started) * 1000
+            try:
+                await asyncio.to_thread(_write, capture, elapsed_ms)
+            except OSError as exc:
+                log.warning("Could not write profile %s: %s", capture.id, exc)
+
+class ProfiledRoute(APIRoute):
+    """
+    Runs sync endpoints under the request's profiler. cProfile only sees the thread that enables it,
+    so it has to start inside the worker thread FastAPI runs the endpoint on. Async endpoints share the
+    event loop with every other request and are not profiled (their SQL is still recorded).
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = _profiled(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+def _profiled(endpoint):
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        capture = _current.get()
+        if capture is None or capture.profiler is not None:
+            return endpoint(*args, **kwargs)
+        capture.profiler = cProfile.Profile()
+        return capture.profiler.runcall(endpoint, *args, **kwargs)
+    return wrapper
+
+# ---- SQL hook
+def _before(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+def _after(conn, cursor, statement, parameters, context, executemany):
+    capture = _current.get()
+    started = conn.info.get("profile_started")
+    if capture is None or not started:
+        return
+    ms = (time.perf_counter() - started.pop()) * 1000
+    entry = {"sql": statement, "ms": round(ms, 3)}
+    if executemany:
+        entry["batch"] = len(parameters)
+    if ms >= settings.PROFILE_SLOW_QUERY_MS:
+        entry["slow"] = True
+        plan = _plan(conn, statement, parameters, executemany)
+        if plan:
+            entry["plan"] = plan
+    capture.queries.append(entry)
+
+def _failed(context):
+    started = context.connection.info.get("profile_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+def _plan(conn, statement: str, parameters, executemany: bool) -> Optional[List[str]]:
+    if conn.dialect.name != "sqlite" or executemany or not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    try:
+        # A second cursor on the same connection: the statement's own cursor keeps its rows.
+        cur = conn.connection.cursor()
+        try:
+            cur.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            return [row[-1] for row in cur.fetchall()]
+        finally:
+            cur.close()
+    except Exception as exc:
+        log.debug("EXPLAIN QUERY PLAN failed: %s", exc)
+        return None
+
+# ---- Reports
+def _top(profiler: cProfile.Profile) -> List[dict]:
+    stats = pstats.Stats(profiler).stats     # (file, line, function) -> (primitive calls, calls, self s, cumulative s, callers)
+    rows = sorted(stats.items(), key=lambda kv: kv[1][3], reverse=True)[:TOP_FUNCTIONS]
+    return [
+        {"function": f"{file}:{line}({name})", "calls": calls, "self_ms": round(tt * 1000, 3), "cumulative_ms": round(ct * 1000, 3)}
+        for (file, line, name), (_, calls, tt, ct, _) in rows
+    ]
+
+def _write(capture: Capture, elapsed_ms: float) -> None:
+    flags = []
+    if len(capture.queries) > settings.PROFILE_MAX_QUERIES:
+        flags.append("too_many_queries")
+    if any(q.get("slow") for q in capture.queries):
+        flags.append("slow_queries")
+    report = {
+        "id": capture.id,
+        "method": capture.method,
+        "path": capture.path,
+        "reason": capture.reason,
+        "status": capture.status,
+        "ms": round(elapsed_ms, 3),
+        "query_count": len(capture.queries),
+        "query_ms": round(sum(q["ms"] for q in capture.queries), 3),
+        "flags": flags,
+        "queries": capture.queries,
+        "top": [],
+    }
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    base = os.path.join(settings.PROFILE_DIR, capture.id)
+    if capture.profiler is not None:
+        capture.profiler.dump_stats(base + ".prof")
+        report["top"] = _top(capture.profiler)
+    with open(base + ".json", "w") as f:
+        json.dump(report, f, indent=1)
+    if flags:
+        log.warning("Profiled %s %s: %d queries in %.1f ms (%s) -> %s",
+                    capture.method, capture.path, len(capture.queries), elapsed_ms, ", ".join(flags), base + ".json")
+
+def install(app: FastAPI, engines: Iterable[Engine]) -> None:
+    """Hooks profiling into `app` and `engines` when enabled. Call before routes are declared and before other middleware."""
+    if not ENABLED:
+        return
+    app.router.route_class = ProfiledRoute
+    app.add_middleware(ProfilingMiddleware)
+    for eng in engines:
+        event.listen(eng, "before_cursor_execute", _before)
+        event.listen(eng, "after_cursor_execute", _after)
+        event.listen(eng, "handle_error", _failed)
+    log.info("Profiling on (header: %s, sample rate: %s) -> %s",
+             "yes" if settings.PROFILE_TOKEN else "no", settings.PROFILE_SAMPLE_RATE, settings.PROFILE_DIR)
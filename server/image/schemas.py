@@ -1,4 +1,5 @@
-from typing import Optional, Annotated
+from datetime import datetime
+from typing import List, Optional, Annotated
 from pydantic import BaseModel, Field, HttpUrl
 
 class ImageBase(BaseModel):
@@ -17,3 +18,35 @@ class ImageOut(ImageBase):
 
     class Config:
         from_attributes = True
+
+class ImageBulkDelete(BaseModel):
+    ids: Optional[List[str]] = None
+    product_id: Optional[str] = None   # filter: every image attached to this product
+
+class BulkDeleteOut(BaseModel):
+    deleted: int
+    missing: List[str] = Field(default_factory=list)  # requested ids that did not exist
+    job_id: Optional[str] = None                      # product unlinks still being sent (GET /jobs/{job_id})
+
+class UnlinkPair(BaseModel):
+    id: str       # image
+    ref_id: str   # product it should no longer point at
+
+class BulkUnlink(BaseModel):
+    relation: Optional[str] = None
+    pairs: List[UnlinkPair]
+
+class BulkUnlinkOut(BaseModel):
+    applied: int   # pairs naming an existing image (already detached ones included)
+
+class JobOut(BaseModel):
+    id: str
+    kind: str
+    status: str    # pending|running|done|failed
+    total: int
+    done: int
+    pending: int
+    attempts: int
+    last_error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
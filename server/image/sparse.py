@@ -0,0 +1,36 @@
+from functools import lru_cache
+from typing import Any, Iterable, List, Optional, Tuple, Type
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel, TypeAdapter
+
+def parse(fields: Optional[str], schema: Type[BaseModel]) -> Optional[Tuple[str, ...]]:
+    """`?fields=id,name,price` -> ("id", "name", "price"); None means the full representation."""
+    if fields is None:
+        return None
+    names = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [n for n in names if n not in schema.model_fields]
+    if not names or unknown:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Unknown field(s) {', '.join(unknown) or '(none given)'}; allowed: {', '.join(schema.model_fields)}",
+        )
+    return names
+
+def columns(model, names: Iterable[str]) -> list:
+    return [getattr(model, n) for n in names]
+
+@lru_cache(maxsize=None)
+def _adapter(schema: Type[BaseModel], name: str) -> TypeAdapter:
+    return TypeAdapter(schema.model_fields[name].annotation)
+
+def dump(schema: Type[BaseModel], names: Tuple[str, ...], row) -> dict:
+    """One projected row -> JSON-ready dict, serialized exactly as the full schema would serialize those fields."""
+    out = {}
+    for name, value in zip(names, row):
+        adapter = _adapter(schema, name)
+        out[name] = adapter.dump_python(adapter.validate_python(value), mode="json")
+    return out
+
+def dump_all(schema: Type[BaseModel], names: Tuple[str, ...], rows: Iterable[Any]) -> List[dict]:
+    return [dump(schema, names, row) for row in rows]
@@ -0,0 +1,343 @@
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+try:  # python-multipart >= 0.0.13 renamed its top-level package
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # pragma: no cover
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from config import settings
+from models import ImageContent
+
+log = logging.getLogger("image.storage")
+
+CHUNK = 64 * 1024
+
+def enabled() -> bool:
+    return bool(settings.IMAGE_STORAGE_DIR)
+
+def require_enabled() -> None:
+    if not enabled():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Local image storage is disabled")
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(settings.IMAGE_STORAGE_DIR, sha256[:2], sha256[2:4], sha256)
+
+def content_url(image_id: str, sha256: str) -> str:
+    return f"{settings.PUBLIC_BASE_URL.rstrip('/')}/images/{image_id}/content?v={sha256[:16]}"
+
+# ---- Streaming multipart upload
+class Upload:
+    """Result of a streamed upload: the file part is on disk and hashed, still in a temp file (see stored())."""
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.sha256: Optional[str] = None
+        self.tmp_path: Optional[str] = None
+        self.size = 0
+        self.content_type = "application/octet-stream"
+
+class _PartSink:
+    """Feeds multipart parser callbacks: form fields are buffered (small), the file part goes straight to a temp file."""
+
+    def __init__(self, tmp_dir: str):
+        self.tmp_dir = tmp_dir
+        self.upload = Upload()
+        self.pending = []          # file chunks waiting to be written off the event loop
+        self.tmp = None
+        self.hasher = None
+        self._headers: Dict[str, str] = {}
+        self._field = b""
+        self._value = b""
+        self._name: Optional[str] = None
+        self._is_file = False
+        self._buf = bytearray()
+
+    # header callbacks
+    def on_part_begin(self):
+        self._headers, self._name, self._is_file, self._buf = {}, None, False, bytearray()
+
+    def on_header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._field.decode("latin-1").lower()] = self._value.decode("latin-1")
+        self._field, self._value = b"", b""
+
+    def on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get("content-disposition", ""))
+        self._name = (params.get(b"name") or b"").decode("utf-8", "replace")
+        self._is_file = b"filename" in params
+        if self._is_file:
+            if self.tmp is not None:
+                raise HTTPException(status_code=422, detail="Only one file part is accepted")
+            self.tmp = tempfile.NamedTemporaryFile(dir=self.tmp_dir, delete=False)
+            self.hasher = hashlib.sha256()
+            self.upload.content_type = self._headers.get("content-type") or self.upload.content_type
+
+    def on_part_data(self, data, start, end):
+        chunk = data[start:end]
+        if self._is_file:
+            self.upload.size += len(chunk)
+            if self.upload.size > settings.IMAGE_MAX_BYTES:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Image too large")
+            self.hasher.update(chunk)
+            self.pending.append(chunk)
+        else:
+            self._buf += chunk
+            if len(self._buf) > 64 * 1024:
+                raise HTTPException(status_code=422, detail=f"Form field too large: {self._name}")
+
+    def on_part_end(self):
+        if not self._is_file and self._name:
+            self.upload.fields[self._name] = self._buf.decode("utf-8", "replace")
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def flush(self):
+        chunks, self.pending = self.pending, []
+        for c in chunks:
+            self.tmp.write(c)
+
+    def discard(self):
+        if self.tmp is not None:
+            self.tmp.close()
+            try:
+                os.unlink(self.tmp.name)
+            except FileNotFoundError:
+                pass
+
+async def receive_upload(request: Request) -> Upload:
+    """
+    Parse a multipart/form-data body chunk by chunk. Memory stays bounded by one network chunk;
+    the file part is hashed while it is written. stored() moves it to its content address (deduplicated),
+    discard() drops it if the request fails before that.
+    """
+    require_enabled()
+    ctype, params = parse_options_header(request.headers.get("content-type", ""))
+    if ctype != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=415, detail="Expected multipart/form-data")
+    tmp_dir = os.path.join(settings.IMAGE_STORAGE_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    sink = _PartSink(tmp_dir)
+    parser = MultipartParser(params[b"boundary"], sink.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if sink.pending:
+                await run_in_threadpool(sink.flush)
+        parser.finalize()
+        if sink.tmp is None:
+            raise HTTPException(status_code=422, detail="Missing file part")
+        await run_in_threadpool(sink.flush)
+        sink.tmp.close()
+        upload = sink.upload
+        upload.sha256, upload.tmp_path = sink.hasher.hexdigest(), sink.tmp.name
+        return upload
+    except BaseException:
+        sink.discard()
+        raise
+
+def discard(upload: Upload) -> None:
+    """Remove the upload's temp file, unless stored() has moved it into place."""
+    if upload.tmp_path is not None:
+        try:
+            os.unlink(upload.tmp_path)
+        except FileNotFoundError:
+            pass
+        upload.tmp_path = None
+
+@contextmanager
+def _blob_lock(sha256: str) -> Iterator[None]:
+    # An flock, so worker processes exclude each other too; one lock file per 3-hex-digit hash prefix.
+    path = os.path.join(settings.IMAGE_STORAGE_DIR, "locks", sha256[:3])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+def _commit_blob(tmp_name: str, sha256: str) -> None:
+    # Identical bytes map to the same path, so a repeat upload just replaces the file in place (dedup).
+    path = blob_path(sha256)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_name, path)
+
+@contextmanager
+def stored(db: Session, upload: Upload) -> Iterator[None]:
+    """
+    Move the upload to its content address for a block that commits the row referencing it. The hash
+    stays locked until then, so a release() of the same content cannot unlink the file in between.
+    If the block fails, `db` is rolled back and the file removed unless another image references it.
+    """
+    with _blob_lock(upload.sha256):
+        _commit_blob(upload.tmp_path, upload.sha256)
+        upload.tmp_path = None
+        try:
+            yield
+        except BaseException:
+            db.rollback()
+            _unlink_unreferenced(db, upload.sha256)
+            raise
+
+# ---- Metadata
+def attach(db: Session, image_id: str, upload: Upload) -> Optional[str]:
+    """Point `image_id` at the uploaded blob; returns the previous hash if it changed."""
+    row = db.get(ImageContent, image_id)
+    previous = row.sha256 if row else None
+    if row is None:
+        row = ImageContent(image_id=image_id)
+        db.add(row)
+    row.sha256, row.size, row.content_type = upload.sha256, upload.size, upload.content_type
+    return previous if previous != upload.sha256 else None
+
+def detach(db: Session, image_id: str) -> Optional[str]:
+    """Drop the content row of a deleted image (same transaction); returns its hash for release()."""
+    row = db.get(ImageContent, image_id)
+    if row is None:
+        return None
+    db.delete(row)
+    return row.sha256
+
+def get_content(db: Session, image_id: str) -> ImageContent:
+    row = db.get(ImageContent, image_id)
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image has no stored content")
+    return row
+
+def _unlink_unreferenced(db: Session, sha256: str) -> None:
+    if db.query(ImageContent).filter(ImageContent.sha256 == sha256).first():
+        return
+    try:
+        os.unlink(blob_path(sha256))
+    except FileNotFoundError:
+        pass
+
+def release(db: Session, sha256: Optional[str]) -> None:
+    """Remove the blob file once no image references it any more (call after commit)."""
+    if sha256:
+        with _blob_lock(sha256):
+            _unlink_unreferenced(db, sha256)
+
+# ---- Serving
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Single byte range -> (start, end inclusive). None means serve the whole body; raises 416 if unsatisfiable."""
+    if not header:
+        return None
+    m = _RANGE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None                  # multi-range or malformed: fall back to 200
+    if m.group(1):
+        start = int(m.group(1))
+        end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    else:
+        start, end = max(size - int(m.group(2)), 0), size - 1
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+class BlobResponse(Response):
+    """
+    Serves a stored blob (or a byte range of it). Uses the ASGI zero-copy extensions when the server
+    offers them (`http.response.pathsend` / `http.response.zerocopysend`), else streams in chunks
+    read off the event loop.
+    """
+
+    def __init__(self, path: str, status_code: int, headers: Dict[str, str], start: int = 0, length: int = 0, body: bool = True):
+        self.path, self.status_code, self.blob_headers = path, status_code, headers
+        self.start, self.length, self.send_body = start, length, body
+        self.background = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        raw_headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in self.blob_headers.items()]
+        await send({"type": "http.response.start", "status": self.status_code, "headers": raw_headers})
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        extensions = scope.get("extensions") or {}
+        whole = self.start == 0 and self.status_code == 200
+        if whole and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": self.path})
+            return
+        with open(self.path, "rb") as f:
+            if "http.response.zerocopysend" in extensions:
+                await send({"type": "http.response.zerocopysend", "file": f.fileno(), "offset": self.start, "count": self.length})
+                return
+            f.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await run_in_threadpool(f.read, min(CHUNK, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b""})
+
+def serve(request: Request, content: ImageContent, version: Optional[str]):
+    path = blob_path(content.sha256)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image content missing on disk")
+    etag = f'"{content.sha256}"'
+    # A versioned URL (?v=<hash prefix>) never changes meaning, so it can be cached forever.
+    if version and content.sha256.startswith(version):
+        cache = f"public, max-age={settings.IMAGE_CACHE_MAX_AGE}, immutable"
+    else:
+        cache = "public, no-cache"
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache,
+        "Accept-Ranges": "bytes",
+        "Content-Type": content.content_type,
+        "X-Content-Type-Options": "nosniff",
+    }
+    inm = request.headers.get("if-none-match")
+    if inm and (inm.strip() == "*" or etag in [t.strip() for t in inm.split(",")]):
+        return BlobResponse(path, 304, headers, body=False)
+
+    size = content.size
+    rng = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if rng and if_range and if_range.strip() != etag:
+        rng = None                    # representation changed since the client's partial copy
+    span = parse_range(rng, size)
+    head_only = request.method == "HEAD"
+    if span is None:
+        headers["Content-Length"] = str(size)
+        return BlobResponse(path, 200, headers, 0, size, body=not head_only)
+    start, end = span
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return BlobResponse(path, 206, headers, start, end - start + 1, body=not head_only)
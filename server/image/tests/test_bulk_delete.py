@@ -0,0 +1,78 @@
+import asyncio
+import hashlib
+import os
+import uuid
+
+import httpx
+
+from models import Image, Job, JobTask
+from schemas import ImageCreate
+from main import app
+import crud
+import jobs
+import storage
+import sync
+
+def _request(method, path, **kwargs):
+    async def go():
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, path, **kwargs)
+    return asyncio.run(go())
+
+def _no_peer_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(sync, "_safe_request", lambda *args, **kwargs: calls.append(args))
+    return calls
+
+def _attach(db, image_id, product_id):
+    db.get(Image, image_id).product_id = product_id
+    db.commit()
+
+def test_bulk_delete_queues_product_unlinks_and_removes_content(db, monkeypatch):
+    pid, other = str(uuid.uuid4()), str(uuid.uuid4())
+    a = crud.create(db, ImageCreate(url="http://x/a.png", product_id=pid)).id
+    b = crud.create(db, ImageCreate(url="http://x/b.png", product_id=other)).id
+    resp = _request("POST", "/images/upload", files={"file": ("c.png", b"bytes", "image/png")})
+    c = resp.json()["id"]
+    _attach(db, c, pid)
+    calls = _no_peer_calls(monkeypatch)
+
+    resp = _request("DELETE", "/images", json={"product_id": pid})
+
+    assert resp.status_code == 202, resp.text
+    body = resp.json()
+    assert body["deleted"] == 2 and body["missing"] == []
+    assert resp.headers["location"] == f"/jobs/{body['job_id']}"
+    assert calls == []                                   # nothing sent before the response
+    db.expire_all()
+    assert [i.id for i in db.query(Image).all()] == [b]
+    assert not os.path.exists(storage.blob_path(hashlib.sha256(b"bytes").hexdigest()))
+    tasks = db.query(JobTask).filter(JobTask.job_id == body["job_id"]).all()
+    assert sorted((t.peer, t.relation, t.owner_id, t.ref_id) for t in tasks) == sorted(
+        [("product", "images", pid, a), ("product", "images", pid, c)]
+    )
+
+def test_job_runner_sends_one_batch_per_peer(db, monkeypatch):
+    pid = str(uuid.uuid4())
+    ids = [crud.create(db, ImageCreate(url=f"http://x/{n}.png", product_id=pid)).id for n in range(3)]
+    _no_peer_calls(monkeypatch)
+    job_id = _request("DELETE", "/images", json={"ids": ids + [str(uuid.uuid4())]}).json()["job_id"]
+    sent = []
+    monkeypatch.setattr(sync, "bulk_unlink", lambda peer, relation, pairs: sent.append((peer, relation, sorted(pairs))))
+
+    assert jobs.run_once(db) is True
+
+    assert sent == [("product", "images", sorted((pid, i) for i in ids))]
+    job = db.get(Job, job_id)
+    assert (job.status, job.done, job.total) == ("done", 3, 3)
+    assert _request("GET", f"/jobs/{job_id}").json()["pending"] == 0
+
+def test_single_delete_is_204_and_unattached_images_queue_nothing(db, monkeypatch):
+    iid = crud.create(db, ImageCreate(url="http://x/a.png")).id
+    calls = _no_peer_calls(monkeypatch)
+
+    assert _request("DELETE", f"/images/{iid}").status_code == 204
+
+    assert calls == []
+    assert db.query(Image).count() == 0 and db.query(Job).count() == 0
@@ -0,0 +1,100 @@
+import asyncio
+import hashlib
+import os
+import threading
+import uuid
+
+import httpx
+
+from config import settings
+from database import SessionLocal
+from models import ImageContent
+from main import app
+import storage
+
+def _post(path, content, **fields):
+    async def go():
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(path, data=fields, files={"file": ("a.png", content, "image/png")})
+    return asyncio.run(go())
+
+def _blobs():
+    """Files under the storage dir other than lock files."""
+    root = settings.IMAGE_STORAGE_DIR
+    return sorted(
+        os.path.relpath(os.path.join(d, f), root)
+        for d, _, files in os.walk(root) for f in files
+        if os.path.relpath(d, root).split(os.sep)[0] != "locks"
+    )
+
+def test_upload_stores_content(db):
+    resp = _post("/images/upload", b"one")
+    assert resp.status_code == 201
+    assert _blobs() == [os.path.relpath(storage.blob_path(hashlib.sha256(b"one").hexdigest()), settings.IMAGE_STORAGE_DIR)]
+
+def test_bad_form_field_is_422_and_stores_nothing(db):
+    for fields in ({"id": "not a uuid"}, {"product_id": "nope"}):
+        resp = _post("/images/upload", b"two", **fields)
+        assert resp.status_code == 422, resp.text
+    assert _blobs() == []
+
+def test_failed_create_removes_the_new_blob(db):
+    iid = str(uuid.uuid4())
+    assert _post("/images/upload", b"first", id=iid).status_code == 201
+    before = _blobs()
+
+    resp = _post("/images/upload", b"second", id=iid)      # same id: the insert fails
+
+    assert resp.status_code >= 400
+    assert _blobs() == before
+    assert db.query(ImageContent).count() == 1
+
+def test_failed_create_keeps_content_another_image_uses(db):
+    assert _post("/images/upload", b"shared").status_code == 201
+    iid = db.query(ImageContent).one().image_id
+
+    assert _post("/images/upload", b"shared", id=iid).status_code >= 400
+
+    assert os.path.exists(storage.blob_path(hashlib.sha256(b"shared").hexdigest()))
+
+def test_release_waits_for_an_upload_of_the_same_content(db):
+    assert _post("/images/upload", b"busy").status_code == 201
+    row = db.query(ImageContent).one()
+    sha, iid = row.sha256, row.image_id
+    db.delete(row)
+    db.commit()
+
+    def release():
+        with SessionLocal() as other:
+            storage.release(other, sha)
+
+    # An upload of the same bytes holds the hash's lock from moving the file into place until its row
+    # commits: a release that starts meanwhile waits, then sees the row and keeps the file.
+    releasing = threading.Thread(target=release)
+    with storage._blob_lock(sha):
+        releasing.start()
+        releasing.join(0.2)
+        assert releasing.is_alive()
+        db.add(ImageContent(image_id=iid, sha256=sha, size=4, content_type="image/png"))
+        db.commit()
+    releasing.join(5)
+    assert os.path.exists(storage.blob_path(sha))
+
+def test_keyed_upload_replays_only_the_same_file(db):
+    key = {"Idempotency-Key": "upload-1"}
+
+    async def go():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            send = lambda content: client.post("/images/upload", headers=key, files={"file": ("a.png", content, "image/png")})
+            return await send(b"AAAA"), await send(b"BBBB"), await send(b"AAAA")
+
+    first, other_file, retry = asyncio.run(go())
+
+    assert first.status_code == 201
+    assert other_file.status_code == 422               # same size, different bytes
+    assert retry.status_code == 201                    # a new multipart boundary, the same file
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert db.query(ImageContent).count() == 1
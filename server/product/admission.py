@@ -0,0 +1,176 @@
+import asyncio
+import itertools
+import json
+import logging
+from collections import Counter
+from typing import Dict, List, Optional
+
+from starlette.routing import Match, Router
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import settings
+
+log = logging.getLogger("product.admission")
+
+# Long-lived or probe endpoints are never queued or shed.
+EXEMPT_PATHS = {"/health", "/livez", "/readyz", "/admission"}
+EXEMPT_SUFFIXES = ("/stream",)
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "route", "future")
+
+    def __init__(self, priority: int, seq: int, route: str, future: asyncio.Future):
+        self.priority, self.seq, self.route, self.future = priority, seq, route, future
+
+class AdmissionController:
+    """
+    Concurrency limits for the whole service and per route ("METHOD /path/{template}"), with one
+    bounded wait queue. Reads are served from the queue before writes, and a full queue evicts the
+    newest queued write to make room for a read. Everything runs on the event loop, so no locks.
+    """
+
+    def __init__(self, limit: int, queue_size: int, queue_timeout: float, route_limits: Dict[str, int]):
+        self.limit, self.queue_size, self.queue_timeout = limit, queue_size, queue_timeout
+        self.route_limits = dict(route_limits)
+        self.in_flight = 0
+        self.route_in_flight: Counter = Counter()
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self.admitted: Counter = Counter()
+        self.queued: Counter = Counter()
+        self.shed: Counter = Counter()        # by reason: queue_full | timeout | evicted
+        self.route_shed: Counter = Counter()
+
+    def _can_run(self, route: str) -> bool:
+        limit = self.route_limits.get(route)
+        return self.in_flight < self.limit and (limit is None or self.route_in_flight[route] < limit)
+
+    def _grant(self, route: str) -> None:
+        self.in_flight += 1
+        self.route_in_flight[route] += 1
+        self.admitted[route] += 1
+
+    def _reject(self, route: str, reason: str) -> None:
+        self.shed[reason] += 1
+        self.route_shed[route] += 1
+
+    async def acquire(self, route: str, read: bool) -> Optional[str]:
+        """Returns None once admitted, else the reason the request was shed."""
+        if self._can_run(route):
+            self._grant(route)
+            return None
+        priority = 0 if read else 1
+        if len(self._waiters) >= self.queue_size:
+            victim = max(self._waiters, key=lambda w: (w.priority, w.seq), default=None)
+            if victim is None or victim.priority <= priority:   # no queue at all, or nothing worse queued
+                self._reject(route, "queue_full")
+                return "queue_full"
+            self._waiters.remove(victim)
+            self._reject(victim.route, "evicted")
+            victim.future.set_result("evicted")
+        waiter = _Waiter(priority, next(self._seq), route, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self.queued[route] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.future.done():           # granted while the timeout fired
+                return waiter.future.result()
+            self._waiters.remove(waiter)
+            waiter.future.cancel()
+            self._reject(route, "timeout")
+            return "timeout"
+        except asyncio.CancelledError:         # client went away while queued
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.future.done() and waiter.future.result() is None:
+                self.release(route)
+            raise
+
+    def release(self, route: str) -> None:
+        self.in_flight -= 1
+        self.route_in_flight[route] -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        for waiter in sorted(self._waiters, key=lambda w: (w.priority, w.seq)):
+            if self.in_flight >= self.limit:
+                break
+            if self._can_run(waiter.route):
+                self._waiters.remove(waiter)
+                self._grant(waiter.route)
+                waiter.future.set_result(None)
+
+    def snapshot(self) -> dict:
+        routes = set(self.route_limits) | set(self.admitted) | set(self.route_shed)
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "queue_size": self.queue_size,
+            "queue_timeout": self.queue_timeout,
+            "admitted": sum(self.admitted.values()),
+            "queued": sum(self.queued.values()),
+            "shed": dict(self.shed),
+            "routes": {
+                r: {
+                    "limit": self.route_limits.get(r),
+                    "in_flight": self.route_in_flight[r],
+                    "queued": sum(1 for w in self._waiters if w.route == r),
+                    "admitted": self.admitted[r],
+                    "shed": self.route_shed[r],
+                }
+                for r in sorted(routes)
+            },
+        }
+
+controller = AdmissionController(
+    settings.ADMISSION_MAX_CONCURRENCY,
+    settings.ADMISSION_QUEUE_SIZE,
+    settings.ADMISSION_QUEUE_TIMEOUT,
+    settings.ADMISSION_ROUTE_LIMITS,
+)
+
+class AdmissionMiddleware:
+    """ASGI middleware: holds an admission slot from routing until the response is fully sent."""
+
+    def __init__(self, app: ASGIApp, router: Router, controller: AdmissionController = controller):
+        self.app, self.router, self.controller = app, router, controller
+
+    def _route_key(self, scope: Scope) -> str:
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return f"{scope['method']} {route.path}"
+        return f"{scope['method']} *"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        path = scope.get("path", "")
+        if (scope["type"] != "http" or self.controller.limit <= 0
+                or path in EXEMPT_PATHS or path.endswith(EXEMPT_SUFFIXES)):
+            await self.app(scope, receive, send)
+            return
+        route = self._route_key(scope)
+        reason = await self.controller.acquire(route, scope["method"] in READ_METHODS)
+        if reason is not None:
+            log.info("Shed %s (%s)", route, reason)
+            await _overloaded(send, reason)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route)
+
+async def _overloaded(send: Send, reason: str) -> None:
+    body = json.dumps({"detail": "Service overloaded, retry later", "reason": reason}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(settings.ADMISSION_RETRY_AFTER).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
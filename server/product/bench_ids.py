@@ -0,0 +1,104 @@
+"""
+Text vs binary id storage at scale (writes two scratch SQLite files, never the service database):
+
+    python bench_ids.py                   # 1,000,000 rows
+    python bench_ids.py --rows 5000000 --lookups 50000 --dir /tmp
+
+Each file holds `rows` products shaped like the real table's id columns (UUID primary key, three linked
+ids in a list) plus an indexed foreign-key column. Reported: file size, primary key index size, random
+point lookups through the ORM type, and the id-list validator against the per-id uuid.UUID loop.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from typing import List
+
+from sqlalchemy import Column, Index, MetaData, Table, create_engine, select
+
+from idtypes import UUIDBytes, UUIDList, first_invalid
+
+def _table(binary: bool) -> Table:
+    meta = MetaData()
+    return Table(
+        "products", meta,
+        Column("id", UUIDBytes(binary), primary_key=True),
+        Column("owner_id", UUIDBytes(binary), nullable=False),
+        Column("linked_ids", UUIDList(binary), nullable=False),
+        Index("ix_products_owner_id", "owner_id"),
+    )
+
+def _index_bytes(conn, name: str) -> int:
+    try:
+        return conn.exec_driver_sql("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)).scalar() or 0
+    except Exception:
+        return -1                      # SQLite built without the dbstat table
+
+def run(binary: bool, ids: List[str], owners: List[str], lookups: int, directory: str) -> dict:
+    path = os.path.join(directory, f"bench_ids_{'binary' if binary else 'text'}.db")
+    if os.path.exists(path):
+        os.unlink(path)
+    engine = create_engine(f"sqlite:///{path}")
+    table = _table(binary)
+    table.metadata.create_all(engine)
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        batch = 20000
+        for i in range(0, len(ids), batch):
+            conn.execute(table.insert(), [
+                {"id": pid, "owner_id": owners[j % len(owners)], "linked_ids": owners[j % 7:j % 7 + 3]}
+                for j, pid in enumerate(ids[i:i + batch], start=i)
+            ])
+    insert_s = time.perf_counter() - started
+    with engine.connect() as conn:
+        pk_index = _index_bytes(conn, "sqlite_autoindex_products_1")
+        sample = random.sample(ids, min(lookups, len(ids)))
+        query = select(table.c.id, table.c.linked_ids)
+        started = time.perf_counter()
+        for pid in sample:
+            row = conn.execute(query.where(table.c.id == pid)).first()
+            assert row is not None and row.id == pid
+        lookup_s = time.perf_counter() - started
+    engine.dispose()
+    return {
+        "mode": "binary" if binary else "text",
+        "file_mb": round(os.path.getsize(path) / 1e6, 1),
+        "pk_index_mb": round(pk_index / 1e6, 1) if pk_index >= 0 else "n/a",
+        "insert_s": round(insert_s, 1),
+        "lookups_per_s": round(len(sample) / lookup_s),
+    }
+
+def _old_validate(ids: List[str]) -> None:
+    for s in ids:
+        uuid.UUID(str(s))
+
+def bench_validator(lists: List[List[str]]) -> dict:
+    started = time.perf_counter()
+    for ids in lists:
+        _old_validate(ids)
+    old_s = time.perf_counter() - started
+    started = time.perf_counter()
+    for ids in lists:
+        assert first_invalid(ids) is None
+    new_s = time.perf_counter() - started
+    n = sum(len(ids) for ids in lists)
+    return {"ids": n, "uuid_loop_ids_per_s": round(n / old_s), "batch_regex_ids_per_s": round(n / new_s)}
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark text vs binary id storage.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--dir", default=tempfile.gettempdir())
+    args = parser.parse_args(argv)
+
+    ids = [str(uuid.uuid4()) for _ in range(args.rows)]
+    owners = [str(uuid.uuid4()) for _ in range(max(args.rows // 100, 10))]
+    for binary in (False, True):
+        print(run(binary, ids, owners, args.lookups, args.dir))
+    print(bench_validator([ids[i:i + 20] for i in range(0, min(len(ids), 200_000), 20)]))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
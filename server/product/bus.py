@@ -0,0 +1,102 @@
+import logging
+import threading
+from typing import Callable, List
+
+from config import settings
+from database import SHARD_IDS, SessionLocal
+from models import ChangeLog
+import changes
+import workers
+
+log = logging.getLogger("product.bus")
+
+# With several workers a commit fires changes.subscribe() only in the worker that made it. Every worker
+# writes the same change_log though, so each one tails it and so learns about the others' commits too.
+ENABLED = workers.MULTI
+
+class ChangeBus:
+    """
+    Tails change_log (seq > last seen, per shard) every `interval` seconds, or at once after a commit in
+    this worker, and hands the entries, in seq order per shard, to its subscribers. Runs only when ENABLED.
+    """
+
+    def __init__(self, interval: float, batch: int):
+        self.interval, self.batch = interval, batch
+        self.cursor: List[int] = [0] * len(SHARD_IDS)     # as changes.latest_cursor
+        self.delivered = 0
+        self._subscribers: List[Callable[[List[dict]], None]] = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="change-bus", daemon=True)
+
+    def subscribe(self, fn: Callable[[List[dict]], None]) -> None:
+        self._subscribers.append(fn)
+
+    def start(self, cursor: List[int]) -> "ChangeBus":
+        self.cursor = list(cursor)
+        if ENABLED:
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def poll(self) -> bool:
+        """Deliver the next batch of entries of every shard; True when there may be more right away."""
+        entries, more = [], False
+        with SessionLocal() as db:
+            for index, shard in enumerate(SHARD_IDS):
+                rows = (
+                    db.query(ChangeLog)
+                    .filter(ChangeLog.seq > self.cursor[index])
+                    .order_by(ChangeLog.seq)
+                    .limit(self.batch)
+                    .set_shard(shard)
+                    .all()
+                )
+                if rows:
+                    self.cursor[index] = rows[-1].seq
+                    entries += [changes.entry_out(e) for e in rows]
+                    more = more or len(rows) == self.batch
+        if not entries:
+            return False
+        self.delivered += len(entries)
+        for fn in self._subscribers:
+            try:
+                fn(entries)
+            except Exception as e:
+                log.warning("Bus subscriber failed: %s", e)
+        return more
+
+    def snapshot(self) -> dict:
+        return {"enabled": ENABLED, "cursor": changes.cursor_token(self.cursor), "delivered": self.delivered}
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                more = self.poll()
+            except Exception as e:
+                log.warning("Change bus poll failed: %s", e)
+                more = False
+            if not more:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+
+channel = ChangeBus(settings.BUS_POLL_MS / 1000, settings.BUS_BATCH)
+
+if ENABLED:
+    changes.subscribe(lambda entries: channel.wake())
+
+def subscribe(fn: Callable[[List[dict]], None]) -> None:
+    """Call `fn(entries)` for the commits of every worker, in seq order (one worker: straight after each commit)."""
+    if ENABLED:
+        channel.subscribe(fn)
+    else:
+        changes.subscribe(fn)
+
+def start(cursor: List[int]) -> ChangeBus:
+    return channel.start(cursor)
@@ -0,0 +1,215 @@
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional, Union
+
+from fastapi import HTTPException, status
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SHARD_IDS, SHARDED, SessionLocal, shard_for
+from models import ChangeLog, ChangeLogMeta
+from schemas import ProductOut
+
+log = logging.getLogger("product.changes")
+
+HORIZON_KEY = "horizon"
+
+_subscribers: List[Callable[[List[dict]], None]] = []
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def snapshot(obj) -> dict:
+    return ProductOut.model_validate(obj).model_dump(mode="json")
+
+def record(db: Session, op: str, obj=None, entity_id: Optional[str] = None,
+           relation: Optional[str] = None, ref_id: Optional[str] = None) -> ChangeLog:
+    """Append a change entry to the caller's transaction; it commits (or rolls back) with the write itself."""
+    entry = ChangeLog(
+        entity_id=entity_id or obj.id,
+        op=op,
+        relation=relation,
+        ref_id=ref_id,
+        data=snapshot(obj) if obj is not None and op != "delete" else None,
+        created_at=_now(),
+    )
+    db.add(entry)
+    return entry
+
+def _horizon(db: Session, shard: str) -> int:
+    row = db.query(ChangeLogMeta).filter(ChangeLogMeta.key == HORIZON_KEY).set_shard(shard).first()
+    return row.value if row else 0
+
+# ---- Cursors
+# Every shard numbers its own change log, so a position in the feed is one seq per shard. With a single
+# database the cursor is just that seq (an int, as always); sharded it is the seqs joined in shard order
+# ("12.0.7.3"). Entries then also carry the index of their `shard`.
+def shard_of(entry: dict) -> int:
+    return entry.get("shard", 0)
+
+def parse_cursor(token: Union[int, str, None]) -> List[int]:
+    parts = str(token if token is not None else 0).split(".")
+    if not all(p.isdigit() for p in parts):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid change cursor: {token}")
+    if parts == ["0"]:
+        return [0] * len(SHARD_IDS)
+    if len(parts) != len(SHARD_IDS):
+        # Written under a different shard count (see rebalance.py): positions no longer line up.
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail=f"Cursor is for {len(parts)} shard(s), the store now has {len(SHARD_IDS)}; resync from since=0",
+        )
+    return [int(p) for p in parts]
+
+def cursor_token(cursor: List[int]) -> Union[int, str]:
+    return ".".join(map(str, cursor)) if SHARDED else cursor[0]
+
+def entry_out(e: ChangeLog) -> dict:
+    out = {
+        "seq": e.seq,
+        "op": e.op,
+        "id": e.entity_id,
+        "relation": e.relation,
+        "ref_id": e.ref_id,
+        "data": e.data,
+        "at": e.created_at.isoformat() + "Z",
+    }
+    if SHARDED:
+        out["shard"] = int(shard_for(e.entity_id))
+    return out
+
+def read_since(db: Session, since: Union[int, str], limit: int) -> dict:
+    """
+    Entries after cursor `since`, oldest first. `next` is the cursor to pass back as `since`.
+    Sharded, each shard's entries stay in seq order (all changes of one product live on one shard)
+    and shards are interleaved by commit time.
+    """
+    cursor = parse_cursor(since)
+    runs = []
+    for index, (shard, pos) in enumerate(zip(SHARD_IDS, cursor)):
+        horizon = _horizon(db, shard)
+        if 0 < pos < horizon:
+            where = f" on shard {shard}" if SHARDED else ""
+            raise HTTPException(
+                status_code=status.HTTP_410_GONE,
+                detail=f"Changes up to seq {horizon}{where} were compacted; resync from since=0",
+            )
+        rows = (
+            db.query(ChangeLog)
+            .filter(ChangeLog.seq > pos)
+            .order_by(ChangeLog.seq)
+            .limit(limit + 1)
+            .set_shard(shard)
+            .all()
+        )
+        runs.append([(e.created_at, index, e) for e in rows])
+    merged = list(heapq.merge(*runs, key=lambda t: t[:2])) if SHARDED else runs[0]
+    has_more = len(merged) > limit
+    page = merged[:limit]
+    for _, index, e in page:
+        cursor[index] = e.seq
+    return {
+        "changes": [entry_out(e) for _, _, e in page],
+        "next": cursor_token(cursor),
+        "has_more": has_more,
+    }
+
+def latest_cursor(db: Session) -> List[int]:
+    return [
+        db.query(func.max(ChangeLog.seq)).set_shard(shard).scalar() or 0
+        for shard in SHARD_IDS
+    ]
+
+# ---- Commit notifications
+def subscribe(fn: Callable[[List[dict]], None]) -> None:
+    """Call `fn(entries)` after each commit that appended change entries."""
+    _subscribers.append(fn)
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect(session, flush_context):
+    pending = [entry_out(o) for o in session.new if isinstance(o, ChangeLog)]
+    if pending:
+        session.info.setdefault("changes", []).extend(pending)
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish(session):
+    entries = session.info.pop("changes", None)
+    if entries:
+        for fn in _subscribers:
+            try:
+                fn(entries)
+            except Exception as e:
+                log.warning("Change subscriber failed: %s", e)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard(session):
+    session.info.pop("changes", None)
+
+# ---- Compaction
+def compact(db: Session, retention: timedelta, tombstone_retention: timedelta) -> int:
+    """
+    Collapse entries older than `retention` to the latest one per entity, then drop delete
+    tombstones older than `tombstone_retention`. Replaying the compacted log still yields
+    the current state; consumers whose cursor is below the dropped tombstones get 410.
+    """
+    removed = 0
+    for shard in SHARD_IDS:
+        removed += _compact_shard(db, shard, _now(), retention, tombstone_retention)
+        db.commit()
+    return removed
+
+def _compact_shard(db: Session, shard: str, now: datetime, retention: timedelta, tombstone_retention: timedelta) -> int:
+    latest = select(func.max(ChangeLog.seq)).group_by(ChangeLog.entity_id)
+    removed = (
+        db.query(ChangeLog)
+        .filter(ChangeLog.created_at < now - retention, ChangeLog.seq.not_in(latest))
+        .set_shard(shard)
+        .delete(synchronize_session=False)
+    )
+    tomb_q = db.query(ChangeLog).filter(ChangeLog.op == "delete", ChangeLog.created_at < now - tombstone_retention).set_shard(shard)
+    tomb_max = tomb_q.with_entities(func.max(ChangeLog.seq)).scalar()
+    if tomb_max:
+        removed += tomb_q.delete(synchronize_session=False)
+        meta = db.query(ChangeLogMeta).filter(ChangeLogMeta.key == HORIZON_KEY).set_shard(shard).first()
+        if meta is None:
+            db.execute(insert(ChangeLogMeta).values(key=HORIZON_KEY, value=tomb_max), bind_arguments={"shard_id": shard})
+        else:
+            meta.value = max(meta.value, tomb_max)
+    return removed
+
+class Compactor:
+    def __init__(self, interval: int):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="changelog-compactor", daemon=True)
+
+    def start(self) -> "Compactor":
+        if self.interval > 0:
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            db = SessionLocal()
+            try:
+                removed = compact(
+                    db,
+                    timedelta(seconds=settings.CHANGELOG_RETENTION_SECONDS),
+                    timedelta(seconds=settings.CHANGELOG_TOMBSTONE_RETENTION_SECONDS),
+                )
+                if removed:
+                    log.info("Compacted %d change log entries", removed)
+            except Exception as e:
+                db.rollback()
+                log.warning("Change log compaction failed: %s", e)
+            finally:
+                db.close()
+
+def start_compactor() -> Compactor:
+    return Compactor(settings.CHANGELOG_COMPACT_INTERVAL).start()
@@ -1,3 +1,4 @@
+from typing import Dict
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -5,9 +6,86 @@ class Settings(BaseSettings):
     CATEGORY_BASE_URL: str = "http://localhost:8003/categories"
     IMAGE_BASE_URL: str = "http://localhost:8004/images"
     DATABASE_URL: str = "sqlite:///./product.db"
+    PRODUCT_SHARDS: int = 1            # 1 = single database at DATABASE_URL; N > 1 spreads products over N databases by id hash
+    PRODUCT_SHARD_URL: str = "sqlite:///./product_{shard}.db"  # per-shard URL when PRODUCT_SHARDS > 1
+    ID_STORAGE: str = "text"           # text = 36-char strings; binary = 16-byte blobs (switch with convert_ids.py)
     LOG_LEVEL: str = "INFO"
     HTTP_TIMEOUT: int = 5
     HTTP_RETRIES: int = 2
+    HTTP_RETRY_BACKOFF: float = 0.2    # seconds before the first retry, doubled per attempt
+    HTTP_POOL_SIZE: int = 10           # keep-alive connections per peer host
+    HTTP_WARMUP_TIMEOUT: float = 1.0
+    BREAKER_FAILURES: int = 5          # consecutive peer failures before the circuit opens
+    BREAKER_RESET_SECONDS: int = 30    # open circuit lets one trial call through after this
+    DB_BUSY_TIMEOUT_MS: int = 5000
+    DB_WARM_CONNECTIONS: int = 4       # pooled connections opened during startup
+    READYZ_REQUIRE_PEERS: bool = False # when true, an open peer circuit fails /readyz
+    IDFILTER_VALIDATE: bool = True            # reject links to ids a peer's filter rules out (fails open if the peer is down)
+    IDFILTER_ERROR_RATE: float = 0.01         # false-positive rate of the id filter at capacity
+    IDFILTER_MIN_CAPACITY: int = 1024         # ids the own filter is sized for, at least (otherwise twice the rows)
+    IDFILTER_TTL_SECONDS: float = 30.0        # a cached peer filter is revalidated (If-None-Match) after this
+    IDFILTER_REFETCH_SECONDS: float = 1.0     # on a miss refetch at most this often; misses in between are looked up
+    STATS_VERIFY_INTERVAL: int = 300  # seconds between aggregate checks; 0 disables
+    CHANGELOG_RETENTION_SECONDS: int = 86400            # older entries collapse to latest per entity
+    CHANGELOG_TOMBSTONE_RETENTION_SECONDS: int = 604800 # delete markers kept this long
+    CHANGELOG_COMPACT_INTERVAL: int = 3600              # seconds; 0 disables
+    SSE_BACKLOG: int = 1024            # recent events kept in memory for resuming streams
+    SSE_BACKFILL_PAGE: int = 500
+    SSE_HEARTBEAT_SECONDS: int = 15
+    SSE_RETRY_MS: int = 3000
+    ADMISSION_MAX_CONCURRENCY: int = 32   # requests in flight across the service; 0 disables admission control
+    ADMISSION_QUEUE_SIZE: int = 64        # requests allowed to wait for a slot; beyond this they get 503
+    ADMISSION_QUEUE_TIMEOUT: float = 1.0  # seconds a queued request may wait (keep below the gateway timeout)
+    ADMISSION_RETRY_AFTER: int = 1        # Retry-After seconds on 503
+    COALESCE_READS: bool = True           # identical concurrent GETs share one query
+    COALESCE_WINDOW: float = 0.0          # seconds a finished read keeps serving new callers; 0 = in-flight only
+    COMPRESS_MIN_BYTES: int = 1024        # smaller responses go out uncompressed; negative disables compression
+    COMPRESS_GZIP_LEVEL: int = 6
+    COMPRESS_BROTLI_QUALITY: int = 4      # br is offered only when the `brotli` package is installed
+    IDEMPOTENCY_TTL_SECONDS: int = 86400  # how long a stored response answers replays of its Idempotency-Key
+    IDEMPOTENCY_MAX_ENTRIES: int = 10000  # oldest keys are dropped beyond this
+    IDEMPOTENCY_MAX_RESPONSE_BYTES: int = 1048576  # larger responses are not stored (a retry runs again)
+    IDEMPOTENCY_WAIT_SECONDS: float = 10.0         # a duplicate waits this long for the first request, then 409
+    IDEMPOTENCY_LEASE_SECONDS: int = 300           # WORKERS > 1: a claimed key whose worker died is taken over after this
+    BULK_DELETE_MAX_ROWS: int = 10000     # rows one bulk DELETE may remove; more is a 422
+    JOB_BATCH: int = 500                  # queued peer unlinks sent per batch (one request per peer)
+    JOB_POLL_SECONDS: float = 5.0         # job runner idle wake-up; a new job wakes it at once
+    JOB_RETRY_BACKOFF: float = 2.0        # seconds before retrying a failed batch, doubled per attempt (max 300)
+    JOB_MAX_ATTEMPTS: int = 10            # consecutive failed batches before a job is marked failed
+    WORKERS: int = 1                      # processes started by serve.py; > 1 shares caches and coordination through the database
+    WORKER_LOCK_FILE: str = "./product.leader"   # flock held by the worker running the background loops
+    WORKER_LEADER_POLL: float = 5.0       # seconds between the other workers' attempts to take over
+    BUS_POLL_MS: float = 50.0             # WORKERS > 1: how often each worker tails change_log for the others' commits
+    BUS_BATCH: int = 1000                 # change entries read per poll
+    SNAPSHOT_DIR: str = "./snapshots"     # <name>.db.gz + <name>.json manifest per snapshot
+    SNAPSHOT_TOKEN: str = ""              # POST /admin/snapshot needs X-Admin-Token equal to this; empty = endpoint off (CLI still works)
+    SNAPSHOT_STEP_PAGES: int = 1024       # pages copied per backup step; 0 = whole database in one step
+    SNAPSHOT_STEP_SLEEP_MS: float = 5.0   # pause between steps
+    SNAPSHOT_MAX_RESTARTS: int = 3        # copies restarted by concurrent writes before finishing in one step
+    SNAPSHOT_GZIP_LEVEL: int = 6
+    SNAPSHOT_KEEP: int = 7                # newest snapshots kept in SNAPSHOT_DIR; 0 keeps all
+    MAINTENANCE_ENABLED: bool = True      # background checkpoint / incremental vacuum / ANALYZE (SQLite, leading worker)
+    MAINTENANCE_TICK_SECONDS: float = 15.0  # how often the scheduler looks for due tasks and a quiet moment
+    MAINTENANCE_BUDGET_MS: float = 200.0  # longest one tick's work, or its wait for a lock, may take
+    MAINTENANCE_MAX_IN_FLIGHT: int = 0    # quiet = at most this many requests running ...
+    MAINTENANCE_MAX_RPS: float = 5.0      # ... and at most this many admitted per second since the last tick
+    MAINTENANCE_CHECKPOINT_SECONDS: int = 300   # WAL checkpoint (TRUNCATE) at most this often; 0 = never
+    MAINTENANCE_VACUUM_SECONDS: int = 3600      # incremental vacuum; 0 = never
+    MAINTENANCE_VACUUM_MIN_FREE: float = 0.05   # ... only once at least this share of the pages is free
+    MAINTENANCE_VACUUM_PAGES: int = 256         # pages returned per step (each step is one short write)
+    MAINTENANCE_ANALYZE_SECONDS: int = 3600     # ANALYZE + PRAGMA optimize; 0 = never
+    MAINTENANCE_ANALYSIS_LIMIT: int = 1000      # rows ANALYZE samples per index
+    PROFILE_TOKEN: str = ""               # requests whose X-Profile header equals this are profiled; empty = header ignored
+    PROFILE_SAMPLE_RATE: float = 0.0      # fraction of requests profiled at random; 0 with no token = profiling not installed
+    PROFILE_DIR: str = "./profiles"       # <id>.prof (pstats) and <id>.json (queries, plans, top functions) per request
+    PROFILE_SLOW_QUERY_MS: float = 50.0   # profiled statements at least this slow get EXPLAIN QUERY PLAN
+    PROFILE_MAX_QUERIES: int = 30         # profiled requests issuing more statements than this are flagged
+    # Per-route caps ("METHOD /template"); writes here call peers synchronously and hold a worker meanwhile.
+    ADMISSION_ROUTE_LIMITS: Dict[str, int] = {
+        "POST /products": 8,
+        "PUT /products/{product_id}": 8,
+        "PATCH /products/{product_id}": 8,
+    }
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
@@ -1,59 +1,79 @@
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
-from typing import List, Optional
+from typing import Dict, List, Optional, Sequence, Set, Tuple
 from decimal import Decimal
 import uuid
 
+from config import settings
+from database import SHARD_IDS, SHARDED, scatter, shard_for
 from models import Product
-from schemas import ProductCreate, ProductUpdate
-
-def _validate_uuid(id_str: str) -> None:
-    try:
-        uuid.UUID(str(id_str))
-    except Exception:
+from schemas import ProductBulkDelete, ProductCreate, ProductUpdate, UnlinkPair
+import stats
+import changes
+import idfilter
+import idtypes
+import jobs
+import sparse
+
+def _validate_uuid(id_str: str) -> str:
+    if not idtypes.is_uuid(id_str):
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID: {id_str}")
+    return idtypes.canonical(id_str)
 
 def _clean_ids(ids: Optional[List[str]]) -> Optional[List[str]]:
     if ids is None:
         return None
-    out, seen = [], set()
-    for s in ids:
-        _validate_uuid(s)
-        if s not in seen:
-            seen.add(s)
-            out.append(s)
-    return out
-
-def get(db: Session, product_id: str) -> Product:
-    obj = db.query(Product).filter(Product.id == product_id).first()
+    bad = idtypes.first_invalid(ids)
+    if bad is not None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID: {bad}")
+    return list(dict.fromkeys(idtypes.canonical(s) for s in ids))
+
+def get(db: Session, product_id: str, fields: Optional[Sequence[str]] = None) -> Product:
+    """With `fields`, only those columns are loaded and a row tuple in that order is returned."""
+    query = db.query(*sparse.columns(Product, fields)) if fields else db.query(Product)
+    obj = query.filter(Product.id == product_id).set_shard(shard_for(product_id)).first()
     if not obj:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
     return obj
 
-def list_all(db: Session, skip: int = 0, limit: int = 100) -> List[Product]:
-    return db.query(Product).offset(skip).limit(limit).all()
+def list_all(db: Session, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None) -> List[Product]:
+    """Sharded, the list is ordered by id (merged across shards); a single database keeps its natural order."""
+    query = db.query(*sparse.columns(Product, fields)) if fields else db.query(Product)
+    if not SHARDED:
+        return query.offset(skip).limit(limit).all()
+    keyed = not fields or "id" in fields
+    if not keyed:
+        query = query.add_columns(Product.id)   # merge key, dropped again below
+    rows = scatter(query.order_by(Product.id), lambda r: r.id, skip, limit)
+    return rows if keyed else [tuple(r)[:-1] for r in rows]
+
+# Link list -> the peer service owning those ids.
+PEER_OF = {"supplier_ids": "supplier", "category_ids": "category", "image_ids": "image"}
 
 def create(db: Session, payload: ProductCreate) -> Product:
-    pid = payload.id or str(uuid.uuid4())
-    _validate_uuid(pid)
+    pid = _validate_uuid(payload.id or str(uuid.uuid4()))
+    links = {attr: _clean_ids(getattr(payload, attr)) or [] for attr in PEER_OF}
+    for attr, ids in links.items():
+        idfilter.require(PEER_OF[attr], ids)
 
     obj = Product(
         id=pid,
         name=payload.name,
         description=payload.description or "",
         quantity=int(payload.quantity),
-        price=Decimal(payload.price),
-        supplier_ids=_clean_ids(payload.supplier_ids) or [],
-        category_ids=_clean_ids(payload.category_ids) or [],
-        image_ids=_clean_ids(payload.image_ids) or [],
+        price=Decimal(payload.price).quantize(stats.CENT),
+        **links,
     )
     db.add(obj)
+    stats.apply_delta(db, None, stats.contribution(obj))
+    changes.record(db, "create", obj)
     db.commit()
     db.refresh(obj)
     return obj
 
 def update(db: Session, product_id: str, payload: ProductUpdate) -> Product:
     obj = get(db, product_id)
+    before = stats.contribution(obj)
 
     if payload.name is not None: obj.name = payload.name
     if payload.description is not None: obj.description = payload.description
@@ -64,23 +84,77 @@ def update(db: Session, product_id: str, payload: ProductUpdate) -> Product:
     if payload.price is not None:
         if payload.price <= 0:
             raise HTTPException(status_code=422, detail="price must be > 0")
-        obj.price = Decimal(payload.price)
-
-    if payload.supplier_ids is not None:
-        obj.supplier_ids = _clean_ids(payload.supplier_ids) or []
-    if payload.category_ids is not None:
-        obj.category_ids = _clean_ids(payload.category_ids) or []
-    if payload.image_ids is not None:
-        obj.image_ids = _clean_ids(payload.image_ids) or []
-
+        obj.price = Decimal(payload.price).quantize(stats.CENT)
+
+    for attr, peer in PEER_OF.items():
+        ids = getattr(payload, attr)
+        if ids is not None:
+            ids = _clean_ids(ids) or []
+            # Only new links are checked: existing ones stay even if the peer has dropped the id since.
+            idfilter.require(peer, [i for i in ids if i not in (getattr(obj, attr) or [])])
+            setattr(obj, attr, ids)
+
+    stats.apply_delta(db, before, stats.contribution(obj))
+    changes.record(db, "update", obj)
     db.commit()
     db.refresh(obj)
     return obj
 
-def delete(db: Session, product_id: str) -> None:
-    obj = get(db, product_id)
-    db.delete(obj)
+def delete(db: Session, product_id: str) -> Optional[jobs.Job]:
+    return delete_many(db, [get(db, product_id)])
+
+def select_for_delete(db: Session, payload: ProductBulkDelete) -> Tuple[List[Product], List[str]]:
+    """The products a bulk delete names (ids) or matches (filters), and the named ids that do not exist."""
+    filtered = payload.supplier_id is not None or payload.category_id is not None
+    if (payload.ids is None) == (not filtered):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Give either ids or a filter (supplier_id, category_id)")
+    if payload.ids is not None:
+        ids = _clean_ids(payload.ids)
+        if len(ids) > settings.BULK_DELETE_MAX_ROWS:
+            raise _too_many(len(ids))
+        objs = db.query(Product).filter(Product.id.in_(ids)).all() if ids else []
+        found = {obj.id for obj in objs}
+        return objs, [pid for pid in ids if pid not in found]
+    supplier_id = _validate_uuid(payload.supplier_id) if payload.supplier_id is not None else None
+    category_id = _validate_uuid(payload.category_id) if payload.category_id is not None else None
+    objs = []
+    for shard in SHARD_IDS:
+        for obj in db.query(Product).set_shard(shard).yield_per(1000):
+            if supplier_id is not None and supplier_id not in (obj.supplier_ids or []):
+                continue
+            if category_id is not None and category_id not in (obj.category_ids or []):
+                continue
+            objs.append(obj)
+            if len(objs) > settings.BULK_DELETE_MAX_ROWS:
+                raise _too_many(len(objs), more=True)
+    return objs, []
+
+def _too_many(n: int, more: bool = False) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail=f"{n}{'+' if more else ''} products selected, a bulk delete removes at most {settings.BULK_DELETE_MAX_ROWS}",
+    )
+
+def delete_many(db: Session, objs: List[Product]) -> Optional[jobs.Job]:
+    """
+    Delete `objs` in one transaction per shard. Suppliers, categories and images are not called here:
+    one unlink per link is queued as a background job, committed with the delete, and sent in batches
+    by jobs.runner. Returns that job (None when the products had no links).
+    Sharded, the job lives on the first shard and commits next to, not atomically with, the other shards.
+    """
+    tasks = []
+    for obj in objs:
+        tasks += [("supplier", None, sid, obj.id) for sid in obj.supplier_ids or []]
+        tasks += [("category", None, cid, obj.id) for cid in obj.category_ids or []]
+        tasks += [("image", None, iid, obj.id) for iid in obj.image_ids or []]
+        stats.apply_delta(db, stats.contribution(obj), None)
+        changes.record(db, "delete", entity_id=obj.id)
+        db.delete(obj)
+    job = jobs.enqueue(db, "delete_cascade", tasks)
     db.commit()
+    if job is not None:
+        jobs.runner.wake()
+    return job
 
 # Link/unlink helpers (used by relationship endpoints)
 def add_id(ids: List[str], new_id: str) -> List[str]:
@@ -90,37 +164,84 @@ def remove_id(ids: List[str], drop_id: str) -> List[str]:
     return [x for x in ids if x != drop_id]
 
 def add_supplier(db: Session, product_id: str, supplier_id: str) -> Product:
-    _validate_uuid(supplier_id)
+    supplier_id = _validate_uuid(supplier_id)
     obj = get(db, product_id)
+    before = stats.contribution(obj)
     obj.supplier_ids = add_id(obj.supplier_ids or [], supplier_id)
+    stats.apply_delta(db, before, stats.contribution(obj))
+    changes.record(db, "link", obj, relation="suppliers", ref_id=supplier_id)
     db.commit(); db.refresh(obj); return obj
 
 def remove_supplier(db: Session, product_id: str, supplier_id: str) -> Product:
-    _validate_uuid(supplier_id)
+    supplier_id = _validate_uuid(supplier_id)
     obj = get(db, product_id)
+    before = stats.contribution(obj)
     obj.supplier_ids = remove_id(obj.supplier_ids or [], supplier_id)
+    stats.apply_delta(db, before, stats.contribution(obj))
+    changes.record(db, "unlink", obj, relation="suppliers", ref_id=supplier_id)
     db.commit(); db.refresh(obj); return obj
 
 def add_category(db: Session, product_id: str, category_id: str) -> Product:
-    _validate_uuid(category_id)
+    category_id = _validate_uuid(category_id)
     obj = get(db, product_id)
+    before = stats.contribution(obj)
     obj.category_ids = add_id(obj.category_ids or [], category_id)
+    stats.apply_delta(db, before, stats.contribution(obj))
+    changes.record(db, "link", obj, relation="categories", ref_id=category_id)
     db.commit(); db.refresh(obj); return obj
 
 def remove_category(db: Session, product_id: str, category_id: str) -> Product:
-    _validate_uuid(category_id)
+    category_id = _validate_uuid(category_id)
     obj = get(db, product_id)
+    before = stats.contribution(obj)
     obj.category_ids = remove_id(obj.category_ids or [], category_id)
+    stats.apply_delta(db, before, stats.contribution(obj))
+    changes.record(db, "unlink", obj, relation="categories", ref_id=category_id)
     db.commit(); db.refresh(obj); return obj
 
 def add_image(db: Session, product_id: str, image_id: str) -> Product:
-    _validate_uuid(image_id)
+    image_id = _validate_uuid(image_id)
     obj = get(db, product_id)
     obj.image_ids = add_id(obj.image_ids or [], image_id)
+    changes.record(db, "link", obj, relation="images", ref_id=image_id)
     db.commit(); db.refresh(obj); return obj
 
 def remove_image(db: Session, product_id: str, image_id: str) -> Product:
-    _validate_uuid(image_id)
+    image_id = _validate_uuid(image_id)
     obj = get(db, product_id)
     obj.image_ids = remove_id(obj.image_ids or [], image_id)
+    changes.record(db, "unlink", obj, relation="images", ref_id=image_id)
     db.commit(); db.refresh(obj); return obj
+
+RELATIONS = {"suppliers": "supplier_ids", "categories": "category_ids", "images": "image_ids"}
+
+def bulk_unlink(db: Session, relation: str, pairs: List[UnlinkPair]) -> int:
+    """
+    Drop each pair's ref_id from its product's `relation` list in one transaction (sent by the peers'
+    delete cascade jobs). Unknown products and links already gone are no-ops, so a retried batch is
+    harmless. Returns how many pairs named an existing product.
+    """
+    bad = idtypes.first_invalid([p.id for p in pairs] + [p.ref_id for p in pairs])
+    if bad is not None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID: {bad}")
+    drop: Dict[str, Set[str]] = {}
+    asked: Dict[str, int] = {}
+    for p in pairs:
+        product_id = idtypes.canonical(p.id)
+        drop.setdefault(product_id, set()).add(idtypes.canonical(p.ref_id))
+        asked[product_id] = asked.get(product_id, 0) + 1
+    attr, applied = RELATIONS[relation], 0
+    for obj in db.query(Product).filter(Product.id.in_(list(drop))).all():
+        gone = drop[obj.id]
+        applied += asked[obj.id]
+        current = getattr(obj, attr) or []
+        if not gone.intersection(current):
+            continue
+        before = stats.contribution(obj)
+        setattr(obj, attr, [x for x in current if x not in gone])
+        stats.apply_delta(db, before, stats.contribution(obj))
+        for ref_id in current:
+            if ref_id in gone:
+                changes.record(db, "unlink", obj, relation=relation, ref_id=ref_id)
+    db.commit()
+    return applied
@@ -1,12 +1,131 @@
-from sqlalchemy import create_engine
+import heapq
+import os
+import zlib
+from itertools import islice
+from typing import Callable, Dict, List
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.horizontal_shard import ShardedSession
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from config import settings
+import idtypes
 
 class Base(DeclarativeBase):
     pass
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if settings.DATABASE_URL.startswith("sqlite") else {},
+# ---- Shards
+# PRODUCT_SHARDS=1 is the plain single database at DATABASE_URL (shard "0"). With N > 1 products live in N
+# databases (PRODUCT_SHARD_URL per shard) chosen by a stable hash of the product id; a product's stats
+# contribution and change log entries are written to the same shard, so every write is a one-database transaction.
+SHARD_IDS: List[str] = [str(i) for i in range(max(settings.PRODUCT_SHARDS, 1))]
+SHARDED = len(SHARD_IDS) > 1
+
+def shard_url(shard: str) -> str:
+    if not SHARDED:
+        return settings.DATABASE_URL
+    if "{shard}" not in settings.PRODUCT_SHARD_URL:
+        raise RuntimeError("PRODUCT_SHARD_URL must contain '{shard}' when PRODUCT_SHARDS > 1")
+    return settings.PRODUCT_SHARD_URL.format(shard=shard)
+
+def shard_index(product_id: str, count: int) -> int:
+    # crc32, not hash(): it must map an id to the same shard in every process and across restarts.
+    return zlib.crc32(str(product_id).encode()) % count
+
+def shard_for(product_id: str) -> str:
+    return SHARD_IDS[shard_index(idtypes.canonical(product_id), len(SHARD_IDS))] if SHARDED else SHARD_IDS[0]
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets readers run alongside the single writer; busy_timeout waits instead of failing fast.
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA auto_vacuum=INCREMENTAL")   # takes on a new file; see maintenance.py for older ones
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute(f"PRAGMA busy_timeout={settings.DB_BUSY_TIMEOUT_MS}")
+    cur.close()
+
+def make_engine(url: str) -> Engine:
+    is_sqlite = url.startswith("sqlite")
+    eng = create_engine(
+        url,
+        connect_args={"check_same_thread": False} if is_sqlite else {},
+        pool_pre_ping=not is_sqlite,
+    )
+    if is_sqlite:
+        event.listen(eng, "connect", _sqlite_pragmas)
+    return eng
+
+engines: Dict[str, Engine] = {shard: make_engine(shard_url(shard)) for shard in SHARD_IDS}
+engine = engines[SHARD_IDS[0]]
+
+# Tables whose new rows pick their shard from a column (the product id they belong to).
+SHARD_KEYS = {"products": "id", "change_log": "entity_id"}
+# Service bookkeeping that is not per product lives on the first shard only.
+HOME_TABLES = {"jobs", "job_tasks", "idempotency_keys"}
+
+# A forked worker must not share the parent's pooled connections (serve.py spawns fresh workers, but a
+# pre-forking server would copy the pools). Only the child's references are dropped; the parent keeps its own.
+os.register_at_fork(after_in_child=lambda: [eng.dispose(close=False) for eng in engines.values()])
+
+def _home(mapper) -> bool:
+    return mapper is not None and mapper.local_table.name in HOME_TABLES
+
+def _shard_chooser(mapper, instance, clause=None) -> str:
+    # Rows loaded from a shard keep its identity token, so updates and deletes go back there without asking.
+    if _home(mapper):
+        return SHARD_IDS[0]
+    column = SHARD_KEYS.get(mapper.local_table.name) if mapper is not None else None
+    if instance is not None and column:
+        return shard_for(getattr(instance, column))
+    if not SHARDED:
+        return SHARD_IDS[0]
+    raise RuntimeError(f"No shard for {mapper.local_table.name if mapper is not None else 'statement'}; pass one explicitly")
+
+def _identity_chooser(mapper, primary_key, **kw) -> List[str]:
+    if _home(mapper):
+        return SHARD_IDS[:1]
+    if SHARD_KEYS.get(mapper.local_table.name) == "id":
+        return [shard_for(primary_key[0])]
+    return SHARD_IDS
+
+def _execute_chooser(orm_context) -> List[str]:
+    # Statements not pinned to a shard (query.set_shard / bind_arguments) run on all of them.
+    if _home(orm_context.bind_mapper):
+        return SHARD_IDS[:1]
+    return SHARD_IDS
+
+SessionLocal = sessionmaker(
+    class_=ShardedSession,
+    shards=engines,
+    shard_chooser=_shard_chooser,
+    identity_chooser=_identity_chooser,
+    execute_chooser=_execute_chooser,
+    autocommit=False,
+    autoflush=False,
 )
-SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+def scatter(query, key: Callable, skip: int, limit: int) -> list:
+    """
+    Rows `skip .. skip+limit` of an ordered query across all shards. Each shard returns its first
+    skip+limit rows in `key` order and the sorted runs are merged, so the page matches one big ORDER BY.
+    """
+    if not SHARDED:
+        return query.offset(skip).limit(limit).all()
+    runs = [query.limit(skip + limit).set_shard(shard).all() for shard in SHARD_IDS]
+    return list(islice(heapq.merge(*runs, key=key), skip, skip + limit))
+
+def warm_pool(size: int) -> int:
+    """Open up to `size` pooled connections per shard now so the first requests don't pay for connect + pragmas."""
+    opened = 0
+    for eng in engines.values():
+        conns = []
+        try:
+            for _ in range(size):
+                conn = eng.connect()
+                conn.execute(text("SELECT 1"))
+                conns.append(conn)
+        finally:
+            opened += len(conns)
+            for conn in conns:
+                conn.close()
+    return opened
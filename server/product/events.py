@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+from typing import AsyncIterator, List, Optional, Set, Union
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+from database import SHARD_IDS, SessionLocal
+from models import ChangeLog
+import bus
+import changes
+
+log = logging.getLogger("product.events")
+
+# Snapshot fields that hold linked ids; used by the `related` stream filter.
+LINK_FIELDS = ("supplier_ids", "category_ids", "image_ids")
+
+class Broker:
+    """
+    Fan-out of committed change entries to SSE connections in this process.
+    Publishers may call from any thread; all state is touched on the event loop only,
+    and idle connections cost one awaited Event each.
+    """
+
+    def __init__(self, backlog: int):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._recent: deque = deque(maxlen=backlog)
+        self._wakeup = asyncio.Event()
+        self.latest: List[int] = [0]          # newest seq per shard (see changes.parse_cursor)
+        self.connections = 0
+        self._published: List[int] = [0]      # newest seq handed to the loop, per shard
+        self._order = threading.Lock()
+
+    def bind(self, loop: asyncio.AbstractEventLoop, latest: List[int]) -> None:
+        self._loop = loop
+        self.latest = list(latest)
+        with self._order:
+            self._published = list(latest)
+
+    def publish(self, entries: List[dict]) -> None:
+        """
+        Hand `entries` to the loop in seq order per shard. Commits of concurrent requests report in
+        whatever order their threads get here: an entry above a gap first pulls the entries below it,
+        committed already (one writer at a time), from change_log, and those are skipped when they report.
+        """
+        if self._loop is None or not entries:
+            return
+        with self._order:
+            ordered = []
+            for e in sorted(entries, key=lambda e: (changes.shard_of(e), e["seq"])):
+                shard = changes.shard_of(e)
+                published = self._published[shard]
+                if e["seq"] <= published:
+                    continue
+                if e["seq"] > published + 1:
+                    ordered += _committed(shard, published, e["seq"], self._recent.maxlen)
+                ordered.append(e)
+                self._published[shard] = e["seq"]
+            if ordered:
+                self._loop.call_soon_threadsafe(self._dispatch, ordered)
+
+    def _dispatch(self, entries: List[dict]) -> None:
+        for e in entries:
+            shard = changes.shard_of(e)
+            if e["seq"] > self.latest[shard]:
+                self._recent.append(e)
+                self.latest[shard] = e["seq"]
+        wakeup, self._wakeup = self._wakeup, asyncio.Event()
+        wakeup.set()
+
+    def oldest(self) -> List[Optional[int]]:
+        """Oldest seq still in memory, per shard (None: nothing from that shard)."""
+        oldest: List[Optional[int]] = [None] * len(self.latest)
+        for e in self._recent:
+            shard = changes.shard_of(e)
+            if oldest[shard] is None:
+                oldest[shard] = e["seq"]
+        return oldest
+
+    def since(self, cursor: List[int]) -> List[dict]:
+        return [e for e in self._recent if e["seq"] > cursor[changes.shard_of(e)]]
+
+    def waiter(self) -> asyncio.Event:
+        return self._wakeup
+
+def _committed(shard: int, after: int, before: int, limit: int) -> List[dict]:
+    """The newest `limit` entries of `shard` between seqs `after` and `before` (both excluded), oldest first."""
+    try:
+        with SessionLocal() as db:
+            rows = (
+                db.query(ChangeLog)
+                .filter(ChangeLog.seq > after, ChangeLog.seq < before)
+                .order_by(ChangeLog.seq.desc())
+                .limit(limit)
+                .set_shard(SHARD_IDS[shard])
+                .all()
+            )
+    except Exception as e:
+        log.warning("Reading change entries %s..%s failed: %s", after, before, e)
+        return []
+    return [changes.entry_out(e) for e in reversed(rows)]
+
+broker = Broker(settings.SSE_BACKLOG)
+
+def _on_commit(entries: List[dict]) -> None:
+    broker.publish(entries)
+
+# Through the bus: with several workers, streams of this one carry the others' commits as well.
+bus.subscribe(_on_commit)
+
+class StreamFilter:
+    def __init__(self, ids: Optional[Set[str]], related: Optional[Set[str]], ops: Optional[Set[str]]):
+        self.ids, self.related, self.ops = ids, related, ops
+
+    def match(self, e: dict) -> bool:
+        if self.ops and e["op"] not in self.ops:
+            return False
+        if self.ids and e["id"] not in self.ids:
+            return False
+        if self.related:
+            if e.get("ref_id") in self.related:
+                return True
+            data = e.get("data") or {}
+            for field in LINK_FIELDS:
+                value = data.get(field)
+                linked = value if isinstance(value, list) else [value]
+                if self.related.intersection(x for x in linked if x):
+                    return True
+            return False
+        return True
+
+def _format(e: dict, cursor: List[int]) -> str:
+    # The event id is the stream position after this event, so Last-Event-ID resumes right behind it.
+    return f"id: {changes.cursor_token(cursor)}\nevent: {e['op']}\ndata: {json.dumps(e, separators=(',', ':'))}\n\n"
+
+def _backfill(cursor: List[int], limit: int) -> dict:
+    db = SessionLocal()
+    try:
+        return changes.read_since(db, changes.cursor_token(cursor), limit)
+    finally:
+        db.close()
+
+def _behind(cursor: List[int], latest: List[int], oldest: List[Optional[int]]) -> bool:
+    return any(c < l and (o is None or o > c + 1) for c, l, o in zip(cursor, latest, oldest))
+
+async def stream(cursor: Optional[List[int]], filt: StreamFilter) -> AsyncIterator[str]:
+    """SSE body: replay from `cursor` (Last-Event-ID) out of the change log, then follow live commits."""
+    cursor = list(broker.latest if cursor is None else cursor)
+    broker.connections += 1
+    try:
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n"
+        while True:
+            latest, oldest = list(broker.latest), broker.oldest()
+            if _behind(cursor, latest, oldest):
+                # Fell behind the in-memory window: catch up from the database.
+                try:
+                    page = await run_in_threadpool(_backfill, cursor, settings.SSE_BACKFILL_PAGE)
+                except HTTPException:
+                    cursor = list(broker.latest)
+                    yield f"event: reset\ndata: {json.dumps({'seq': changes.cursor_token(cursor)})}\n\n"
+                    continue
+                for e in page["changes"]:
+                    cursor[changes.shard_of(e)] = e["seq"]
+                    if filt.match(e):
+                        yield _format(e, cursor)
+                if not page["has_more"]:
+                    # Compaction can leave seq gaps; everything up to the window is now delivered.
+                    cursor = [max(c, o - 1 if o is not None else l) for c, l, o in zip(cursor, latest, oldest)]
+                continue
+
+            # Take the wakeup before yielding so commits that land mid-send are not missed.
+            wakeup = broker.waiter()
+            for e in broker.since(cursor):
+                cursor[changes.shard_of(e)] = e["seq"]
+                if filt.match(e):
+                    yield _format(e, cursor)
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=settings.SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+    finally:
+        broker.connections -= 1
+
+def _csv(value: Optional[str]) -> Optional[Set[str]]:
+    return {x.strip() for x in value.split(",") if x.strip()} if value else None
+
+def open_stream(last_event_id: Optional[str], since: Optional[Union[int, str]], ids: Optional[str],
+                related: Optional[str], ops: Optional[str]) -> StreamingResponse:
+    cursor = None
+    if last_event_id:
+        try:
+            cursor = changes.parse_cursor(last_event_id)
+        except HTTPException:
+            pass                      # unusable Last-Event-ID: fall back to ?since= or live
+    if cursor is None and since is not None:
+        cursor = changes.parse_cursor(since)
+    return StreamingResponse(
+        stream(cursor, StreamFilter(_csv(ids), _csv(related), _csv(ops))),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
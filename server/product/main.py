@@ -1,12 +1,39 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
 import logging
-from fastapi import FastAPI, Depends, status, HTTPException
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Depends, Header, Query, Response, status, HTTPException
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 from config import settings
-from database import Base, engine
+from database import SessionLocal, engines, warm_pool
 from deps import get_db
+import bus
 import crud
-from schemas import ProductCreate, ProductUpdate, ProductOut
+import stats
+import changes
+import events
+import admission
+import coalesce
+import compression
+import idempotency
+import idfilter
+import jobs
+import profiling
+import snapshot
+import sparse
+import maintenance
+import probes
+import sync
+import workers
+from schemas import (
+    ProductCreate, ProductUpdate, ProductOut, RelationStatsOut,
+    ProductBulkDelete, BulkDeleteOut, BulkUnlink, BulkUnlinkOut, JobOut,
+)
 from sync import (
     sync_add_product_to_suppliers,
     sync_remove_product_from_suppliers,
@@ -16,23 +43,79 @@ from sync import (
     sync_detach_images_from_product,
 )
 
-# DB schema init
-Base.metadata.create_all(bind=engine)
-
 # Logging
 logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO))
 log = logging.getLogger("product.service")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema is managed by `python migrate.py`, run before the server starts.
+    warmup_started = time.perf_counter()
+    warm_pool(settings.DB_WARM_CONNECTIONS)
+    probes.require_schema()
+    idfilter.owned.rebuild()
+    sync.warm_peers()
+    leader = app.state.leader = workers.elect(
+        lambda: [stats.start_verifier(), changes.start_compactor(), jobs.start_runner(), maintenance.start()]
+    )
+    with SessionLocal() as db:
+        latest = changes.latest_cursor(db)
+    events.broker.bind(asyncio.get_running_loop(), latest)
+    change_bus = bus.start(latest)
+    probes.startup.mark_ready(_IMPORT_STARTED, warmup_started)
+    yield
+    change_bus.stop()
+    leader.stop()
+
 app = FastAPI(
     title="Product Service",
     version="1.0.0",
     description="CRUD for products with validations and bidirectional sync to Supplier, Category, and Image services.",
+    lifespan=lifespan,
 )
+profiling.install(app, engines.values())
+app.add_middleware(admission.AdmissionMiddleware, router=app.router)
+app.add_middleware(idempotency.IdempotencyMiddleware)
+app.add_middleware(compression.CompressionMiddleware)
 
 # ---- Health
 @app.get("/health")
 def health():
-    return {"status": "ok", "service": "product", "version": "1.0.0"}
+    # File size, free-page share and the last maintenance runs (those run in the leading worker only).
+    return {"status": "ok", "service": "product", "version": "1.0.0", "maintenance": maintenance.scheduler.snapshot()}
+
+@app.get("/livez")
+async def livez():
+    # Served on the event loop: stays answerable even when the threadpool or database is saturated.
+    return {"status": "alive"}
+
+@app.get("/readyz")
+def readyz():
+    ok, body = probes.readiness()
+    return JSONResponse(body, status_code=status.HTTP_200_OK if ok else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+@app.get("/admission")
+async def admission_stats():
+    return admission.controller.snapshot()
+
+@app.get("/workers")
+async def worker_stats():
+    # Answers for whichever worker the connection landed on.
+    return {"worker": app.state.leader.snapshot(), "bus": bus.channel.snapshot(), "idempotency": idempotency.store.snapshot()}
+
+@app.get("/idfilters")
+async def idfilter_stats():
+    return {"own": idfilter.owned.snapshot(), "peers": {peer: f.snapshot() for peer, f in idfilter.peers.items()}}
+
+@app.post("/admin/snapshot", status_code=status.HTTP_201_CREATED)
+def take_snapshot(x_admin_token: Optional[str] = Header(None)):
+    snapshot.authorize(x_admin_token)
+    try:
+        return snapshot.create()
+    except snapshot.SnapshotBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except snapshot.SnapshotError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 # ---- CRUD
 @app.post("/products", response_model=ProductOut, status_code=status.HTTP_201_CREATED)
@@ -47,12 +130,66 @@ def create_product(payload: ProductCreate, db: Session = Depends(get_db)):
     return created
 
 @app.get("/products", response_model=list[ProductOut])
-def list_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.list_all(db, skip=skip, limit=limit)
+def list_products(skip: int = 0, limit: int = 100, fields: Optional[str] = None):
+    names = sparse.parse(fields, ProductOut)
+    if names:
+        return JSONResponse(coalesce.read(
+            ("products", skip, limit, names),
+            lambda db: sparse.dump_all(ProductOut, names, crud.list_all(db, skip=skip, limit=limit, fields=names)),
+        ))
+    return coalesce.read(
+        ("products", skip, limit),
+        lambda db: [ProductOut.model_validate(p) for p in crud.list_all(db, skip=skip, limit=limit)],
+    )
+
+@app.delete("/products", response_model=BulkDeleteOut, status_code=status.HTTP_202_ACCEPTED)
+def bulk_delete_products(payload: ProductBulkDelete, response: Response, db: Session = Depends(get_db)):
+    objs, missing = crud.select_for_delete(db, payload)
+    job = crud.delete_many(db, objs)
+    if job is not None:
+        response.headers["Location"] = f"/jobs/{job.id}"
+    return BulkDeleteOut(deleted=len(objs), missing=missing, job_id=job.id if job else None)
+
+@app.post("/products/bulk-unlink", response_model=BulkUnlinkOut)
+def bulk_unlink(payload: BulkUnlink, db: Session = Depends(get_db)):
+    # The peers' delete cascades: many (product, supplier|category|image) pairs per call.
+    return BulkUnlinkOut(applied=crud.bulk_unlink(db, payload.relation, payload.pairs))
+
+@app.get("/products/idfilter")
+def product_idfilter(if_none_match: Optional[str] = Header(None)):
+    # Bloom filter of every product id; peers cache it to reject links to missing ids (see idfilter.py).
+    etag, bloom = idfilter.owned.current()
+    headers = {
+        "ETag": etag, "Cache-Control": "no-cache",
+        "X-Filter-Bits": str(bloom.bits), "X-Filter-Hashes": str(bloom.hashes), "X-Filter-Ids": str(bloom.count),
+    }
+    if if_none_match == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(bytes(bloom.data), media_type="application/octet-stream", headers=headers)
+
+@app.get("/products/changes")
+def product_changes(since: str = "0", limit: int = Query(500, ge=1, le=5000), db: Session = Depends(get_db)):
+    return changes.read_since(db, since, limit)
+
+@app.get("/products/stream")
+async def product_stream(
+    since: Optional[str] = None,
+    id: Optional[str] = None,
+    related: Optional[str] = None,
+    ops: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+):
+    return events.open_stream(last_event_id, since, id, related, ops)
 
 @app.get("/products/{product_id}", response_model=ProductOut)
-def read_product(product_id: str, db: Session = Depends(get_db)):
-    return crud.get(db, product_id)
+def read_product(product_id: str, fields: Optional[str] = None):
+    names = sparse.parse(fields, ProductOut)
+    if names:
+        return JSONResponse(coalesce.read(
+            ("product", product_id, names),
+            lambda db: sparse.dump(ProductOut, names, crud.get(db, product_id, fields=names)),
+        ))
+    return coalesce.read(("product", product_id), lambda db: ProductOut.model_validate(crud.get(db, product_id)))
 
 @app.put("/products/{product_id}", response_model=ProductOut)
 def put_product(product_id: str, payload: ProductUpdate, db: Session = Depends(get_db)):
@@ -85,21 +222,8 @@ def patch_product(product_id: str, payload: ProductUpdate, db: Session = Depends
 
 @app.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_product(product_id: str, db: Session = Depends(get_db)):
-    existing = crud.get(db, product_id)
-    sids = list(existing.supplier_ids or [])
-    cids = list(existing.category_ids or [])
-    iids = list(existing.image_ids or [])
-    
+    # Suppliers, categories and images are unlinked by a background job (see jobs.py), not before this returns.
     crud.delete(db, product_id)
-    
-    # TEMPORARILY DISABLED - other services not running
-    # if sids:
-    #     sync_remove_product_from_suppliers(product_id, sids)
-    # if cids:
-    #     sync_remove_product_from_categories(product_id, cids)
-    # if iids:
-    #     sync_detach_images_from_product(iids)
-    
     return None
 
 # ---- Relationship endpoints (used by peer services & optionally clients)
@@ -126,3 +250,47 @@ def link_image(product_id: str, image_id: str, db: Session = Depends(get_db)):
 @app.delete("/products/{product_id}/images/{image_id}", response_model=ProductOut)
 def unlink_image(product_id: str, image_id: str, db: Session = Depends(get_db)):
     return crud.remove_image(db, product_id, image_id)
+
+# ---- Category / supplier aggregates (served from incrementally maintained rows)
+def _split_ids(ids: Optional[str]) -> Optional[list[str]]:
+    if ids is None:
+        return None
+    out = [x.strip() for x in ids.split(",") if x.strip()]
+    for x in out:
+        crud._validate_uuid(x)
+    return out
+
+@app.get("/stats/categories", response_model=list[RelationStatsOut])
+def bulk_category_stats(ids: Optional[str] = None, skip: int = 0, limit: int = 100):
+    ref_ids = _split_ids(ids)
+    return coalesce.read(
+        ("category_stats", ids, skip, limit),
+        lambda db: stats.get_many(db, "category", ref_ids, skip=skip, limit=limit),
+    )
+
+@app.get("/stats/categories/{category_id}", response_model=RelationStatsOut)
+def category_stats(category_id: str):
+    crud._validate_uuid(category_id)
+    return coalesce.read(("category_stats", category_id), lambda db: stats.get_one(db, "category", category_id))
+
+@app.get("/stats/suppliers", response_model=list[RelationStatsOut])
+def bulk_supplier_stats(ids: Optional[str] = None, skip: int = 0, limit: int = 100):
+    ref_ids = _split_ids(ids)
+    return coalesce.read(
+        ("supplier_stats", ids, skip, limit),
+        lambda db: stats.get_many(db, "supplier", ref_ids, skip=skip, limit=limit),
+    )
+
+@app.get("/stats/suppliers/{supplier_id}", response_model=RelationStatsOut)
+def supplier_stats(supplier_id: str):
+    crud._validate_uuid(supplier_id)
+    return coalesce.read(("supplier_stats", supplier_id), lambda db: stats.get_one(db, "supplier", supplier_id))
+
+# ---- Background jobs
+@app.get("/jobs/{job_id}", response_model=JobOut)
+def read_job(job_id: str, db: Session = Depends(get_db)):
+    return jobs.out(jobs.get(db, job_id))
+
+@app.post("/jobs/{job_id}/retry", response_model=JobOut)
+def retry_job(job_id: str, db: Session = Depends(get_db)):
+    return jobs.out(jobs.retry(db, job_id))
@@ -0,0 +1,133 @@
+"""
+Offline re-sharding of the product store. Stop the service first, then:
+
+    python rebalance.py --to-shards 4                                    # -> 4 shards at PRODUCT_SHARD_URL
+    python rebalance.py --to-shards 8 --to-url 'sqlite:///./product_v2_{shard}.db'
+    python rebalance.py --to-shards 1 --to-url sqlite:///./product_merged.db
+
+The source is the layout the current settings describe (PRODUCT_SHARDS with DATABASE_URL or
+PRODUCT_SHARD_URL); it is only read. Every product is copied to the target shard its id hashes to,
+the per-shard stats are rebuilt from the copied rows and each target change log is seeded with one
+`create` entry per product. The service's own bookkeeping on the first shard (database.HOME_TABLES:
+pending cascade jobs, stored idempotent responses) is copied as it is to the first target shard.
+Targets are migrated first and must be empty and distinct from the source.
+Afterwards point PRODUCT_SHARDS / PRODUCT_SHARD_URL (or DATABASE_URL) at the new layout and start the
+service. Change feed cursors from the old layout get 410 and consumers resync from since=0.
+"""
+import argparse
+import logging
+import sys
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.engine import Engine
+
+from config import settings
+from database import HOME_TABLES, Base, engine, engines, make_engine, shard_index
+from models import Product, CategoryStats, SupplierStats, ChangeLog, ChangeLogMeta
+import changes
+import migrate
+import stats
+
+BATCH = 1000
+
+def _target_urls(count: int, url: str) -> List[str]:
+    if count == 1:
+        return [url.format(shard=0)]
+    if "{shard}" not in url:
+        raise SystemExit("--to-url must contain '{shard}' when --to-shards > 1")
+    return [url.format(shard=i) for i in range(count)]
+
+def _flush(targets, shard: int, products: list, entries: list) -> None:
+    with targets[shard].begin() as conn:
+        conn.execute(insert(Product), products)
+        conn.execute(insert(ChangeLog), entries)
+    products.clear()
+    entries.clear()
+
+def _home_tables():
+    return [table for table in Base.metadata.sorted_tables if table.name in HOME_TABLES]
+
+def _copy_home(target: Engine) -> Dict[str, int]:
+    """Copy the home-shard tables row for row (ids included) from the current first shard to `target`."""
+    copied = {}
+    with engine.connect() as src, target.begin() as dst:
+        for table in _home_tables():
+            copied[table.name] = 0
+            for part in src.execution_options(yield_per=BATCH).execute(select(table)).partitions():
+                dst.execute(insert(table), [dict(row._mapping) for row in part])
+                copied[table.name] += len(part)
+    return copied
+
+def rebalance(count: int, url: str) -> Tuple[Dict[int, int], Dict[str, int]]:
+    urls = _target_urls(count, url)
+    overlap = set(urls) & {str(eng.url) for eng in engines.values()}
+    if overlap:
+        raise SystemExit(f"Target overlaps the current layout ({', '.join(sorted(overlap))}); use another --to-url")
+    targets = [make_engine(u) for u in urls]
+    for eng in targets:
+        migrate.upgrade(eng)
+        with eng.connect() as conn:
+            for table in [Product.__table__, *_home_tables()]:
+                if conn.execute(select(func.count()).select_from(table)).scalar():
+                    raise SystemExit(f"Target {eng.url} already holds {table.name}")
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    copied = defaultdict(int)
+    pending = defaultdict(lambda: ([], []))
+    # shard -> kind -> ref_id -> [product_count, total_units, total_value_cents]
+    totals = defaultdict(lambda: {"category": defaultdict(lambda: [0, 0, 0]), "supplier": defaultdict(lambda: [0, 0, 0])})
+
+    for source in engines.values():
+        with source.connect() as conn:
+            rows = conn.execution_options(yield_per=BATCH).execute(select(Product.__table__))
+            for row in rows:
+                shard = shard_index(row.id, count)
+                products, entries = pending[shard]
+                products.append(dict(row._mapping))
+                entries.append({"entity_id": row.id, "op": "create", "data": changes.snapshot(row), "created_at": now})
+                quantity = int(row.quantity or 0)
+                cents = quantity * stats.to_cents(row.price)
+                for kind, ids in (("category", row.category_ids), ("supplier", row.supplier_ids)):
+                    for ref_id in set(ids or []):
+                        agg = totals[shard][kind][ref_id]
+                        agg[0] += 1; agg[1] += quantity; agg[2] += cents
+                copied[shard] += 1
+                if len(products) >= BATCH:
+                    _flush(targets, shard, products, entries)
+    for shard, (products, entries) in pending.items():
+        if products:
+            _flush(targets, shard, products, entries)
+
+    for shard, eng in enumerate(targets):
+        with eng.begin() as conn:
+            for kind, model, key in (("category", CategoryStats, "category_id"), ("supplier", SupplierStats, "supplier_id")):
+                rows = [
+                    {key: ref_id, "product_count": c, "total_units": u, "total_value_cents": v}
+                    for ref_id, (c, u, v) in totals[shard][kind].items()
+                ]
+                if rows:
+                    conn.execute(insert(model), rows)
+            # A same-length cursor from an older layout must not skip the seeded entries: below them is 410.
+            seeded = conn.execute(select(func.max(ChangeLog.seq))).scalar() or 0
+            conn.execute(insert(ChangeLogMeta).values(key=changes.HORIZON_KEY, value=seeded))
+    return {shard: copied[shard] for shard in range(count)}, _copy_home(targets[0])
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Copy the product store into a new shard layout (offline).")
+    parser.add_argument("--to-shards", type=int, required=True)
+    parser.add_argument("--to-url", default=None, help="target URL, with '{shard}' when --to-shards > 1 (default PRODUCT_SHARD_URL)")
+    args = parser.parse_args(argv)
+    if args.to_shards < 1:
+        raise SystemExit("--to-shards must be >= 1")
+    counts, home = rebalance(args.to_shards, args.to_url or settings.PRODUCT_SHARD_URL)
+    for shard, n in counts.items():
+        print(f"shard={shard} products={n}")
+    print(" ".join(f"{name}={n}" for name, n in home.items()), "(shard=0)")
+    print(f"total={sum(counts.values())} shards={args.to_shards}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -1,4 +1,5 @@
-from typing import List, Optional, Annotated
+from datetime import datetime
+from typing import List, Literal, Optional, Annotated
 from pydantic import BaseModel, Field
 from decimal import Decimal
 
@@ -31,3 +32,42 @@ class ProductOut(ProductBase):
 
     class Config:
         from_attributes = True
+
+class ProductBulkDelete(BaseModel):
+    ids: Optional[List[str]] = None
+    supplier_id: Optional[str] = None   # filter: every product linked to this supplier
+    category_id: Optional[str] = None   # filter: every product in this category (both filters: in both)
+
+class BulkDeleteOut(BaseModel):
+    deleted: int
+    missing: List[str] = Field(default_factory=list)  # requested ids that did not exist
+    job_id: Optional[str] = None                      # peer unlinks still being sent (GET /jobs/{job_id})
+
+class UnlinkPair(BaseModel):
+    id: str       # product
+    ref_id: str   # supplier / category / image to drop from it
+
+class BulkUnlink(BaseModel):
+    relation: Literal["suppliers", "categories", "images"]
+    pairs: List[UnlinkPair]
+
+class BulkUnlinkOut(BaseModel):
+    applied: int   # pairs naming an existing product (already unlinked ones included)
+
+class JobOut(BaseModel):
+    id: str
+    kind: str
+    status: str    # pending|running|done|failed
+    total: int
+    done: int
+    pending: int
+    attempts: int
+    last_error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+class RelationStatsOut(BaseModel):
+    id: str
+    product_count: int
+    total_units: int
+    total_value: Decimal
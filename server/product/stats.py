@@ -0,0 +1,206 @@
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from decimal import Decimal
+from itertools import groupby, islice
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SHARD_IDS, SHARDED, SessionLocal, shard_for
+from models import Product, CategoryStats, SupplierStats
+
+log = logging.getLogger("product.stats")
+
+CENT = Decimal("0.01")
+
+# What one product contributes to the aggregates of each category/supplier it links to.
+# Sharded, every shard keeps partial aggregates for its own products (in the product's write
+# transaction); reads add the partials up.
+class Contribution(NamedTuple):
+    quantity: int
+    value_cents: int
+    category_ids: frozenset
+    supplier_ids: frozenset
+    shard: str
+
+def to_cents(price) -> int:
+    return int(Decimal(price).quantize(CENT) * 100)
+
+def contribution(obj: Product) -> Contribution:
+    quantity = int(obj.quantity or 0)
+    return Contribution(
+        quantity=quantity,
+        value_cents=quantity * to_cents(obj.price),
+        category_ids=frozenset(obj.category_ids or []),
+        supplier_ids=frozenset(obj.supplier_ids or []),
+        shard=shard_for(obj.id),
+    )
+
+def _insert(db: Session, shard: str, model, key_col, ref_id: str, count: int, units: int, cents: int) -> None:
+    db.execute(
+        insert(model).values(**{key_col.key: ref_id}, product_count=count, total_units=units, total_value_cents=cents),
+        bind_arguments={"shard_id": shard},
+    )
+
+def _bump(db: Session, shard: str, model, key_col, ref_id: str, count: int, units: int, cents: int) -> None:
+    res = db.execute(
+        update(model)
+        .where(key_col == ref_id)
+        .values(
+            product_count=model.product_count + count,
+            total_units=model.total_units + units,
+            total_value_cents=model.total_value_cents + cents,
+        ),
+        bind_arguments={"shard_id": shard},
+    )
+    if res.rowcount == 0:
+        _insert(db, shard, model, key_col, ref_id, count, units, cents)
+
+def _apply_side(db: Session, model, key_col, before: Optional[Contribution], after: Optional[Contribution], attr: str) -> None:
+    old_ids = getattr(before, attr) if before else frozenset()
+    new_ids = getattr(after, attr) if after else frozenset()
+    same_values = before and after and before.quantity == after.quantity and before.value_cents == after.value_cents
+    shard = (after or before).shard
+    for ref_id in old_ids - new_ids:
+        _bump(db, shard, model, key_col, ref_id, -1, -before.quantity, -before.value_cents)
+    for ref_id in new_ids - old_ids:
+        _bump(db, shard, model, key_col, ref_id, 1, after.quantity, after.value_cents)
+    if not same_values:
+        for ref_id in old_ids & new_ids:
+            _bump(db, shard, model, key_col, ref_id, 0, after.quantity - before.quantity, after.value_cents - before.value_cents)
+
+def apply_delta(db: Session, before: Optional[Contribution], after: Optional[Contribution]) -> None:
+    """Move aggregates from `before` to `after` inside the caller's transaction (None = no product)."""
+    if before == after:
+        return
+    _apply_side(db, CategoryStats, CategoryStats.category_id, before, after, "category_ids")
+    _apply_side(db, SupplierStats, SupplierStats.supplier_id, before, after, "supplier_ids")
+
+# ---- Reads
+def _out(ref_id: str, rows) -> dict:
+    """Aggregate of `ref_id` from its rows (one per shard that has any of its products)."""
+    count = units = cents = 0
+    for row in rows:
+        count += row.product_count; units += row.total_units; cents += row.total_value_cents
+    return {
+        "id": ref_id,
+        "product_count": count,
+        "total_units": units,
+        "total_value": (Decimal(cents) / 100).quantize(CENT),
+    }
+
+def _model_for(kind: str):
+    return (CategoryStats, CategoryStats.category_id) if kind == "category" else (SupplierStats, SupplierStats.supplier_id)
+
+def get_one(db: Session, kind: str, ref_id: str) -> dict:
+    model, key_col = _model_for(kind)
+    return _out(ref_id, db.query(model).filter(key_col == ref_id).all())
+
+def get_many(db: Session, kind: str, ref_ids: Optional[List[str]], skip: int = 0, limit: int = 100) -> List[dict]:
+    model, key_col = _model_for(kind)
+    key = lambda r: getattr(r, key_col.key)
+    if ref_ids is None:
+        query = db.query(model).order_by(key_col)
+        if not SHARDED:
+            return [_out(key(r), [r]) for r in query.offset(skip).limit(limit).all()]
+        # A key among the first skip+limit overall is among the first skip+limit of every shard holding it.
+        runs = [query.limit(skip + limit).set_shard(shard).all() for shard in SHARD_IDS]
+        groups = groupby(heapq.merge(*runs, key=key), key=key)
+        return [_out(ref_id, rows) for ref_id, rows in islice(groups, skip, skip + limit)]
+    rows = defaultdict(list)
+    for r in db.query(model).filter(key_col.in_(ref_ids)).all():
+        rows[key(r)].append(r)
+    return [_out(rid, rows.get(rid, ())) for rid in ref_ids]
+
+# ---- Verification
+def _recompute(db: Session, shard: str) -> Dict[str, Dict[str, list]]:
+    expected = {"category": defaultdict(lambda: [0, 0, 0]), "supplier": defaultdict(lambda: [0, 0, 0])}
+    for obj in db.query(Product).set_shard(shard).yield_per(1000):
+        c = contribution(obj)
+        for kind, ids in (("category", c.category_ids), ("supplier", c.supplier_ids)):
+            for ref_id in ids:
+                agg = expected[kind][ref_id]
+                agg[0] += 1; agg[1] += c.quantity; agg[2] += c.value_cents
+    return expected
+
+def verify(db: Session, repair: bool = True) -> int:
+    """Recompute aggregates from a full scan (shard by shard) and compare; returns the number of rows that drifted."""
+    return sum(_verify_shard(db, shard, repair) for shard in SHARD_IDS)
+
+def _compare(db: Session, shard: str) -> List[tuple]:
+    """(kind, ref_id, stored, expected) for every aggregate of `shard` that a full recount disagrees with."""
+    expected = _recompute(db, shard)
+    drifted = []
+    for kind, wanted in expected.items():
+        model, key_col = _model_for(kind)
+        stored = {
+            ref_id: [count, units, cents]
+            for ref_id, count, units, cents in db.query(
+                key_col, model.product_count, model.total_units, model.total_value_cents
+            ).set_shard(shard)
+        }
+        for ref_id in set(stored) | set(wanted):
+            want, have = wanted.get(ref_id, [0, 0, 0]), stored.get(ref_id, [0, 0, 0])
+            if have != want:
+                drifted.append((kind, ref_id, have, want))
+    return drifted
+
+def _lock_shard(db: Session, shard: str) -> None:
+    """Hold `shard`'s write lock (BEGIN IMMEDIATE) until `db` commits: no product write lands in between."""
+    conn = db.connection(bind_arguments={"shard_id": shard})
+    if conn.dialect.name == "sqlite" and not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+def _verify_shard(db: Session, shard: str, repair: bool) -> int:
+    drifted = _compare(db, shard)
+    if drifted and repair:
+        # The scan runs alongside writers, so a difference may only be a write that committed mid-scan.
+        # Recount under the write lock, and repair by the difference rather than overwriting the row.
+        _lock_shard(db, shard)
+        db.expire_all()
+        drifted = _compare(db, shard)
+    for kind, ref_id, have, want in drifted:
+        log.warning("Stats drift %s %s (shard %s): stored=%s expected=%s", kind, ref_id, shard, have, want)
+        if repair:
+            model, key_col = _model_for(kind)
+            _bump(db, shard, model, key_col, ref_id, *(w - h for w, h in zip(want, have)))
+    if repair:
+        db.commit()
+    return len(drifted)
+
+class StatsVerifier:
+    """Daemon thread that periodically checks the incremental aggregates against a full recount."""
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stats-verifier", daemon=True)
+
+    def start(self) -> "StatsVerifier":
+        if self.interval > 0:
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                drift = verify(db)
+                if drift:
+                    log.warning("Stats verifier repaired %d aggregate rows", drift)
+            except Exception as e:
+                db.rollback()
+                log.warning("Stats verifier failed: %s", e)
+            finally:
+                db.close()
+            self._stop.wait(self.interval)
+
+def start_verifier() -> StatsVerifier:
+    return StatsVerifier(settings.STATS_VERIFY_INTERVAL).start()
@@ -1,17 +1,160 @@
 import logging
-import requests
-from typing import Iterable
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
 from config import settings
 
 log = logging.getLogger("product.sync")
 
+PEERS: Dict[str, str] = {
+    "supplier": settings.SUPPLIER_BASE_URL,
+    "category": settings.CATEGORY_BASE_URL,
+    "image": settings.IMAGE_BASE_URL,
+}
+
+# ---- Peer circuit breakers
+class CircuitBreaker:
+    """
+    Closed until `threshold` consecutive failures (exceptions or 5xx), then open: calls are
+    skipped for `reset_after` seconds, after which one trial call decides (half-open).
+    """
+
+    def __init__(self, name: str, threshold: int, reset_after: float):
+        self.name, self.threshold, self.reset_after = name, threshold, reset_after
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            self._trial = False
+            if ok:
+                self.failures, self.opened_at = 0, None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold or self.opened_at is not None:
+                if self.opened_at is None:
+                    log.warning("Circuit to %s opened after %d failures", self.name, self.failures)
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "failures": self.failures}
+
+breakers: Dict[str, CircuitBreaker] = {
+    name: CircuitBreaker(name, settings.BREAKER_FAILURES, settings.BREAKER_RESET_SECONDS) for name in PEERS
+}
+
+def _peer_for(url: str) -> Optional[str]:
+    for name, base in PEERS.items():
+        if url.startswith(base):
+            return name
+    return None
+
+# ---- Shared HTTP pool
+_session = None
+_session_lock = threading.Lock()
+
+def http():
+    """Keep-alive session shared by all sync calls; `requests` is only imported on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=len(PEERS), pool_maxsize=settings.HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+def _reset_http() -> None:
+    # Keep-alive sockets of a forked parent are not ours; the child opens its own pool on first use.
+    global _session, _session_lock
+    _session, _session_lock = None, threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_http)
+
+def warm_peers() -> Dict[str, bool]:
+    """Open one pooled connection per peer (GET /livez) so the first sync call skips connect."""
+    def ping(base: str) -> bool:
+        parts = urlsplit(base)
+        try:
+            http().get(f"{parts.scheme}://{parts.netloc}/livez", timeout=settings.HTTP_WARMUP_TIMEOUT)
+            return True
+        except Exception as e:
+            log.info("Peer warm-up %s failed: %s", base, e)
+            return False
+    with ThreadPoolExecutor(max_workers=len(PEERS)) as pool:
+        return dict(zip(PEERS, pool.map(ping, PEERS.values())))
+
 def _safe_request(method: str, url: str, json=None):
-    try:
-        resp = requests.request(method=method, url=url, json=json, timeout=settings.HTTP_TIMEOUT)
-        if resp.status_code >= 400:
-            log.warning("Sync %s %s -> %s %s", method, url, resp.status_code, resp.text)
-    except Exception as e:
-        log.warning("Sync exception %s %s: %s", method, url, e)
+    """
+    Best-effort peer call. Connection errors and 5xx are retried up to HTTP_RETRIES times with the
+    same Idempotency-Key, so a retry of a write that did land is answered from the peer's store.
+    Returns the last response, or None when the peer could not be reached (or its circuit is open).
+    """
+    breaker = breakers.get(_peer_for(url))
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    resp = None
+    for attempt in range(settings.HTTP_RETRIES + 1):
+        if breaker is not None and not breaker.allow():
+            log.warning("Sync skipped %s %s: circuit to %s is open", method, url, breaker.name)
+            return resp
+        ok, resp = False, None
+        try:
+            resp = http().request(method=method, url=url, json=json, headers=headers, timeout=settings.HTTP_TIMEOUT)
+            ok = resp.status_code < 500
+            if resp.status_code >= 400:
+                log.warning("Sync %s %s -> %s %s", method, url, resp.status_code, resp.text)
+        except Exception as e:
+            log.warning("Sync exception %s %s: %s", method, url, e)
+        finally:
+            if breaker is not None:
+                breaker.record(ok)
+        if ok:
+            return resp
+        if attempt < settings.HTTP_RETRIES:
+            time.sleep(settings.HTTP_RETRY_BACKOFF * 2 ** attempt)
+    return resp
+
+def bulk_unlink(peer: str, relation: Optional[str], pairs: List[Tuple[str, str]]) -> Optional[str]:
+    """
+    One request dropping each (peer row id, our id) pair, for cascade jobs (see jobs.py):
+        POST {peer}/bulk-unlink {"relation": ..., "pairs": [{"id": ..., "ref_id": ...}, ...]}
+    Returns None once the peer applied them, else what went wrong.
+    """
+    body = {"pairs": [{"id": owner_id, "ref_id": ref_id} for owner_id, ref_id in pairs]}
+    if relation:
+        body["relation"] = relation
+    resp = _safe_request("POST", f"{PEERS[peer]}/bulk-unlink", json=body)
+    if resp is None:
+        return f"{peer} unreachable"
+    if resp.status_code >= 300:
+        return f"{peer} answered {resp.status_code}: {resp.text[:500]}"
+    return None
 
 # ---- SUPPLIER bidirectional ----
 # Supplier service contract:
@@ -0,0 +1,113 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from config import settings
+import admission
+
+def _client(asgi):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi, raise_app_exceptions=False), base_url="http://test")
+
+def _gated_app(limit=1, queue_size=4, queue_timeout=5.0):
+    """An app behind its own controller; each handler records its name and waits for the gate."""
+    inner = FastAPI()
+    inner.state.order = []
+    gate = asyncio.Event()
+
+    @inner.get("/things/{name}")
+    async def read(name: str):
+        inner.state.order.append(name)
+        await gate.wait()
+        return {"name": name}
+
+    @inner.post("/things/{name}")
+    async def write(name: str):
+        inner.state.order.append(name)
+        await gate.wait()
+        return {"name": name}
+
+    @inner.post("/boom")
+    async def boom():
+        raise RuntimeError("boom")
+
+    controller = admission.AdmissionController(limit, queue_size, queue_timeout, {})
+    return inner, admission.AdmissionMiddleware(inner, router=inner.router, controller=controller), controller, gate
+
+async def _until(check):
+    while not check():
+        await asyncio.sleep(0.01)
+
+def test_saturated_limiter_sheds_with_503_and_retry_after():
+    async def go():
+        inner, asgi, controller, gate = _gated_app(limit=1, queue_size=0)
+        async with _client(asgi) as client:
+            first = asyncio.create_task(client.get("/things/a"))
+            await _until(lambda: controller.in_flight == 1)
+            shed = await client.get("/things/b")
+            gate.set()
+            return await first, shed, controller.snapshot()
+
+    first, shed, snapshot = asyncio.run(go())
+
+    assert first.status_code == 200
+    assert shed.status_code == 503
+    assert shed.headers["retry-after"] == str(settings.ADMISSION_RETRY_AFTER)
+    assert shed.json()["reason"] == "queue_full"
+    assert snapshot["shed"] == {"queue_full": 1}
+    assert snapshot["in_flight"] == 0
+
+def test_queued_reads_are_admitted_before_writes_in_arrival_order():
+    async def go():
+        inner, asgi, controller, gate = _gated_app(limit=1, queue_size=4)
+        async with _client(asgi) as client:
+            tasks = [asyncio.create_task(client.get("/things/running"))]
+            await _until(lambda: controller.in_flight == 1)
+            for method, name in (("POST", "w1"), ("GET", "r1"), ("POST", "w2"), ("GET", "r2")):
+                tasks.append(asyncio.create_task(client.request(method, f"/things/{name}")))
+                await _until(lambda: len(controller._waiters) == len(tasks) - 1)
+            gate.set()
+            responses = await asyncio.gather(*tasks)
+            return inner.state.order, responses
+
+    order, responses = asyncio.run(go())
+
+    assert [r.status_code for r in responses] == [200] * 5
+    assert order == ["running", "r1", "r2", "w1", "w2"]
+
+def test_read_at_a_full_queue_evicts_the_newest_write():
+    async def go():
+        inner, asgi, controller, gate = _gated_app(limit=1, queue_size=2)
+        async with _client(asgi) as client:
+            running = asyncio.create_task(client.get("/things/running"))
+            await _until(lambda: controller.in_flight == 1)
+            w1 = asyncio.create_task(client.post("/things/w1"))
+            await _until(lambda: len(controller._waiters) == 1)
+            w2 = asyncio.create_task(client.post("/things/w2"))
+            await _until(lambda: len(controller._waiters) == 2)
+            r1 = asyncio.create_task(client.get("/things/r1"))
+            evicted = await w2
+            gate.set()
+            return inner.state.order, evicted, await asyncio.gather(running, w1, r1)
+
+    order, evicted, admitted = asyncio.run(go())
+
+    assert evicted.status_code == 503 and evicted.json()["reason"] == "evicted"
+    assert [r.status_code for r in admitted] == [200, 200, 200]
+    assert order == ["running", "r1", "w1"]
+
+def test_slot_is_released_when_the_handler_raises():
+    async def go():
+        inner, asgi, controller, gate = _gated_app(limit=1, queue_size=0)
+        gate.set()
+        async with _client(asgi) as client:
+            failed = await client.post("/boom")
+            in_flight = controller.in_flight
+            after = await client.get("/things/a")
+            return failed, in_flight, after
+
+    failed, in_flight, after = asyncio.run(go())
+
+    assert failed.status_code == 500
+    assert in_flight == 0
+    assert after.status_code == 200
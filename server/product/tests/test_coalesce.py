@@ -0,0 +1,54 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+from sqlalchemy import event
+
+from database import engines
+from main import app
+from schemas import ProductCreate
+import coalesce
+import crud
+
+N = 8
+
+@contextmanager
+def count_selects(hold_until=None):
+    """Counts SELECTs on every engine; the first one waits (in its threadpool thread) for `hold_until()`."""
+    selects, first = [], threading.Event()
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            selects.append(statement)
+            if hold_until is not None and not first.is_set():
+                first.set()
+                deadline = time.monotonic() + 5
+                while not hold_until() and time.monotonic() < deadline:
+                    time.sleep(0.005)
+
+    for eng in engines.values():
+        event.listen(eng, "before_cursor_execute", before)
+    try:
+        yield selects
+    finally:
+        for eng in engines.values():
+            event.remove(eng, "before_cursor_execute", before)
+
+async def _get_all(path, n):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await asyncio.gather(*(client.get(path) for _ in range(n)))
+
+def test_concurrent_identical_reads_run_one_query(db):
+    product = crud.create(db, ProductCreate(name="widget", quantity=1, price="2.50"))
+    coalesce.reads.forget()
+    shared = coalesce.reads.shared
+    # The one query is held until the other N - 1 requests have joined its flight.
+    with count_selects(hold_until=lambda: coalesce.reads.shared - shared >= N - 1) as selects:
+        responses = asyncio.run(_get_all(f"/products/{product.id}", N))
+
+    assert [r.status_code for r in responses] == [200] * N
+    assert {r.json()["id"] for r in responses} == {product.id}
+    assert len(selects) == 1, selects
@@ -0,0 +1,30 @@
+import asyncio
+
+from database import SessionLocal
+from models import ChangeLog
+from schemas import ProductCreate
+import changes
+import crud
+import events
+
+def test_commits_reporting_out_of_order_reach_streams_in_seq_order(db):
+    for name in ("a", "b", "c"):
+        crud.create(db, ProductCreate(name=name, quantity=1, price="1.00"))
+    with SessionLocal() as s:
+        entries = [changes.entry_out(e) for e in s.query(ChangeLog).order_by(ChangeLog.seq)]
+    first, second, third = entries
+
+    loop = asyncio.new_event_loop()
+    broker = events.Broker(backlog=16)
+    broker.bind(loop, [first["seq"] - 1])
+    try:
+        # The third commit's thread reports first; the other two straggle in after it.
+        broker.publish([third])
+        broker.publish([first])
+        broker.publish([second])
+        loop.run_until_complete(asyncio.sleep(0))
+    finally:
+        loop.close()
+
+    assert [e["seq"] for e in broker.since([0])] == [e["seq"] for e in entries]
+    assert broker.latest == [third["seq"]]
@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import httpx
+from fastapi import FastAPI, Request
+
+from main import app
+from models import Product
+import idempotency
+
+def _client(asgi):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi), base_url="http://test")
+
+def _counting_app(gate=None):
+    """An app behind its own middleware and in-memory store, counting how often its handler runs."""
+    inner = FastAPI()
+    inner.state.calls = 0
+
+    @inner.post("/things", status_code=201)
+    async def create(request: Request):
+        inner.state.calls += 1
+        if gate is not None:
+            await gate.wait()
+        return {"call": inner.state.calls, "body": await request.json()}
+
+    store = idempotency.IdempotencyStore(max_entries=100, ttl=60)
+    return inner, idempotency.IdempotencyMiddleware(inner, store=store), store
+
+def test_replayed_post_returns_the_stored_response(db):
+    async def go():
+        async with _client(app) as client:
+            headers = {"Idempotency-Key": "create-widget"}
+            body = {"name": "widget", "quantity": 1, "price": "2.50"}
+            return [await client.post("/products", json=body, headers=headers) for _ in range(2)]
+
+    first, second = asyncio.run(go())
+
+    assert first.status_code == second.status_code == 201
+    assert second.json() == first.json()
+    assert "idempotent-replayed" not in first.headers
+    assert second.headers["idempotent-replayed"] == "true"
+    assert db.query(Product).count() == 1
+
+def test_concurrent_duplicate_runs_the_handler_once():
+    async def go():
+        gate = asyncio.Event()
+        inner, asgi, _ = _counting_app(gate)
+        async with _client(asgi) as client:
+            send = lambda: client.post("/things", json={"n": 1}, headers={"Idempotency-Key": "k"})
+            first = asyncio.create_task(send())
+            second = asyncio.create_task(send())
+            while inner.state.calls == 0:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)          # the duplicate is waiting on the first by now
+            gate.set()
+            return inner.state.calls, await first, await second
+
+    calls, first, second = asyncio.run(go())
+
+    assert calls == 1
+    assert first.json() == second.json() == {"call": 1, "body": {"n": 1}}
+    assert {first.headers.get("idempotent-replayed"), second.headers.get("idempotent-replayed")} == {None, "true"}
+
+def test_same_key_with_a_different_body_is_422():
+    async def go():
+        inner, asgi, _ = _counting_app()
+        async with _client(asgi) as client:
+            ok = await client.post("/things", json={"n": 1}, headers={"Idempotency-Key": "k"})
+            reused = await client.post("/things", json={"n": 2}, headers={"Idempotency-Key": "k"})
+            return inner.state.calls, ok, reused
+
+    calls, ok, reused = asyncio.run(go())
+
+    assert ok.status_code == 201
+    assert reused.status_code == 422
+    assert calls == 1
+
+def test_expired_response_is_not_replayed():
+    async def go():
+        inner, asgi, store = _counting_app()
+        store.ttl = 0
+        async with _client(asgi) as client:
+            for _ in range(2):
+                await client.post("/things", json={"n": 1}, headers={"Idempotency-Key": "k"})
+        return inner.state.calls
+
+    assert asyncio.run(go()) == 2
+
+def test_shared_store_claim_is_visible_to_a_fresh_store(db):
+    key = ("POST", "/products", "shared-key")
+    first = idempotency.SharedStore(ttl=60, lease=60)
+    claim = first._claim(key, "fp")
+
+    other = idempotency.SharedStore(ttl=60, lease=60)    # another worker: nothing in memory
+    seen = other._lookup(key)
+    assert (seen.fingerprint, seen.token, seen.finished) == ("fp", claim.token, False)
+    assert other._claim(key, "fp") is None
+
+    first._finish(key, claim, 201, [(b"content-type", b"application/json")], json.dumps({"id": "x"}).encode())
+    done = idempotency.SharedStore(ttl=60, lease=60)._lookup(key)
+    assert (done.status, done.headers, done.body) == (201, [(b"content-type", b"application/json")], b'{"id": "x"}')
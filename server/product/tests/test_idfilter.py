@@ -0,0 +1,86 @@
+import asyncio
+import uuid
+
+import httpx
+
+from config import settings
+from main import app
+from schemas import ProductCreate
+import crud
+import idfilter
+
+def _product(db):
+    return crud.create(db, ProductCreate(name="p", quantity=1, price="1.00")).id
+
+def _own(min_capacity=settings.IDFILTER_MIN_CAPACITY):
+    return idfilter.OwnIds(settings.IDFILTER_ERROR_RATE, min_capacity)
+
+def _get_filter(headers=None):
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.get("/products/idfilter", headers=headers or {})
+    return asyncio.run(go())
+
+def test_no_false_negatives_and_a_bounded_false_positive_rate():
+    bloom = idfilter.BloomFilter.for_capacity(2000, 0.01)
+    ids = [str(uuid.uuid4()) for _ in range(2000)]
+    for id_ in ids:
+        bloom.add(id_)
+    # What a peer rebuilds from the response: the bit array and the two sizes.
+    copy = idfilter.BloomFilter(bloom.bits, bloom.hashes, bytes(bloom.data), bloom.count)
+
+    assert all(id_ in bloom and id_ in copy for id_ in ids)
+    unknown = [str(uuid.uuid4()) for _ in range(20000)]
+    assert sum(id_ in copy for id_ in unknown) / len(unknown) < 0.02
+
+def test_filter_is_rebuilt_once_creates_and_deletes_outgrow_capacity(db):
+    ids = [_product(db) for _ in range(3)]
+    own = _own(min_capacity=4)
+    own.rebuild()
+    assert (own.bloom.capacity, own.bloom.count, own.generation) == (6, 3, 1)
+
+    extra = [str(uuid.uuid4()) for _ in range(3)]
+    own.on_commit([{"op": "create", "id": i} for i in extra])
+    own.on_commit([{"op": "delete", "id": ids[0]}])
+    assert own.full                                   # 6 ids + 1 delete > 6
+    _, bloom = own.current()
+
+    assert own.generation == 2 and own.removed == 0
+    assert all(i in bloom for i in ids)               # rows still in the table; extra ids were never written
+    assert bloom.count == 3 and bloom.capacity == 6
+
+def test_matching_if_none_match_is_304_until_an_id_is_added(db):
+    idfilter.owned.rebuild()
+    first = _get_filter()
+    assert first.status_code == 200
+    assert first.headers["content-type"] == "application/octet-stream"
+    etag = first.headers["etag"]
+
+    again = _get_filter({"If-None-Match": etag})
+
+    assert again.status_code == 304 and again.content == b""
+    assert again.headers["etag"] == etag
+
+    pid = _product(db)                                # its commit adds the id to the served filter
+    changed = _get_filter({"If-None-Match": etag})
+
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    bloom = idfilter.BloomFilter(int(changed.headers["x-filter-bits"]), int(changed.headers["x-filter-hashes"]), changed.content)
+    assert pid in bloom
+
+def test_workers_with_the_same_ids_agree_on_the_etag(db):
+    for _ in range(3):
+        _product(db)
+    first, second = _own(), _own()
+    first.rebuild()
+    second.rebuild()
+    second.rebuild()                                  # another generation, same bits
+
+    assert first.current()[0] == second.current()[0]
+
+    new = str(uuid.uuid4())
+    first.on_commit([{"op": "create", "id": new}])
+    assert first.current()[0] != second.current()[0]
+
+    second.on_commit([{"op": "create", "id": new}])
+    assert first.current()[0] == second.current()[0]
@@ -0,0 +1,60 @@
+from sqlalchemy import create_engine, event
+
+import maintenance
+
+def _engine(path, auto_vacuum="INCREMENTAL"):
+    """A scratch SQLite file set up like database.py's, with a table that left free pages behind."""
+    eng = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(eng, "connect")
+    def _pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute(f"PRAGMA auto_vacuum={auto_vacuum}")
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.close()
+
+    with eng.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE churn (id INTEGER PRIMARY KEY, body TEXT)")
+        conn.exec_driver_sql("CREATE INDEX ix_churn_body ON churn (body)")
+        for i in range(2000):
+            conn.exec_driver_sql("INSERT INTO churn (body) VALUES (?)", (f"{i:06d}" * 50,))
+    with eng.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM churn WHERE id % 4 != 0")
+    return eng
+
+def _tick(scheduler):
+    """What one scheduler tick does once tasks are due and traffic is quiet."""
+    scheduler.quiet()             # the previous tick's reading: requests other tests made came before it
+    assert scheduler.quiet()
+    scheduler.run(scheduler.due())
+
+def test_tick_checkpoints_vacuums_and_analyzes(tmp_path):
+    path = str(tmp_path / "maint.db")
+    eng = _engine(path)
+    before = maintenance.file_stats(eng)
+    assert before["auto_vacuum"] == "incremental" and before["free_pages"] > 0
+    scheduler = maintenance.Maintenance({"scratch": eng}, tick=1.0, budget=5.0)
+
+    _tick(scheduler)
+
+    assert {task: run["status"] for task, run in scheduler.last.items()} == {"checkpoint": "ok", "vacuum": "ok", "analyze": "ok"}
+    checkpoint = scheduler.last["checkpoint"]["result"]["scratch"]
+    assert checkpoint["blocked"] is False and checkpoint["checkpointed"] == checkpoint["wal_frames"]
+    assert scheduler.last["vacuum"]["result"]["scratch"] == {"free_pages": 0, "freed_pages": before["free_pages"]}
+    after = maintenance.file_stats(eng)
+    assert after["free_pages"] == 0 and after["pages"] < before["pages"]
+    with eng.connect() as conn:
+        assert conn.exec_driver_sql("SELECT count(*) FROM sqlite_stat1").scalar() > 0
+    assert scheduler.due() == []                      # each task waits out its interval now
+    eng.dispose()
+
+def test_vacuum_is_skipped_without_incremental_auto_vacuum(tmp_path):
+    eng = _engine(str(tmp_path / "plain.db"), auto_vacuum="NONE")
+    scheduler = maintenance.Maintenance({"scratch": eng}, tick=1.0, budget=5.0)
+
+    _tick(scheduler)
+
+    assert scheduler.last["vacuum"]["status"] == "ok"
+    assert scheduler.last["vacuum"]["result"]["scratch"]["skipped"] == "auto_vacuum=none"
+    assert maintenance.file_stats(eng)["free_pages"] > 0
+    eng.dispose()
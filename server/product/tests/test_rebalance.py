@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from models import IdempotencyRecord, Job, JobTask, Product
+from schemas import ProductCreate
+import crud
+import jobs
+import rebalance
+
+def _count(eng, model):
+    with eng.connect() as conn:
+        return conn.execute(select(func.count()).select_from(model)).scalar()
+
+def test_rebalance_carries_pending_jobs_and_idempotency_keys(db, tmp_path):
+    for name in ("a", "b", "c"):
+        crud.create(db, ProductCreate(name=name, quantity=1, price="1.00"))
+    job = jobs.enqueue(db, "delete_cascade", [("supplier", "products", "s1", "p1"), ("image", None, "i1", "p1")])
+    db.add(IdempotencyRecord(key="k" * 64, fingerprint="f" * 64, token="t" * 32, status=201,
+                             headers=[], body=b"{}", expires_at=datetime.utcnow() + timedelta(hours=1)))
+    db.commit()
+
+    counts, home = rebalance.rebalance(2, f"sqlite:///{tmp_path}/product_{{shard}}.db")
+
+    assert sum(counts.values()) == 3
+    assert home == {"jobs": 1, "job_tasks": 2, "idempotency_keys": 1}
+    first, second = (rebalance.make_engine(f"sqlite:///{tmp_path}/product_{i}.db") for i in range(2))
+    with first.connect() as conn:
+        assert conn.execute(select(Job.id, Job.status)).all() == [(job.id, "pending")]
+    assert _count(first, JobTask) == 2
+    assert _count(first, IdempotencyRecord) == 1
+    assert (_count(second, Job), _count(second, JobTask), _count(second, IdempotencyRecord)) == (0, 0, 0)
+    assert _count(first, Product) + _count(second, Product) == 3
@@ -0,0 +1,81 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+
+from database import SessionLocal
+from main import app
+from models import Product
+from schemas import ProductCreate, ProductUpdate
+import changes
+import crud
+import snapshot
+import sync
+
+class _Response:
+    def __init__(self, status_code, body=None):
+        self.status_code, self.body, self.text = status_code, body, ""
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+class _Source:
+    """The live copy catch-up reads from: answers GET .../changes with queued responses."""
+
+    def __init__(self, *responses):
+        self.responses, self.calls = list(responses), []
+
+    def get(self, url, params=None, timeout=None):
+        self.calls.append((url, dict(params)))
+        return self.responses.pop(0)
+
+def _feed(since):
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.get("/products/changes", params={"since": since, "limit": 5000})
+    return asyncio.run(go()).json()
+
+def _product(db, name):
+    return crud.create(db, ProductCreate(name=name, quantity=1, price="1.00")).id
+
+def test_snapshot_restore_and_catch_up_from_its_cursor(db, tmp_path, monkeypatch):
+    a, b = _product(db, "a"), _product(db, "b")
+    manifest = snapshot.create(str(tmp_path))
+    with SessionLocal() as fresh:
+        assert manifest["cursor"] == changes.cursor_token(changes.latest_cursor(fresh))
+    assert all(os.path.exists(tmp_path / f["file"]) for f in manifest["files"])
+
+    # Written after the snapshot: the live copy's feed from the snapshot's cursor carries them.
+    c = _product(db, "c")
+    crud.update(db, a, ProductUpdate(name="a2"))
+    live = _feed(manifest["cursor"])
+    assert [e["op"] for e in live["changes"]] == ["create", "update"]
+    with SessionLocal() as fresh:
+        live_cursor = changes.latest_cursor(fresh)
+    db.close()
+
+    snapshot.restore(str(tmp_path / f"{manifest['name']}.json"), force=True)
+
+    with SessionLocal() as restored:
+        assert sorted(p.name for p in restored.query(Product)) == ["a", "b"]
+
+    source = _Source(_Response(200, live))
+    monkeypatch.setattr(sync, "http", lambda: source)
+
+    assert snapshot.catch_up("http://live/products") == len(live["changes"])
+
+    assert source.calls == [("http://live/products/changes", {"since": manifest["cursor"], "limit": snapshot.CATCH_UP_PAGE})]
+    with SessionLocal() as caught_up:
+        assert sorted((p.id, p.name) for p in caught_up.query(Product)) == sorted([(a, "a2"), (b, "b"), (c, "c")])
+        assert changes.latest_cursor(caught_up) == live_cursor
+
+def test_catch_up_past_the_source_horizon_is_an_error(db, monkeypatch):
+    monkeypatch.setattr(sync, "http", lambda: _Source(_Response(410)))
+
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.catch_up("http://live/products")
@@ -0,0 +1,47 @@
+import uuid
+
+from database import SessionLocal
+from models import CategoryStats
+from schemas import ProductCreate
+import crud
+import stats
+
+CATEGORY = str(uuid.uuid4())
+
+def _product(db, quantity):
+    return crud.create(db, ProductCreate(name="p", quantity=quantity, price="1.00", category_ids=[CATEGORY]))
+
+def _stored(db):
+    db.expire_all()
+    return stats.get_one(db, "category", CATEGORY)
+
+def test_verify_repairs_drift(db):
+    _product(db, 2)
+    db.query(CategoryStats).update({"product_count": 7})
+    db.commit()
+
+    assert stats.verify(db) == 1
+    assert _stored(db)["product_count"] == 1
+    assert stats.verify(db, repair=False) == 0
+
+def test_verify_keeps_a_write_that_commits_mid_scan(db, monkeypatch):
+    _product(db, 2)
+    db.query(CategoryStats).update({"product_count": 7})
+    db.commit()
+    recompute, calls = stats._recompute, []
+
+    def racing_recompute(session, shard):
+        expected = recompute(session, shard)
+        if not calls:
+            with SessionLocal() as other:        # a product write lands between the scan and the repair
+                _product(other, 3)
+        calls.append(shard)
+        return expected
+
+    monkeypatch.setattr(stats, "_recompute", racing_recompute)
+    stats.verify(db)
+    monkeypatch.undo()
+
+    assert stats.verify(db, repair=False) == 0
+    assert _stored(db)["product_count"] == 2
+    assert _stored(db)["total_units"] == 5
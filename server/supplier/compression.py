@@ -0,0 +1,125 @@
+import zlib
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import settings
+
+try:  # optional: `pip install brotli` enables br
+    import brotli
+except ImportError:  # pragma: no cover
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+# Already compressed or streamed to clients that must see each event as it is produced.
+SKIP_TYPES = ("text/event-stream", "image/", "video/", "audio/", "application/zip", "application/gzip")
+
+def choose(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header (q-values honoured, br preferred on ties)."""
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            weights[coding.strip().lower()] = q
+    offered = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for coding in offered:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+class _Encoder:
+    def __init__(self, coding: str):
+        self.coding = coding
+        if coding == "br":
+            self._c = brotli.Compressor(quality=settings.COMPRESS_BROTLI_QUALITY)
+        else:
+            self._c = zlib.compressobj(settings.COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def encode(self, data: bytes, final: bool) -> bytes:
+        if self.coding == "br":
+            out = self._c.process(data)
+            return out + (self._c.finish() if final else self._c.flush())
+        return self._c.compress(data) + self._c.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+class CompressionMiddleware:
+    """
+    Compresses response bodies of at least COMPRESS_MIN_BYTES with the client's preferred encoding.
+    Single-message bodies are compressed whole; streamed bodies chunk by chunk. Event streams,
+    media, partial content and responses that already carry a Content-Encoding pass through.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD" or settings.COMPRESS_MIN_BYTES < 0:
+            await self.app(scope, receive, send)
+            return
+        coding = choose(Headers(scope=scope).get("accept-encoding", ""))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _Responder(send, coding).send)
+
+class _Responder:
+    def __init__(self, send: Send, coding: str):
+        self._send = send
+        self.coding = coding
+        self.start: Optional[Message] = None
+        self.encoder: Optional[_Encoder] = None
+        self.passthrough = False
+
+    def _eligible(self, headers: MutableHeaders) -> bool:
+        status = self.start["status"]
+        ctype = headers.get("content-type", "")
+        return (200 <= status < 300 and status not in (204, 206)
+                and "content-encoding" not in headers and "accept-ranges" not in headers
+                and not ctype.startswith(SKIP_TYPES))
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if self.passthrough:
+            await self._send(message)
+            return
+        if self.encoder is not None:
+            message["body"] = self.encoder.encode(message.get("body", b""), not message.get("more_body", False))
+            await self._send(message)
+            return
+
+        # First body message: decide now.
+        headers = MutableHeaders(raw=self.start["headers"])
+        body, more = message.get("body", b""), message.get("more_body", False)
+        if message["type"] != "http.response.body" or not self._eligible(headers):
+            self.passthrough = True
+            await self._send(self.start)
+            await self._send(message)
+            return
+        headers.add_vary_header("Accept-Encoding")
+        if not more and len(body) < settings.COMPRESS_MIN_BYTES:
+            self.passthrough = True
+            await self._send(self.start)
+            await self._send(message)
+            return
+        self.encoder = _Encoder(self.coding)
+        headers["Content-Encoding"] = self.coding
+        message["body"] = self.encoder.encode(body, not more)
+        if more:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(len(message["body"]))
+        await self._send(self.start)
+        await self._send(message)
@@ -1,47 +1,56 @@
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
-from typing import List, Optional
+from typing import Dict, List, Optional, Sequence, Tuple
 import uuid
 
+from config import settings
+from database import lock_for_write
 from models import Supplier
-from schemas import SupplierCreate, SupplierUpdate
+from schemas import SupplierBulkDelete, SupplierCreate, SupplierUpdate, UnlinkPair
+import batching
+import changes
+import idfilter
+import idtypes
+import jobs
+import sparse
 
-def _validate_uuid(id_str: str) -> None:
-    try:
-        uuid.UUID(str(id_str))
-    except Exception:
+def _validate_uuid(id_str: str) -> str:
+    if not idtypes.is_uuid(id_str):
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID: {id_str}")
+    return idtypes.canonical(id_str)
 
 def _clean_ids(ids: Optional[List[str]]) -> Optional[List[str]]:
     if ids is None:
         return None
-    out, seen = [], set()
-    for s in ids:
-        _validate_uuid(s)
-        if s not in seen:
-            seen.add(s)
-            out.append(s)
-    return out
-
-def get(db: Session, supplier_id: str) -> Supplier:
-    obj = db.query(Supplier).filter(Supplier.id == supplier_id).first()
+    bad = idtypes.first_invalid(ids)
+    if bad is not None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID: {bad}")
+    return list(dict.fromkeys(idtypes.canonical(s) for s in ids))
+
+def get(db: Session, supplier_id: str, fields: Optional[Sequence[str]] = None) -> Supplier:
+    """With `fields`, only those columns are loaded and a row tuple in that order is returned."""
+    query = db.query(*sparse.columns(Supplier, fields)) if fields else db.query(Supplier)
+    obj = query.filter(Supplier.id == supplier_id).first()
     if not obj:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Supplier not found")
     return obj
 
-def list_all(db: Session, skip: int = 0, limit: int = 100) -> List[Supplier]:
-    return db.query(Supplier).offset(skip).limit(limit).all()
+def list_all(db: Session, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None) -> List[Supplier]:
+    query = db.query(*sparse.columns(Supplier, fields)) if fields else db.query(Supplier)
+    return query.offset(skip).limit(limit).all()
 
 def create(db: Session, payload: SupplierCreate) -> Supplier:
-    sid = payload.id or str(uuid.uuid4())
-    _validate_uuid(sid)
+    sid = _validate_uuid(payload.id or str(uuid.uuid4()))
+    product_ids = _clean_ids(payload.product_ids) or []
+    idfilter.require("product", product_ids)
     obj = Supplier(
         id=sid,
         name=payload.name,
         contact=str(payload.contact),
-        product_ids=_clean_ids(payload.product_ids) or [],
+        product_ids=product_ids,
     )
     db.add(obj)
+    changes.record(db, "create", obj)
     db.commit()
     db.refresh(obj)
     return obj
@@ -50,27 +59,108 @@ def update(db: Session, supplier_id: str, payload: SupplierUpdate) -> Supplier:
     obj = get(db, supplier_id)
     if payload.name is not None: obj.name = payload.name
     if payload.contact is not None: obj.contact = str(payload.contact)
-    if payload.product_ids is not None: obj.product_ids = _clean_ids(payload.product_ids) or []
+    if payload.product_ids is not None:
+        product_ids = _clean_ids(payload.product_ids) or []
+        # Only new links are checked: existing ones stay even if the peer has dropped the id since.
+        idfilter.require("product", [i for i in product_ids if i not in (obj.product_ids or [])])
+        obj.product_ids = product_ids
+    changes.record(db, "update", obj)
     db.commit(); db.refresh(obj)
     return obj
 
-def delete(db: Session, supplier_id: str) -> None:
-    obj = get(db, supplier_id)
-    db.delete(obj)
+def delete(db: Session, supplier_id: str) -> Optional[jobs.Job]:
+    return delete_many(db, [get(db, supplier_id)])
+
+def select_for_delete(db: Session, payload: SupplierBulkDelete) -> Tuple[List[Supplier], List[str]]:
+    """The suppliers a bulk delete names (ids) or matches (filter), and the named ids that do not exist."""
+    if (payload.ids is None) == (payload.product_id is None):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Give either ids or a filter (product_id)")
+    if payload.ids is not None:
+        ids = _clean_ids(payload.ids)
+        if len(ids) > settings.BULK_DELETE_MAX_ROWS:
+            raise _too_many(len(ids))
+        objs = db.query(Supplier).filter(Supplier.id.in_(ids)).all() if ids else []
+        found = {obj.id for obj in objs}
+        return objs, [sid for sid in ids if sid not in found]
+    product_id = _validate_uuid(payload.product_id)
+    objs = [obj for obj in db.query(Supplier).all() if product_id in (obj.product_ids or [])]
+    if len(objs) > settings.BULK_DELETE_MAX_ROWS:
+        raise _too_many(len(objs))
+    return objs, []
+
+def _too_many(n: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail=f"{n} suppliers selected, a bulk delete removes at most {settings.BULK_DELETE_MAX_ROWS}",
+    )
+
+def delete_many(db: Session, objs: List[Supplier]) -> Optional[jobs.Job]:
+    """
+    Delete `objs` in one transaction. Their products are not called here: one product unlink per link
+    is queued as a background job, committed with the delete, and sent in batches by jobs.runner.
+    Returns that job (None when the suppliers had no products).
+    """
+    tasks = []
+    for obj in objs:
+        tasks += [("product", "suppliers", pid, obj.id) for pid in obj.product_ids or []]
+        changes.record(db, "delete", entity_id=obj.id)
+        db.delete(obj)
+    job = jobs.enqueue(db, "delete_cascade", tasks)
     db.commit()
+    if job is not None:
+        jobs.runner.wake()
+    return job
 
-def add_product(db: Session, supplier_id: str, product_id: str) -> Supplier:
-    _validate_uuid(product_id)
+def apply_links(db: Session, supplier_id: str, ops: List[Tuple[str, str]]) -> List[dict]:
+    """
+    Apply ("link" | "unlink", product_id) calls to one supplier in order, in one transaction, with one
+    write of product_ids. Each call still gets its own change entry and sees the row as it stood right
+    after its own change.
+    """
+    lock_for_write(db)          # other worker processes batch their own calls to this row
     obj = get(db, supplier_id)
-    if product_id not in (obj.product_ids or []):
-        obj.product_ids.append(product_id)
-        db.commit(); db.refresh(obj)
-    return obj
+    ids = dict.fromkeys(obj.product_ids or [])
+    results = []
+    for op, product_id in ops:
+        if (op == "link") == (product_id in ids):          # already linked / not linked: nothing to do
+            results.append(changes.snapshot(obj))
+            continue
+        if op == "link":
+            ids[product_id] = None
+        else:
+            del ids[product_id]
+        obj.product_ids = list(ids)
+        results.append(changes.record(db, op, obj, relation="products", ref_id=product_id).data)
+    db.commit()
+    return results
 
-def remove_product(db: Session, supplier_id: str, product_id: str) -> Supplier:
-    _validate_uuid(product_id)
-    obj = get(db, supplier_id)
-    if product_id in (obj.product_ids or []):
-        obj.product_ids = [x for x in obj.product_ids if x != product_id]
-        db.commit(); db.refresh(obj)
-    return obj
+links = batching.GroupCommitter(apply_links, settings.GROUP_COMMIT_WINDOW_MS / 1000, settings.GROUP_COMMIT_MAX_OPS)
+
+def add_product(db: Session, supplier_id: str, product_id: str) -> dict:
+    return links.submit(db, idtypes.canonical(supplier_id), ("link", _validate_uuid(product_id)))
+
+def remove_product(db: Session, supplier_id: str, product_id: str) -> dict:
+    return links.submit(db, idtypes.canonical(supplier_id), ("unlink", _validate_uuid(product_id)))
+
+def bulk_unlink(db: Session, pairs: List[UnlinkPair]) -> int:
+    """
+    Drop each pair's product from its supplier (sent by Product's delete cascade jobs). The pairs of one
+    supplier go through `links` together; unknown suppliers and links already gone are no-ops, so a
+    retried batch is harmless. Returns how many pairs named an existing supplier.
+    """
+    bad = idtypes.first_invalid([p.id for p in pairs] + [p.ref_id for p in pairs])
+    if bad is not None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid UUID: {bad}")
+    ops: Dict[str, List[Tuple[str, str]]] = {}
+    for p in pairs:
+        ops.setdefault(idtypes.canonical(p.id), []).append(("unlink", idtypes.canonical(p.ref_id)))
+    applied = 0
+    for supplier_id, supplier_ops in ops.items():
+        try:
+            links.submit_many(db, supplier_id, supplier_ops)
+        except HTTPException as e:
+            if e.status_code != status.HTTP_404_NOT_FOUND:
+                raise
+            continue
+        applied += len(supplier_ops)
+    return applied
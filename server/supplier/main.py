@@ -1,35 +1,114 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
 import logging
-from fastapi import FastAPI, Depends, status
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 from config import settings
-from database import Base, engine
+from database import SessionLocal, engine, warm_pool
 from deps import get_db
+import bus
 import crud
-from schemas import SupplierCreate, SupplierUpdate, SupplierOut, LinkProductOp
+import changes
+import events
+import admission
+import coalesce
+import compression
+import idempotency
+import idfilter
+import jobs
+import profiling
+import snapshot
+import sparse
+import maintenance
+import probes
+import sync
+import workers
+from schemas import (
+    SupplierCreate, SupplierUpdate, SupplierOut, LinkProductOp,
+    SupplierBulkDelete, BulkDeleteOut, BulkUnlink, BulkUnlinkOut, JobOut,
+)
 from sync import (
     sync_add_supplier_to_products,
-    sync_remove_supplier_from_products,
     sync_replace_supplier_products,
 )
 
-# Initialize DB schema
-Base.metadata.create_all(bind=engine)
-
 # Logging
 logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO))
 log = logging.getLogger("supplier.service")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema is managed by `python migrate.py`, run before the server starts.
+    warmup_started = time.perf_counter()
+    warm_pool(settings.DB_WARM_CONNECTIONS)
+    probes.require_schema()
+    idfilter.owned.rebuild()
+    sync.warm_peers()
+    leader = app.state.leader = workers.elect(lambda: [changes.start_compactor(), jobs.start_runner(), maintenance.start()])
+    with SessionLocal() as db:
+        latest = changes.latest_seq(db)
+    events.broker.bind(asyncio.get_running_loop(), latest)
+    change_bus = bus.start(latest)
+    probes.startup.mark_ready(_IMPORT_STARTED, warmup_started)
+    yield
+    change_bus.stop()
+    leader.stop()
+
 app = FastAPI(
     title="Supplier Service",
     version="1.0.0",
     description="CRUD for suppliers with validations and bidirectional sync to Product service.",
+    lifespan=lifespan,
 )
+profiling.install(app, [engine])
+app.add_middleware(admission.AdmissionMiddleware, router=app.router)
+app.add_middleware(idempotency.IdempotencyMiddleware)
+app.add_middleware(compression.CompressionMiddleware)
 
 # ---- Health
 @app.get("/health")
 def health():
-    return {"status": "ok", "service": "supplier", "version": "1.0.0"}
+    # File size, free-page share and the last maintenance runs (those run in the leading worker only).
+    return {"status": "ok", "service": "supplier", "version": "1.0.0", "maintenance": maintenance.scheduler.snapshot()}
+
+@app.get("/livez")
+async def livez():
+    # Served on the event loop: stays answerable even when the threadpool or database is saturated.
+    return {"status": "alive"}
+
+@app.get("/readyz")
+def readyz():
+    ok, body = probes.readiness()
+    return JSONResponse(body, status_code=status.HTTP_200_OK if ok else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+@app.get("/admission")
+async def admission_stats():
+    return admission.controller.snapshot()
+
+@app.get("/workers")
+async def worker_stats():
+    # Answers for whichever worker the connection landed on.
+    return {"worker": app.state.leader.snapshot(), "bus": bus.channel.snapshot(), "idempotency": idempotency.store.snapshot()}
+
+@app.get("/idfilters")
+async def idfilter_stats():
+    return {"own": idfilter.owned.snapshot(), "peers": {peer: f.snapshot() for peer, f in idfilter.peers.items()}}
+
+@app.post("/admin/snapshot", status_code=status.HTTP_201_CREATED)
+def take_snapshot(x_admin_token: Optional[str] = Header(None)):
+    snapshot.authorize(x_admin_token)
+    try:
+        return snapshot.create()
+    except snapshot.SnapshotBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except snapshot.SnapshotError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 # ---- CRUD
 @app.post("/suppliers", response_model=SupplierOut, status_code=status.HTTP_201_CREATED)
@@ -40,12 +119,66 @@ def create_supplier(payload: SupplierCreate, db: Session = Depends(get_db)):
     return created
 
 @app.get("/suppliers", response_model=list[SupplierOut])
-def list_suppliers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.list_all(db, skip=skip, limit=limit)
+def list_suppliers(skip: int = 0, limit: int = 100, fields: Optional[str] = None):
+    names = sparse.parse(fields, SupplierOut)
+    if names:
+        return JSONResponse(coalesce.read(
+            ("suppliers", skip, limit, names),
+            lambda db: sparse.dump_all(SupplierOut, names, crud.list_all(db, skip=skip, limit=limit, fields=names)),
+        ))
+    return coalesce.read(
+        ("suppliers", skip, limit),
+        lambda db: [SupplierOut.model_validate(x) for x in crud.list_all(db, skip=skip, limit=limit)],
+    )
+
+@app.delete("/suppliers", response_model=BulkDeleteOut, status_code=status.HTTP_202_ACCEPTED)
+def bulk_delete_suppliers(payload: SupplierBulkDelete, response: Response, db: Session = Depends(get_db)):
+    objs, missing = crud.select_for_delete(db, payload)
+    job = crud.delete_many(db, objs)
+    if job is not None:
+        response.headers["Location"] = f"/jobs/{job.id}"
+    return BulkDeleteOut(deleted=len(objs), missing=missing, job_id=job.id if job else None)
+
+@app.post("/suppliers/bulk-unlink", response_model=BulkUnlinkOut)
+def bulk_unlink_products(payload: BulkUnlink, db: Session = Depends(get_db)):
+    # Product's delete cascade: many (supplier, product) pairs per call.
+    return BulkUnlinkOut(applied=crud.bulk_unlink(db, payload.pairs))
+
+@app.get("/suppliers/idfilter")
+def supplier_idfilter(if_none_match: Optional[str] = Header(None)):
+    # Bloom filter of every supplier id; peers cache it to reject links to missing ids (see idfilter.py).
+    etag, bloom = idfilter.owned.current()
+    headers = {
+        "ETag": etag, "Cache-Control": "no-cache",
+        "X-Filter-Bits": str(bloom.bits), "X-Filter-Hashes": str(bloom.hashes), "X-Filter-Ids": str(bloom.count),
+    }
+    if if_none_match == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(bytes(bloom.data), media_type="application/octet-stream", headers=headers)
+
+@app.get("/suppliers/changes")
+def supplier_changes(since: int = 0, limit: int = Query(500, ge=1, le=5000), db: Session = Depends(get_db)):
+    return changes.read_since(db, since, limit)
+
+@app.get("/suppliers/stream")
+async def supplier_stream(
+    since: Optional[int] = None,
+    id: Optional[str] = None,
+    related: Optional[str] = None,
+    ops: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+):
+    return events.open_stream(last_event_id, since, id, related, ops)
 
 @app.get("/suppliers/{supplier_id}", response_model=SupplierOut)
-def read_supplier(supplier_id: str, db: Session = Depends(get_db)):
-    return crud.get(db, supplier_id)
+def read_supplier(supplier_id: str, fields: Optional[str] = None):
+    names = sparse.parse(fields, SupplierOut)
+    if names:
+        return JSONResponse(coalesce.read(
+            ("supplier", supplier_id, names),
+            lambda db: sparse.dump(SupplierOut, names, crud.get(db, supplier_id, fields=names)),
+        ))
+    return coalesce.read(("supplier", supplier_id), lambda db: SupplierOut.model_validate(crud.get(db, supplier_id)))
 
 @app.put("/suppliers/{supplier_id}", response_model=SupplierOut)
 def put_supplier(supplier_id: str, payload: SupplierUpdate, db: Session = Depends(get_db)):
@@ -67,11 +200,8 @@ def patch_supplier(supplier_id: str, payload: SupplierUpdate, db: Session = Depe
 
 @app.delete("/suppliers/{supplier_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_supplier(supplier_id: str, db: Session = Depends(get_db)):
-    existing = crud.get(db, supplier_id)
-    prod_ids = list(existing.product_ids or [])
+    # Products are unlinked by a background job (see jobs.py), not before this returns.
     crud.delete(db, supplier_id)
-    if prod_ids:
-        sync_remove_supplier_from_products(supplier_id, prod_ids)
     return None
 
 # ---- Relationship endpoints (used by Product service & optionally clients)
@@ -85,3 +215,12 @@ def link_product(supplier_id: str, op: LinkProductOp, db: Session = Depends(get_
 def unlink_product(supplier_id: str, product_id: str, db: Session = Depends(get_db)):
     sup = crud.remove_product(db, supplier_id, product_id)
     return sup
+
+# ---- Background jobs
+@app.get("/jobs/{job_id}", response_model=JobOut)
+def read_job(job_id: str, db: Session = Depends(get_db)):
+    return jobs.out(jobs.get(db, job_id))
+
+@app.post("/jobs/{job_id}/retry", response_model=JobOut)
+def retry_job(job_id: str, db: Session = Depends(get_db)):
+    return jobs.out(jobs.retry(db, job_id))
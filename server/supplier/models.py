@@ -1,12 +1,72 @@
-from sqlalchemy import Column, String
+from sqlalchemy import Column, String, Integer, DateTime, Index, LargeBinary
 from sqlalchemy.types import JSON
 from database import Base
+from idtypes import UUIDBytes, UUIDList
 
-# Supplier table per spec. product_ids are stored as JSON array of UUID strings.
+# Id columns use idtypes: 36-char strings, or 16-byte blobs with ID_STORAGE=binary.
+# Supplier table per spec. product_ids are stored as a list of UUIDs.
 class Supplier(Base):
     __tablename__ = "suppliers"
 
-    id = Column(String(36), primary_key=True, index=True)      # UUID
+    id = Column(UUIDBytes(), primary_key=True, index=True)     # UUID
     name = Column(String(2000), nullable=False)                # <= 2000
     contact = Column(String(320), nullable=False)              # Email (validated in schema)
-    product_ids = Column(JSON, nullable=False, default=list)   # list[str]
+    product_ids = Column(UUIDList(), nullable=False, default=list)  # list[str]
+
+# Append-only change feed (see changes.py). AUTOINCREMENT keeps seq monotonic across compaction.
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    entity_id = Column(UUIDBytes(), nullable=False, index=True)
+    op = Column(String(16), nullable=False)                    # create|update|delete|link|unlink
+    relation = Column(String(16), nullable=True)               # "products" for link ops
+    ref_id = Column(UUIDBytes(), nullable=True)                # linked id for link ops
+    data = Column(JSON, nullable=True)                         # row snapshot after the change
+    created_at = Column(DateTime, nullable=False, index=True)
+
+class ChangeLogMeta(Base):
+    __tablename__ = "change_log_meta"
+
+    key = Column(String(32), primary_key=True)
+    value = Column(Integer, nullable=False)
+
+# Background jobs (see jobs.py). A bulk delete queues the peer unlinks it causes as tasks in its own
+# transaction; the runner sends them in batches and deletes each task once the peer has applied it.
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String(36), primary_key=True)                  # UUID, returned as job_id
+    kind = Column(String(32), nullable=False)                  # delete_cascade
+    status = Column(String(16), nullable=False, index=True)    # pending|running|done|failed
+    total = Column(Integer, nullable=False)                    # tasks queued
+    done = Column(Integer, nullable=False, default=0)          # tasks the peers have applied
+    attempts = Column(Integer, nullable=False, default=0)      # consecutive failed batches
+    last_error = Column(String(2000), nullable=True)
+    next_run_at = Column(DateTime, nullable=True)              # retry backoff after a failed batch
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+class JobTask(Base):
+    __tablename__ = "job_tasks"
+    __table_args__ = (Index("ix_job_tasks_job_seq", "job_id", "seq"),)
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String(36), nullable=False)
+    peer = Column(String(16), nullable=False)                  # key of sync.PEERS
+    relation = Column(String(16), nullable=True)               # list on the peer row, for peers with several
+    owner_id = Column(UUIDBytes(), nullable=False)             # peer row to unlink from
+    ref_id = Column(UUIDBytes(), nullable=False)               # deleted id to drop from it
+
+# Idempotency-Key records shared by worker processes (idempotency.SharedStore); unused with WORKERS=1.
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(64), primary_key=True)                 # sha256 of method, path and Idempotency-Key
+    fingerprint = Column(String(64), nullable=False)           # sha256 of query string and body
+    token = Column(String(32), nullable=False)                 # the claim; a takeover replaces it
+    status = Column(Integer, nullable=True)                    # NULL while the first request runs
+    headers = Column(JSON, nullable=True)                      # [[name, value], ...]
+    body = Column(LargeBinary, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)  # claim lease, then the replay TTL
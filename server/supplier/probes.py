@@ -0,0 +1,67 @@
+import logging
+import time
+from typing import Dict, Tuple
+
+from sqlalchemy import text
+
+from config import settings
+from database import engine
+import idtypes
+import migrate
+import sync
+
+log = logging.getLogger("supplier.probes")
+
+class Startup:
+    def __init__(self):
+        self.ready = False
+        self.timings: Dict[str, float] = {}
+
+    def mark_ready(self, import_started: float, warmup_started: float) -> None:
+        now = time.perf_counter()
+        self.timings = {
+            "import_ms": round((warmup_started - import_started) * 1000, 1),
+            "warmup_ms": round((now - warmup_started) * 1000, 1),
+            "total_ms": round((now - import_started) * 1000, 1),
+        }
+        self.ready = True
+        log.info("Ready in %(total_ms).0f ms (import %(import_ms).0f ms, warm-up %(warmup_ms).0f ms)", self.timings)
+
+startup = Startup()
+
+def require_schema() -> None:
+    """Refuse to start against a database `migrate.py` has not brought up to date, or whose ids are stored the other way."""
+    with engine.connect() as conn:
+        version = migrate.current_version(conn)
+        if version < migrate.LATEST:
+            raise RuntimeError(f"Database schema is at version {version}, expected {migrate.LATEST}; run `python migrate.py`")
+        mode = idtypes.stored_mode(conn, "suppliers")
+    if mode and mode != settings.ID_STORAGE:
+        raise RuntimeError(f"Ids are stored as {mode} but ID_STORAGE={settings.ID_STORAGE}; run `python convert_ids.py`")
+
+def _check_database() -> dict:
+    started = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            version = migrate.current_version(conn)
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+    return {
+        "ok": version >= migrate.LATEST,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        "schema_version": version,
+        "schema_expected": migrate.LATEST,
+    }
+
+def readiness() -> Tuple[bool, dict]:
+    """Ready once startup finished, the database answers at the expected schema version and (optionally) peers are reachable."""
+    db = _check_database()
+    peers = {name: b.snapshot() for name, b in sync.breakers.items()}
+    peers_ok = all(p["state"] != "open" for p in peers.values())
+    ok = startup.ready and db["ok"] and (peers_ok or not settings.READYZ_REQUIRE_PEERS)
+    return ok, {
+        "status": "ready" if ok else "not_ready",
+        "checks": {"startup": startup.ready, "database": db, "peers": peers},
+        "startup": startup.timings,
+    }
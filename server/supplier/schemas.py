@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import List, Optional, Annotated
 from pydantic import BaseModel, EmailStr, Field
 
@@ -19,6 +20,38 @@ class SupplierUpdate(BaseModel):
 class LinkProductOp(BaseModel):
     product_id: str
 
+class SupplierBulkDelete(BaseModel):
+    ids: Optional[List[str]] = None
+    product_id: Optional[str] = None   # filter: every supplier linked to this product
+
+class BulkDeleteOut(BaseModel):
+    deleted: int
+    missing: List[str] = Field(default_factory=list)  # requested ids that did not exist
+    job_id: Optional[str] = None                      # product unlinks still being sent (GET /jobs/{job_id})
+
+class UnlinkPair(BaseModel):
+    id: str       # supplier
+    ref_id: str   # product to drop from its product_ids
+
+class BulkUnlink(BaseModel):
+    relation: Optional[str] = None
+    pairs: List[UnlinkPair]
+
+class BulkUnlinkOut(BaseModel):
+    applied: int   # pairs naming an existing supplier (already unlinked ones included)
+
+class JobOut(BaseModel):
+    id: str
+    kind: str
+    status: str    # pending|running|done|failed
+    total: int
+    done: int
+    pending: int
+    attempts: int
+    last_error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
 class SupplierOut(SupplierBase):
     id: str
 
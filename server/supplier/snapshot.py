@@ -0,0 +1,308 @@
+"""
+Online snapshots of the service database, and restore from one:
+
+    python snapshot.py create [--dir DIR]                       # what POST /admin/snapshot does
+    python snapshot.py restore DIR/<name>.json [--force] [--catch-up URL]
+    python snapshot.py catch-up URL                             # URL = a live copy's /suppliers
+
+A snapshot is copied with SQLite's backup API while the service keeps running, checked, gzipped and
+described by a manifest (<name>.json) that records the change log seq it contains. Restore (service
+stopped) checks the manifest, unpacks the file over DATABASE_URL at disk speed and applies any newer
+migrations. Catch-up then replays a live copy's change feed from that seq, so the restored database
+and its own feed continue in step with the source.
+"""
+import argparse
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from config import settings
+from database import SessionLocal, engine
+from models import ChangeLog, Supplier
+import changes
+import migrate
+import sync
+
+log = logging.getLogger("supplier.snapshot")
+
+SERVICE = "supplier"
+CATCH_UP_PAGE = 5000
+_running = threading.Lock()
+
+class SnapshotError(Exception):
+    pass
+
+class SnapshotBusy(SnapshotError):
+    pass
+
+class _Restarted(Exception):
+    pass
+
+def _databases() -> List[Tuple[str, str]]:
+    """(shard, file) of every database the service writes."""
+    path = engine.url.database
+    if engine.url.get_backend_name() != "sqlite" or not path or path == ":memory:":
+        raise SnapshotError("Snapshots need a file-backed SQLite DATABASE_URL")
+    return [("0", path)]
+
+def authorize(token: Optional[str]) -> None:
+    if not settings.SNAPSHOT_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Snapshots over HTTP are off (SNAPSHOT_TOKEN is empty)")
+    if token is None or not hmac.compare_digest(token.encode(), settings.SNAPSHOT_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid X-Admin-Token")
+
+# ---- Create
+def _backup(src_path: str, dest_path: str) -> int:
+    """
+    Copy `src_path` to `dest_path` in steps of SNAPSHOT_STEP_PAGES pages, pausing between steps. A write
+    by another connection restarts the copy; after SNAPSHOT_MAX_RESTARTS it is finished in one step,
+    which under WAL only holds a read snapshot, so writers still carry on. Returns the restart count.
+    """
+    restarts, last = 0, None
+
+    def progress(_status: int, remaining: int, _total: int) -> None:
+        nonlocal restarts, last
+        if last is not None and remaining > last:
+            restarts += 1
+            if restarts > settings.SNAPSHOT_MAX_RESTARTS:
+                raise _Restarted()
+        last = remaining
+        if settings.SNAPSHOT_STEP_SLEEP_MS > 0:
+            time.sleep(settings.SNAPSHOT_STEP_SLEEP_MS / 1000)
+
+    src = sqlite3.connect(src_path, timeout=settings.DB_BUSY_TIMEOUT_MS / 1000)
+    try:
+        if settings.SNAPSHOT_STEP_PAGES > 0:
+            dest = sqlite3.connect(dest_path)
+            try:
+                src.backup(dest, pages=settings.SNAPSHOT_STEP_PAGES, progress=progress)
+                return restarts
+            except _Restarted:
+                log.info("Snapshot of %s restarted %d times under writes; finishing in one step", src_path, restarts - 1)
+            finally:
+                dest.close()
+        dest = sqlite3.connect(dest_path)
+        try:
+            src.backup(dest)
+        finally:
+            dest.close()
+        return restarts
+    finally:
+        src.close()
+
+def _position(path: str) -> dict:
+    """What the copy at `path` holds: its newest change seq, compaction horizon and schema version."""
+    conn = sqlite3.connect(path)
+    try:
+        check = conn.execute("PRAGMA quick_check").fetchone()[0]
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+        horizon = conn.execute("SELECT value FROM change_log_meta WHERE key = ?", (changes.HORIZON_KEY,)).fetchone()
+        version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").fetchone()[0]
+    finally:
+        conn.close()
+    if check != "ok":
+        raise SnapshotError(f"Snapshot copy failed quick_check: {check}")
+    return {"seq": seq, "horizon": horizon[0] if horizon else 0, "schema_version": version}
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _compress(src: str, dest: str) -> None:
+    with open(src, "rb") as raw, open(dest + ".tmp", "wb") as out:
+        with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=settings.SNAPSHOT_GZIP_LEVEL) as packed:
+            shutil.copyfileobj(raw, packed, 1 << 20)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(dest + ".tmp", dest)
+
+def _write_json(path: str, data: dict) -> None:
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+def _prune(directory: str) -> None:
+    if settings.SNAPSHOT_KEEP <= 0:
+        return
+    manifests = sorted(n for n in os.listdir(directory) if n.startswith(f"{SERVICE}-") and n.endswith(".json"))
+    for name in manifests[:-settings.SNAPSHOT_KEEP]:
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as f:
+                files = [entry["file"] for entry in json.load(f)["files"]]
+        except (OSError, ValueError, KeyError):
+            continue
+        for file in files + [name]:
+            try:
+                os.unlink(os.path.join(directory, file))
+            except FileNotFoundError:
+                pass
+
+def create(directory: Optional[str] = None) -> dict:
+    """Take a snapshot into `directory` (SNAPSHOT_DIR) and return its manifest. One at a time per process."""
+    directory = directory or settings.SNAPSHOT_DIR
+    if not _running.acquire(blocking=False):
+        raise SnapshotBusy("A snapshot is already running")
+    try:
+        started = time.perf_counter()
+        os.makedirs(directory, exist_ok=True)
+        name = f"{SERVICE}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%fZ}"
+        files = []
+        for shard, path in _databases():
+            raw = os.path.join(directory, f".{name}-{shard}.db")
+            try:
+                restarts = _backup(path, raw)
+                position = _position(raw)
+                file = f"{name}.db.gz"
+                _compress(raw, os.path.join(directory, file))
+                files.append({
+                    "shard": shard, "file": file, "sha256": _sha256(os.path.join(directory, file)),
+                    "bytes": os.path.getsize(os.path.join(directory, file)), "db_bytes": os.path.getsize(raw),
+                    "restarts": restarts, **position,
+                })
+            finally:
+                if os.path.exists(raw):
+                    os.unlink(raw)
+        manifest = {
+            "service": SERVICE,
+            "name": name,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "id_storage": settings.ID_STORAGE,
+            "schema_version": min(f["schema_version"] for f in files),
+            "cursor": files[0]["seq"],             # pass as `since` to GET /suppliers/changes
+            "files": files,
+            "took_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        _write_json(os.path.join(directory, name + ".json"), manifest)
+        _prune(directory)
+        log.info("Snapshot %s at seq %s (%d bytes) in %.0f ms", name, manifest["cursor"], files[0]["bytes"], manifest["took_ms"])
+        return manifest
+    finally:
+        _running.release()
+
+# ---- Restore
+def restore(manifest_path: str, force: bool = False) -> dict:
+    """
+    Replace the database with the snapshot described by `manifest_path`. The service must be stopped.
+    Everything is checked (service, id storage, schema, checksums) before any file is touched.
+    """
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("service") != SERVICE:
+        raise SnapshotError(f"{manifest_path} is a {manifest.get('service')} snapshot, not {SERVICE}")
+    if manifest["id_storage"] != settings.ID_STORAGE:
+        raise SnapshotError(f"Snapshot stores {manifest['id_storage']} ids but ID_STORAGE={settings.ID_STORAGE}")
+    if manifest["schema_version"] > migrate.LATEST:
+        raise SnapshotError(f"Snapshot schema {manifest['schema_version']} is newer than this code ({migrate.LATEST})")
+    directory = os.path.dirname(os.path.abspath(manifest_path))
+    targets = dict(_databases())
+    if sorted(f["shard"] for f in manifest["files"]) != sorted(targets):
+        raise SnapshotError(f"Snapshot has shards {[f['shard'] for f in manifest['files']]}, this service {sorted(targets)}")
+    for f in manifest["files"]:
+        if _sha256(os.path.join(directory, f["file"])) != f["sha256"]:
+            raise SnapshotError(f"Checksum mismatch for {f['file']}")
+        target = targets[f["shard"]]
+        if not force and os.path.exists(target) and os.path.getsize(target) > 0:
+            raise SnapshotError(f"{target} exists; stop the service and pass --force to replace it")
+    engine.dispose()
+    for f in manifest["files"]:
+        target = targets[f["shard"]]
+        with gzip.open(os.path.join(directory, f["file"]), "rb") as packed, open(target + ".restoring", "wb") as out:
+            shutil.copyfileobj(packed, out, 1 << 20)
+            out.flush()
+            os.fsync(out.fileno())
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(target + suffix):
+                os.unlink(target + suffix)
+        os.replace(target + ".restoring", target)
+    applied = migrate.upgrade()
+    log.info("Restored %s (seq %s); migrations applied: %s", manifest["name"], manifest["cursor"], applied or "none")
+    return {"restored": manifest["name"], "cursor": manifest["cursor"], "migrations": applied}
+
+def _apply(db, entry: dict) -> None:
+    """One feed entry: the row is upserted from the entry's snapshot (or deleted) and the entry kept with its seq."""
+    obj = db.get(Supplier, entry["id"])
+    if entry["op"] == "delete":
+        if obj is not None:
+            db.delete(obj)
+    elif entry["data"] is not None:
+        if obj is None:
+            obj = Supplier(id=entry["id"])
+            db.add(obj)
+        for column in Supplier.__table__.columns:
+            if column.key != "id" and column.key in entry["data"]:
+                setattr(obj, column.key, entry["data"][column.key])
+    db.add(ChangeLog(
+        seq=entry["seq"], entity_id=entry["id"], op=entry["op"], relation=entry["relation"], ref_id=entry["ref_id"],
+        data=entry["data"], created_at=datetime.fromisoformat(entry["at"].rstrip("Z")),
+    ))
+    db.flush()
+
+def catch_up(base_url: str) -> int:
+    """
+    Replay the change feed of a live copy (`base_url` is its /suppliers) from the newest seq this database
+    holds. Entries keep their seq, so re-running continues where the last run stopped. Returns entries applied.
+    """
+    with SessionLocal() as db:
+        cursor = changes.latest_seq(db)
+    applied = 0
+    while True:
+        resp = sync.http().get(f"{base_url.rstrip('/')}/changes", params={"since": cursor, "limit": CATCH_UP_PAGE},
+                               timeout=settings.HTTP_TIMEOUT)
+        if resp.status_code == status.HTTP_410_GONE:
+            raise SnapshotError(f"The source compacted its feed past seq {cursor}; restore a newer snapshot")
+        resp.raise_for_status()
+        page = resp.json()
+        with SessionLocal() as db:
+            for entry in page["changes"]:
+                _apply(db, entry)
+            db.commit()
+        applied += len(page["changes"])
+        cursor = page["next"]
+        if not page["has_more"]:
+            break
+    log.info("Caught up %d changes from %s (now at seq %s)", applied, base_url, cursor)
+    return applied
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Online snapshots and restore of the supplier database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    take = commands.add_parser("create")
+    take.add_argument("--dir", default=settings.SNAPSHOT_DIR)
+    back = commands.add_parser("restore")
+    back.add_argument("manifest")
+    back.add_argument("--force", action="store_true", help="replace an existing database file")
+    back.add_argument("--catch-up", metavar="URL", help="then replay this live copy's change feed")
+    follow = commands.add_parser("catch-up")
+    follow.add_argument("url")
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "create":
+            print(json.dumps(create(args.dir), indent=1))
+        elif args.command == "restore":
+            print(json.dumps(restore(args.manifest, args.force)))
+            if args.catch_up:
+                print(f"caught_up={catch_up(args.catch_up)}")
+        else:
+            print(f"caught_up={catch_up(args.url)}")
+    except SnapshotError as e:
+        sys.exit(f"error: {e}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])